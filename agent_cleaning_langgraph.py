@@ -1,4 +1,6 @@
 from typing import TypedDict, Any
+import numpy as np
+import pandas as pd
 from langgraph.graph import StateGraph, END
 
 # Define Agent State
@@ -88,6 +90,122 @@ def run_cleaning_agent(invoice_data):
     result = cleaning_graph.invoke(initial_state)
     return result
 
+# -------- Batch Mode --------
+# The same three rules applied column-wise. Each row of the result matches what
+# run_cleaning_agent returns for that row as a dict, with NaN meaning "key absent".
+
+REQUIRED_FIELDS = ["invoice_no", "total_amount", "items"]
+AMOUNT_TOLERANCE = 1.0
+
+def _is_falsy(value):
+    try:
+        return not value
+    except Exception:
+        # e.g. arrays, whose truth value is ambiguous; the graph would raise here too
+        return False
+
+def _missing_mask(df, field):
+    if field not in df.columns:
+        return np.ones(len(df), dtype=bool)
+    col = df[field]
+    missing = col.isna().to_numpy()
+    if pd.api.types.is_numeric_dtype(col):
+        return missing | (col == 0).to_numpy()
+    return missing | col.map(_is_falsy).to_numpy(dtype=bool)
+
+def _items_total(items):
+    try:
+        return sum(item.get("amount", 0) for item in items), None
+    except Exception as e:
+        return None, f"Amount validation error: {str(e)}"
+
+def _amount_log(items_total, invoice_total):
+    # Scalar form of the check, for rows whose types fall off the vectorized path
+    try:
+        if abs(items_total - invoice_total) > AMOUNT_TOLERANCE:
+            return f"Amount mismatch warning: Items({items_total}) != Total({invoice_total})"
+        return "Amount validation passed."
+    except Exception as e:
+        return f"Amount validation error: {str(e)}"
+
+def _state_values(df, field, rows):
+    if field not in df.columns:
+        return np.full(len(rows), "", dtype=object)
+    # .str.lower() would quietly turn a non-string into NaN where the graph raises; keep it loud
+    return df[field].iloc[rows].fillna("").map(str.lower).to_numpy()
+
+def run_cleaning_batch(df):
+    """
+    Vectorized equivalent of run_cleaning_agent over a DataFrame of invoices.
+    Returns a DataFrame (same index) with is_valid, error, logs and transaction_type.
+    """
+    n = len(df)
+    logs = [[] for _ in range(n)]
+
+    # Node 1: Validate Fields
+    missing = np.column_stack([_missing_mask(df, f) for f in REQUIRED_FIELDS]) if n else np.zeros((0, 3), dtype=bool)
+    is_valid = ~missing.any(axis=1)
+    error = np.full(n, "", dtype=object)
+    for pattern in np.unique(missing[~is_valid], axis=0):
+        rows = (missing == pattern).all(axis=1)
+        error[rows] = f"Missing fields: {[f for f, m in zip(REQUIRED_FIELDS, pattern) if m]}"
+    field_log = np.where(is_valid, "Field validation passed.", "Field validation failed.").tolist()
+
+    valid_idx = np.flatnonzero(is_valid)
+
+    # Node 2: Validate Amounts (valid rows only)
+    amount_log = np.full(n, None, dtype=object)
+    if len(valid_idx):
+        items = df["items"].to_numpy()[valid_idx]
+        totals_raw = df["total_amount"].to_numpy()[valid_idx]
+        sums = [_items_total(it) for it in items]
+        items_total = [t for t, _ in sums]
+
+        numeric = np.array([
+            err is None and isinstance(t, (int, float)) and isinstance(tot, (int, float, np.number))
+            for (t, err), tot in zip(sums, totals_raw)
+        ], dtype=bool)
+
+        # Fast path: one array subtraction for every well-typed row
+        fast = np.flatnonzero(numeric)
+        diff = np.abs(np.array([items_total[i] for i in fast], dtype=np.float64) -
+                      totals_raw[fast].astype(np.float64))
+        mismatch = diff > AMOUNT_TOLERANCE
+        amount_log[valid_idx[fast]] = "Amount validation passed."
+        for i in fast[mismatch]:
+            amount_log[valid_idx[i]] = (f"Amount mismatch warning: Items({items_total[i]}) "
+                                        f"!= Total({totals_raw[i]})")
+
+        # Slow path: errors and odd types get the scalar rule
+        for i in np.flatnonzero(~numeric):
+            t, err = sums[i]
+            amount_log[valid_idx[i]] = err if err is not None else _amount_log(t, totals_raw[i])
+
+    # Node 3: Normalize & Infer State (valid rows only)
+    transaction_type = np.full(n, None, dtype=object)
+    if len(valid_idx):
+        supplier = _state_values(df, "supplier_state", valid_idx)
+        buyer = _state_values(df, "buyer_state", valid_idx)
+        known = (supplier != "") & (buyer != "")
+        transaction_type[valid_idx] = np.where(
+            known, np.where(supplier == buyer, "Intra-state", "Inter-state"), "Unknown"
+        ).tolist()
+
+    for i in range(n):
+        logs[i].append(field_log[i])
+    for i in valid_idx:
+        logs[i].append(amount_log[i])
+        logs[i].append(f"Normalized transaction type: {transaction_type[i]}")
+
+    result = pd.DataFrame({
+        "is_valid": is_valid,
+        "error": error,
+        "logs": logs
+    }, index=df.index)
+    # Assigned as an object Series so invalid rows keep None rather than becoming NaN
+    result["transaction_type"] = pd.Series(transaction_type, index=df.index, dtype=object)
+    return result
+
 if __name__ == "__main__":
     # Test
     sample_invoice = {
@@ -1,120 +1,271 @@
 import json
 import numpy as np
 import os
-import requests
-import google.generativeai as genai
-from sentence_transformers import SentenceTransformer
+import threading
+import time
 from dotenv import load_dotenv
+import tracing
+from vector_store import get_vector_store
+from embedding import QueryEmbedder
+from embedding_models import get_embedding_model
+from response_cache import ResponseCache, make_key
+from agent_state import load_state, save_state, forget_state
+
+# The embedding backend (sentence_transformers or onnxruntime) and google.generativeai take
+# seconds to import; both are imported on first use so SQL-only callers never pay for them.
 
 # Load environment variables
 load_dotenv()
 
 # --- USER CONFIGURATION ---
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-PINECONE_KEY = os.getenv("PINECONE_API_KEY")
-INDEX_NAME = os.getenv("INDEX_NAME", "gst-rules-index")
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "2"))                      # rule chunks per answer
+RECEIPT_NAMESPACE = os.getenv("RECEIPT_NAMESPACE", "receipts")   # written by index_receipts.py
+RECEIPT_TOP_K = int(os.getenv("RECEIPT_TOP_K", "5"))              # receipts listed per search
 # -------------------------
 
-MODEL_NAME = "all-MiniLM-L6-v2"
+LLM_STATE_KEY = "gemini_model"
+
+# Bump when a prompt below changes so cached responses from the old wording are not reused
+FORMAT_PROMPT_VERSION = "format-v1"
+ANSWER_PROMPT_VERSION = "answer-v1"
 
 class GSTRagAgent:
-    def __init__(self):
-        print("Initializing RAG Agent (Pinecone REST)...")
-        self.model = SentenceTransformer(MODEL_NAME)
-        
-        # Get Pinecone Host
-        self.pinecone_host = None
-        try:
-            headers = {"Api-Key": PINECONE_KEY}
-            resp = requests.get(f"https://api.pinecone.io/indexes/{INDEX_NAME}", headers=headers)
-            if resp.status_code == 200:
-                self.pinecone_host = resp.json()['host']
-                print(f"✅ Connected to Pinecone Index: {self.pinecone_host}")
-            else:
-                print(f"❌ Failed to find Pinecone Index '{INDEX_NAME}'. Run setup first.")
-        except Exception as e:
-            print(f"Error connecting to Pinecone: {e}")
+    def __init__(self, vector_backend=None):
+        print("Initializing RAG Agent...")
+        # Embedder and LLM are created on first use (see the properties below)
+        self._model = None
+        self._embedder = None
+        self._llm_model = None
+        self._llm_available = None
+        self._init_lock = threading.RLock()
+
+        # Vector store: Pinecone REST or the local memory-mapped index (see VECTOR_BACKEND).
+        # The Pinecone host lookup itself is deferred to the first query.
+        self.vector_store = get_vector_store(vector_backend)
+        self._receipt_store = None
+
+        # LLM response cache (memory LRU + SQLite), cleared by setup_vector_db on re-index
+        self.response_cache = ResponseCache()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._init_lock:
+                if self._model is None:
+                    # PyTorch or int8 ONNX Runtime, see EMBED_BACKEND
+                    self._model = get_embedding_model()
+        return self._model
 
+    @property
+    def receipt_store(self):
+        """Receipt chunks (index_receipts.py) in their own namespace of the same index."""
+        if self._receipt_store is None:
+            with self._init_lock:
+                if self._receipt_store is None:
+                    self._receipt_store = self.vector_store.for_namespace(RECEIPT_NAMESPACE)
+        return self._receipt_store
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            with self._init_lock:
+                if self._embedder is None:
+                    self._embedder = QueryEmbedder(self.model)
+        return self._embedder
+
+    @property
+    def embedder_loaded(self):
+        return self._embedder is not None
+
+    @property
+    def llm_model(self):
+        self._ensure_llm()
+        return self._llm_model
+
+    @property
+    def llm_available(self):
+        self._ensure_llm()
+        return self._llm_available
+
+    def _ensure_llm(self):
+        if self._llm_available is not None:
+            return
+        with self._init_lock:
+            if self._llm_available is None:
+                self._llm_model = self._connect_llm()
+                self._llm_available = self._llm_model is not None
+
+    def _connect_llm(self):
         # Configure Gemini
-        self.llm_model = None
-        if GEMINI_API_KEY and len(GEMINI_API_KEY) > 20:
-            genai.configure(api_key=GEMINI_API_KEY)
-            self.llm_available = True
+        if not (GEMINI_API_KEY and len(GEMINI_API_KEY) > 20):
+            print("Warning: No API Key set. Using simulated responses.")
+            return None
+
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+
+        # Reuse the model that worked last time instead of probing the whole list
+        cached_name = load_state(LLM_STATE_KEY)
+        if cached_name:
+            print(f"✅ Using LLM: {cached_name} (cached selection)")
+            return genai.GenerativeModel(cached_name)
+
+        # Dynamic Model Selection
+        print("Searching for available Gemini models...")
+        try:
+            all_models = [m for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+            
+            # Filter out image generation models
+            text_models = [m for m in all_models if 'image' not in m.name.lower()]
             
-            # Dynamic Model Selection
-            print("Searching for available Gemini models...")
+            # Prioritize flash models for speed, then pro
+            text_models.sort(key=lambda x: (
+                'flash' in x.name.lower(),
+                '2.0' in x.name or '2.5' in x.name,
+                'pro' in x.name.lower()
+            ), reverse=True)
+
+            for m in text_models:
+                try:
+                    print(f"Testing: {m.name}")
+                    test_model = genai.GenerativeModel(m.name)
+                    test_model.generate_content("Hi")
+                    print(f"✅ Connected to LLM: {m.name}")
+                    save_state(LLM_STATE_KEY, m.name)
+                    return test_model
+                except Exception as e:
+                    print(f"   ❌ Failed: {str(e)[:50]}")
+                    continue
+            
+            print("❌ Warning: No working model found in your account quota.")
+                 
+        except Exception as e:
+            print(f"Error listing models: {e}")
+        return None
+
+    def _llm_failed(self):
+        # A cached model choice that stops working (quota, retirement) is re-probed next start
+        forget_state(LLM_STATE_KEY)
+
+    def warm_up(self, background=False):
+        """Loads the embedder, resolves the vector store and selects the LLM ahead of the first query."""
+        def _run():
             try:
-                found_model = None
-                
-                all_models = [m for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-                
-                # Filter out image generation models
-                text_models = [m for m in all_models if 'image' not in m.name.lower()]
-                
-                # Prioritize flash models for speed, then pro
-                text_models.sort(key=lambda x: (
-                    'flash' in x.name.lower(),
-                    '2.0' in x.name or '2.5' in x.name,
-                    'pro' in x.name.lower()
-                ), reverse=True)
-
-                for m in text_models:
-                    try:
-                        print(f"Testing: {m.name}")
-                        test_model = genai.GenerativeModel(m.name)
-                        test_model.generate_content("Hi")
-                        self.llm_model = test_model
-                        print(f"✅ Connected to LLM: {m.name}")
-                        found_model = m.name
-                        break
-                    except Exception as e:
-                        print(f"   ❌ Failed: {str(e)[:50]}")
-                        continue
-                
-                if not found_model:
-                     print("❌ Warning: No working model found in your account quota.")
-                     self.llm_available = False
-                     
+                self.embedder.embed("warm up")
+                self.vector_store.is_ready()
+                self._ensure_llm()
+                print("✅ RAG Agent warmed up.")
             except Exception as e:
-                print(f"Error listing models: {e}")
-                self.llm_available = False
-        else:
-            self.llm_available = False
-            print("Warning: No API Key set. Using simulated responses.")
+                print(f"Warm-up failed: {e}")
 
-    def retrieve_rules(self, query, top_k=2):
-        if not self.pinecone_host:
-            return ["Error: Pinecone not connected."]
+        if not background:
+            _run()
+            return None
+        thread = threading.Thread(target=_run, name="rag-warm-up", daemon=True)
+        thread.start()
+        return thread
 
-        # 1. Embed Query
-        query_embedding = self.model.encode([query])[0].tolist()
-        
-        # 2. Query Pinecone REST
-        url = f"https://{self.pinecone_host}/query"
-        headers = {
-            "Api-Key": PINECONE_KEY,
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "vector": query_embedding,
-            "topK": top_k,
-            "includeMetadata": True
-        }
+    def retrieve_rules(self, query, top_k=RAG_TOP_K, query_embedding=None, filters=None):
+        """Texts of the top_k rule chunks closest to the query; filters e.g. {"section": "e-way bill"}."""
+        if not self.vector_store.is_ready():
+            return [f"Error: {self.vector_store.name} not connected."]
+
+        # 1. Embed Query (LRU-cached, micro-batched with concurrent callers), unless the
+        #    caller already embedded it for routing
+        if query_embedding is None:
+            query_embedding = self.embedder.embed(query)
         
+        # 2. Query Vector Store
         try:
-            resp = requests.post(url, json=payload, headers=headers)
-            data = resp.json()
-            matches = data.get('matches', [])
-            
+            with tracing.span("vector_query", top_k=top_k, filter=",".join(sorted(filters or {}))) as attrs:
+                matches = self.vector_store.query(query_embedding, top_k=top_k, filter=filters)
+                attrs["matches"] = len(matches)
             results = [m['metadata']['text'] for m in matches if 'metadata' in m]
             return results
         except Exception as e:
-            return [f"Error querying Pinecone: {e}"]
+            return [f"Error querying {self.vector_store.name}: {e}"]
 
-    def format_with_llm(self, query, raw_data):
-        """Uses LLM to format raw data results into structured sentences."""
+    def search_receipts(self, query, top_k=RECEIPT_TOP_K, query_embedding=None, filters=None):
+        """
+        Receipts closest to the query in one vector query, best-scoring chunk per file:
+        [{"file", "score", "year", "country", "category", "invoice_id", "excerpt"}].
+        filters restricts the search to facets, e.g. {"year": [2019], "country": ["de"]}.
+        """
+        store = self.receipt_store
+        if not store.is_ready():
+            return {"error": f"receipts are not indexed in {store.name} (run python index_receipts.py)"}
+        if query_embedding is None:
+            query_embedding = self.embedder.embed(query)
+
+        try:
+            # Several chunks of one long receipt can rank together; over-fetch, then keep one per file
+            with tracing.span("vector_query", top_k=top_k, namespace=RECEIPT_NAMESPACE,
+                              filter=",".join(sorted(filters or {}))) as attrs:
+                matches = store.query(query_embedding, top_k=top_k * 4, filter=filters)
+                attrs["matches"] = len(matches)
+        except Exception as e:
+            return {"error": f"querying {store.name} failed: {e}"}
+
+        receipts = {}
+        for match in matches:
+            metadata = match.get("metadata", {})
+            if "file" in metadata and metadata["file"] not in receipts:
+                text = metadata.get("text", "")
+                receipts[metadata["file"]] = {
+                    "file": metadata["file"],
+                    "score": round(float(match.get("score", 0.0)), 4),
+                    "year": metadata.get("year"),
+                    "country": metadata.get("country"),
+                    "category": metadata.get("category"),
+                    "invoice_id": metadata.get("invoice_id"),
+                    # Chunk text minus the header line the indexer adds
+                    "excerpt": text.split("\n", 1)[-1][:160]
+                }
+        return list(receipts.values())[:top_k]
+
+    def _stream_llm(self, prompt, cache_key, on_error, cacheable=True):
+        """
+        Yields the response in chunks as Gemini produces them (generate_content(stream=True)).
+        A cached response comes back as a single chunk; a completed one is cached.
+        """
+        cached = self.response_cache.get(cache_key)
+        tracing.count("cache_lookups_total", cache="llm_response", result="miss" if cached is None else "hit")
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        tracing.observe_size("llm_prompt_chars", len(prompt))
+        try:
+            # The span includes the time the consumer spends between chunks
+            with tracing.span("llm") as attrs:
+                started = time.perf_counter()
+                for chunk in self.llm_model.generate_content(prompt, stream=True):
+                    text = chunk.text
+                    if not parts:
+                        text = text.lstrip()
+                    if not text:
+                        continue
+                    if not parts:
+                        attrs["first_chunk_ms"] = round(1000 * (time.perf_counter() - started), 3)
+                    parts.append(text)
+                    yield text
+                attrs["chunks"] = len(parts)
+        except Exception as e:
+            self._llm_failed()
+            yield ("\n" if parts else "") + on_error(e)
+            return
+        tracing.observe_size("llm_response_chars", sum(map(len, parts)))
+
+        if cacheable:
+            self.response_cache.put(cache_key, "".join(parts).strip())
+
+    def stream_format(self, query, raw_data):
+        """Streaming form of format_with_llm: yields text chunks."""
         if not self.llm_available:
-            return f"Raw Data: {raw_data}"
+            yield f"Raw Data: {raw_data}"
+            return
             
         prompt = f"""
         You are a GST Assistant. Convert the following RAW DATA into a professionally structured natural language sentence or paragraph.
@@ -132,15 +283,16 @@ class GSTRagAgent:
         FINAL SENTENCE:
         """
         
-        try:
-            response_obj = self.llm_model.generate_content(prompt)
-            return response_obj.text.strip()
-        except Exception as e:
-            return f"Error formatting response: {e}. Raw Data: {raw_data}"
+        cache_key = make_key(self.llm_model.model_name, FORMAT_PROMPT_VERSION, query,
+                             json.dumps(raw_data, sort_keys=True, default=str))
+        yield from self._stream_llm(prompt, cache_key,
+                                    on_error=lambda e: f"Error formatting response: {e}. Raw Data: {raw_data}")
 
-    def generate_answer(self, query):
-        # 1. Retrieve
-        rules = self.retrieve_rules(query)
+    def format_with_llm(self, query, raw_data):
+        """Uses LLM to format raw data results into structured sentences."""
+        return "".join(self.stream_format(query, raw_data)).strip()
+
+    def _stream_answer(self, query, rules):
         context = "\n\n".join(rules)
 
         # 2. Augment Prompt
@@ -158,16 +310,28 @@ class GSTRagAgent:
         ANSWER (Be concise and cite the specific rule/rate):
         """
 
-        # 3. Generate
+        # 3. Generate (or reuse the answer for the same question over the same rules)
         if self.llm_available:
-            try:
-                response_obj = self.llm_model.generate_content(prompt)
-                response = response_obj.text
-            except Exception as e:
-                response = f"Error generating content: {e}"
+            cache_key = make_key(self.llm_model.model_name, ANSWER_PROMPT_VERSION, query, rules)
+            # Don't pin an answer produced while retrieval was failing
+            yield from self._stream_llm(prompt, cache_key, on_error=lambda e: f"Error generating content: {e}",
+                                        cacheable=not any(r.startswith("Error") for r in rules))
         else:
-            # Fallback Mock
-            response = f"[Simulated LLM (No API Key)]: Based on the rules retrieved (e.g., '{rules[0][:30]}...'), here is the answer: [Please add API Key to see real answer]"
+            # Fallback Mock (facet filters can leave no rules at all)
+            if not rules:
+                yield "[Simulated LLM (No API Key)]: No rules matched this question. [Please add API Key to see real answer]"
+                return
+            yield f"[Simulated LLM (No API Key)]: Based on the rules retrieved (e.g., '{rules[0][:30]}...'), here is the answer: [Please add API Key to see real answer]"
+
+    def stream_answer(self, query, query_embedding=None, top_k=RAG_TOP_K, filters=None):
+        """Streaming form of generate_answer: retrieves, then yields answer text chunks."""
+        rules = self.retrieve_rules(query, top_k=top_k, query_embedding=query_embedding, filters=filters)
+        yield from self._stream_answer(query, rules)
+
+    def generate_answer(self, query, query_embedding=None, top_k=RAG_TOP_K, filters=None):
+        # 1. Retrieve
+        rules = self.retrieve_rules(query, top_k=top_k, query_embedding=query_embedding, filters=filters)
+        response = "".join(self._stream_answer(query, rules))
         
         return {
             "query": query,
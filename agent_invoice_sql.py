@@ -1,11 +1,45 @@
-import psycopg2
+import os
+import queue
 import re
+import threading
+import time
+from collections import Counter
+import tracing
+import invoice_analytics
+from db import get_pool, get_db_connection  # get_db_connection re-exported for existing callers
 
 # -------- Step 2.2: Intent Classification --------
+# An aggregate question names what is summed; "intra-state vs inter-state supply" alone is a rules question
+AGGREGATE_WORDS = re.compile(r"\b(total|totals|sum|collected|liability|breakdown|summary|report|turnover|how much|"
+                             r"invoices|billed)\b")
+
+
+def classify_analytics_intent(query: str):
+    """Aggregate question over all invoices ("total tax collected by state"), or None."""
+    q = query.lower()
+    if not AGGREGATE_WORDS.search(q):
+        return None
+    if re.search(r"\b(monthly|month[- ]?wise|(by|per|each) month)\b", q):
+        return "GET_MONTHLY_TAX"
+    if re.search(r"\b(state[- ]?wise|(by|per|each) state)\b", q):
+        return "GET_TAX_BY_STATE"
+    if re.search(r"\bsupply types?\b", q) or (re.search(r"\bintra[- ]?state\b", q)
+                                               and re.search(r"\binter[- ]?state\b", q)):
+        return "GET_SUPPLY_TYPE_SUMMARY"
+    # One supply type's share: "how much tax came from interstate supplies overall"
+    if re.search(r"\b(intra|inter)[- ]?state suppl(y|ies)\b", q) and re.search(r"\b(overall|came from|collected|totals?)\b", q):
+        return "GET_SUPPLY_TYPE_SUMMARY"
+    return None
+
+
 def classify_intent(query: str) -> str:
     q = query.lower()
 
-    if "interstate" in q:
+    analytics = classify_analytics_intent(q)
+    if analytics:
+        return analytics
+
+    if re.search(r"\binter[- ]?state\b", q):
         return "GET_INTERSTATE_INVOICES"
 
     if "total" in q and "invoice" in q:
@@ -38,32 +72,278 @@ SQL_TEMPLATES = {
         "SELECT * FROM invoices"
 }
 
+# Aggregates read invoice_daily_summary (invoice_analytics.py), which the ingesters keep
+# current, so they cost a scan of a few thousand summary rows however many invoices exist.
+# They are prepared on first use, after ensure_summary_table(), since PREPARE fails on a
+# table that doesn't exist yet.
+ANALYTICS_SQL_TEMPLATES = {
+    "GET_TAX_BY_STATE":
+        "SELECT supplier_state AS state, SUM(invoice_count) AS invoice_count, "
+        "SUM(total_amount) AS total_amount, SUM(tax_amount) AS tax_amount "
+        "FROM invoice_daily_summary WHERE supplier_state <> '' "
+        "GROUP BY supplier_state HAVING SUM(invoice_count) > 0 ORDER BY tax_amount DESC",
 
-import os
-from dotenv import load_dotenv
+    # IGST on inter-state supplies; CGST + SGST/UTGST on intra-state ones
+    "GET_MONTHLY_TAX":
+        "SELECT date_trunc('month', day)::date AS month, SUM(invoice_count) AS invoice_count, "
+        "COALESCE(SUM(tax_amount) FILTER (WHERE supply_type = 'inter-state'), 0) AS igst_amount, "
+        "COALESCE(SUM(tax_amount) FILTER (WHERE supply_type = 'intra-state'), 0) AS cgst_sgst_amount, "
+        "SUM(tax_amount) AS tax_amount "
+        "FROM invoice_daily_summary WHERE day <> 'infinity' "
+        "GROUP BY 1 HAVING SUM(invoice_count) > 0 ORDER BY 1",
+
+    "GET_SUPPLY_TYPE_SUMMARY":
+        "SELECT supply_type, SUM(invoice_count) AS invoice_count, "
+        "SUM(total_amount) AS total_amount, SUM(tax_amount) AS tax_amount "
+        "FROM invoice_daily_summary "
+        "GROUP BY supply_type HAVING SUM(invoice_count) > 0 ORDER BY supply_type"
+}
+
+# Batch variants: one round trip for a whole set of IDs (= ANY) or a numeric ID range.
+# invoice_id is VARCHAR, so the range form only casts IDs that are all digits.
+BATCH_SQL_TEMPLATES = {
+    "GET_INVOICE_BY_ID":
+        "SELECT * FROM invoices WHERE invoice_id = ANY(%s)",
+
+    "GET_TOTAL_AMOUNT":
+        "SELECT invoice_id, total_amount FROM invoices WHERE invoice_id = ANY(%s)",
+
+    "GET_TAX_AMOUNT":
+        "SELECT invoice_id, tax_amount FROM invoices WHERE invoice_id = ANY(%s)",
+
+    # Inputs of the batch GST calculator (gst_calculator.py)
+    "GET_TAX_BASIS":
+        "SELECT invoice_id, total_amount, tax_amount, supplier_state, buyer_state "
+        "FROM invoices WHERE invoice_id = ANY(%s)"
+}
+
+_NUMERIC_ID = "CASE WHEN invoice_id ~ '^[0-9]+$' THEN invoice_id::bigint END"
+RANGE_SQL_TEMPLATES = {
+    intent: sql.replace("invoice_id = ANY(%s)", f"{_NUMERIC_ID} BETWEEN %s AND %s")
+    for intent, sql in BATCH_SQL_TEMPLATES.items()
+}
+
+# Ranges up to this many IDs are expanded and go through = ANY (and the session map)
+RANGE_EXPAND_LIMIT = 1000
+
+# A number that isn't a percentage ("18% GST on invoice 101" names invoice 101, "18.5%" none)
+INVOICE_ID_PATTERN = r"\b(\d+)\b(?!(?:\.\d+)?\s*%)"
+RANGE_PATTERN = r"\b(\d+)\s*(?:-|–|to)\s*(\d+)\b"
+# Only numbers tied to an invoice count: "invoice 101", "invoice number 42", "#101", "id 7", and
+# a list or range right after one ("invoices 101, 102 and 105", "invoices 100 to 200"). Years
+# after "in"/"from"/"year" ("invoice 101 in 2023", "invoices from 2019 to 2021") never are.
+INVOICE_REFERENCE = re.compile(
+    r"(?:\binvoices?\b|\bids?\b|#)"
+    r"(?:\s*(?:number|no\.?|num|ids?|#|total (?:for|of)))*\s*"
+    r"(#?\d+(?:\s*(?:,\s*(?:and\s+)?|\band\b|&|-|–|\bto\b)\s*#?\d+)*)",
+    re.IGNORECASE
+)
+
+# Every template is PREPAREd once per pooled connection and run with EXECUTE
+db_pool = get_pool()
+for _intent, _sql in SQL_TEMPLATES.items():
+    db_pool.prepare(_intent.lower(), _sql)
+for _intent, _sql in BATCH_SQL_TEMPLATES.items():
+    db_pool.prepare(f"{_intent.lower()}_batch", _sql)
+for _intent, _sql in RANGE_SQL_TEMPLATES.items():
+    db_pool.prepare(f"{_intent.lower()}_range", _sql)
+
+
+# Set > 0 to coalesce concurrent single-invoice lookups from different threads (see server.py)
+SQL_BATCH_WINDOW_MS = float(os.getenv("SQL_BATCH_WINDOW_MS", "0"))
+SQL_MAX_BATCH = int(os.getenv("SQL_MAX_BATCH", "256"))
 
-# Load environment variables
-load_dotenv()
 
 # -------- Helpers --------
 def extract_invoice_id(query: str):
-    match = re.search(r"\b(\d+)\b", query)
-    return int(match.group(1)) if match else None
+    ids, _ = extract_invoice_ids(query)
+    return ids[0] if ids else None
+
+
+def extract_invoice_ids(query: str):
+    """
+    Parses every invoice ID the query names (see INVOICE_REFERENCE): lists ("invoices 101,
+    102 and 105") and ranges ("invoices 100-200", "100 to 200"). Returns (sorted unique IDs,
+    [(start, end), ...] ranges too large to expand).
+    """
+    ids = set()
+    ranges = []
+
+    for reference in INVOICE_REFERENCE.findall(query):
+        for start, end in re.findall(RANGE_PATTERN, reference):
+            start, end = sorted((int(start), int(end)))
+            if end - start < RANGE_EXPAND_LIMIT:
+                ids.update(range(start, end + 1))
+            else:
+                ranges.append((start, end))
+
+        remainder = re.sub(RANGE_PATTERN, " ", reference)
+        ids.update(int(m) for m in re.findall(INVOICE_ID_PATTERN, remainder))
+    return sorted(ids), ranges
+
 
+class InvoiceSession:
+    """Identity map for one request: each (intent, invoice_id) is fetched from the DB at most once."""
 
-def get_db_connection():
-    return psycopg2.connect(
-        dbname="gst_invoice_db",
-        user="postgres",
-        password=os.getenv("DB_PASSWORD"),
-        host="localhost",
-        port="5432"
-    )
+    def __init__(self):
+        self.rows = {}
+        self.db_round_trips = 0
+
+    def fetch(self, intent, ids):
+        ids = [str(i) for i in dict.fromkeys(ids)]
+        missing = [i for i in ids if (intent, i) not in self.rows]
+        if missing:
+            self.db_round_trips += 1
+            found = db_pool.execute_prepared(f"{intent.lower()}_batch", (missing,))
+            by_id = {str(row["invoice_id"]): row for row in found}
+            for i in missing:
+                self.rows[(intent, i)] = by_id.get(i)
+        return {i: self.rows[(intent, i)] for i in ids}
+
+    def fetch_range(self, intent, start, end):
+        self.db_round_trips += 1
+        found = db_pool.execute_prepared(f"{intent.lower()}_range", (start, end))
+        result = {}
+        for row in found:
+            self.rows[(intent, str(row["invoice_id"]))] = row
+            result[str(row["invoice_id"])] = row
+        return result
+
+
+class _PendingLookup:
+    def __init__(self, intent, invoice_id):
+        self.intent = intent
+        self.invoice_id = invoice_id
+        self.row = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InvoiceLookupBatcher:
+    """
+    Collects single-invoice lookups from concurrent callers for up to window_ms and serves
+    them with one = ANY query per intent, instead of one round trip per request.
+    """
+
+    def __init__(self, window_ms=SQL_BATCH_WINDOW_MS, max_batch=SQL_MAX_BATCH):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self.lookups = 0
+        self.batch_sizes = Counter()
+
+    def lookup(self, intent, invoice_id):
+        """Returns rows shaped like run_query's: [row] or []."""
+        pending = _PendingLookup(intent, str(invoice_id))
+        self._ensure_worker()
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        if pending.row is None:
+            return []
+        if SQL_TEMPLATES[intent].startswith("SELECT *"):
+            return [pending.row]
+        # The batch form also selects invoice_id to key the rows; the single form doesn't
+        return [{k: v for k, v in pending.row.items() if k != "invoice_id"}]
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="sql-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            by_intent = {}
+            for p in batch:
+                by_intent.setdefault(p.intent, []).append(p)
+            for intent, waiting in by_intent.items():
+                try:
+                    rows = InvoiceSession().fetch(intent, [p.invoice_id for p in waiting])
+                    for p in waiting:
+                        p.row = rows[p.invoice_id]
+                except Exception as e:
+                    for p in waiting:
+                        p.error = e
+                with self._lock:
+                    self.lookups += len(waiting)
+                    self.batch_sizes[len(waiting)] += 1
+                for p in waiting:
+                    p.done.set()
+
+    def stats(self):
+        with self._lock:
+            queries = sum(self.batch_sizes.values())
+            return {
+                "lookups": self.lookups,
+                "db_queries": queries,
+                "lookups_per_query": self.lookups / queries if queries else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items()))
+            }
+
+
+lookup_batcher = InvoiceLookupBatcher() if SQL_BATCH_WINDOW_MS > 0 else None
+
+
+def enable_lookup_batching(window_ms=2.0, max_batch=SQL_MAX_BATCH):
+    """Routes run_query's single-invoice lookups through a shared InvoiceLookupBatcher."""
+    global lookup_batcher
+    if lookup_batcher is None:
+        lookup_batcher = InvoiceLookupBatcher(window_ms, max_batch)
+    return lookup_batcher
+
+
+_analytics_ready = False
+_analytics_lock = threading.Lock()
+
+
+def run_analytics(intent):
+    """Runs an ANALYTICS_SQL_TEMPLATES query; the first call creates the summary table if needed."""
+    global _analytics_ready
+    if not _analytics_ready:
+        with _analytics_lock:
+            if not _analytics_ready:
+                invoice_analytics.ensure_summary_table()
+                for name, sql in ANALYTICS_SQL_TEMPLATES.items():
+                    db_pool.prepare(name.lower(), sql)
+                _analytics_ready = True
+    return db_pool.execute_prepared(intent.lower())
 
 
 # -------- Step 2.4: Execution Layer --------
-def run_query(user_query: str):
-    intent = classify_intent(user_query)
+def run_query(user_query: str, intent=None):
+    # intent: pre-classified by the orchestrator's router; keyword rules otherwise
+    intent = intent or classify_intent(user_query)
+    with tracing.span("sql_lookup", intent=intent) as attrs:
+        result = _run_query(user_query, intent)
+        if isinstance(result, list):
+            attrs["rows"] = len(result)
+            tracing.observe_size("sql_rows", len(result))
+        else:
+            tracing.count("errors_total", stage="sql_lookup", error="InvalidQuery")
+    return result
+
+
+def _run_query(user_query, intent):
+    if intent in ANALYTICS_SQL_TEMPLATES:
+        return run_analytics(intent)
+
     sql = SQL_TEMPLATES.get(intent)
 
     if not sql:
@@ -71,22 +351,45 @@ def run_query(user_query: str):
 
     invoice_id = extract_invoice_id(user_query)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    if "%s" in sql:
+        if not invoice_id:
+            return {"error": "Invoice ID not found in query"}
+        if lookup_batcher is not None and intent in BATCH_SQL_TEMPLATES:
+            return lookup_batcher.lookup(intent, invoice_id)
+        # invoice_id is stored as VARCHAR
+        return db_pool.execute_prepared(intent.lower(), (str(invoice_id),))
+
+    return db_pool.execute_prepared(intent.lower())
+
+
+# -------- Batch Execution Layer --------
+def fetch_invoices(ids, intent="GET_INVOICE_BY_ID", ranges=(), session=None):
+    """
+    Looks up many invoices in one query per template. Returns {invoice_id: row}; requested
+    IDs that don't exist map to None. Pass a session to share the identity map across calls.
+    """
+    if intent not in BATCH_SQL_TEMPLATES:
+        return {"error": f"Intent {intent} has no batch form"}
+
+    session = session or InvoiceSession()
+    results = session.fetch(intent, ids) if ids else {}
+    for start, end in ranges:
+        results.update(session.fetch_range(intent, start, end))
+    return results
 
-    try:
-        if "%s" in sql:
-            if not invoice_id:
-                return {"error": "Invoice ID not found in query"}
-            cursor.execute(sql, (invoice_id,))
-        else:
-            cursor.execute(sql)
 
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
+def run_queries(user_query: str, session=None, intent=None):
+    """Batch counterpart of run_query: "total for invoices 101, 102 and 105", "invoices 100-200"."""
+    intent = intent or classify_intent(user_query)
+    if intent not in BATCH_SQL_TEMPLATES:
+        return run_query(user_query, intent)
 
-        return [dict(zip(columns, row)) for row in rows]
+    ids, ranges = extract_invoice_ids(user_query)
+    if not ids and not ranges:
+        return {"error": "Invoice ID not found in query"}
 
-    finally:
-        cursor.close()
-        conn.close()
+    with tracing.span("sql_lookup", intent=intent, batch=True) as attrs:
+        result = fetch_invoices(ids, intent, ranges, session)
+        attrs["rows"] = sum(1 for row in result.values() if row is not None)
+        tracing.observe_size("sql_rows", attrs["rows"])
+    return result
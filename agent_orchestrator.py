@@ -1,18 +1,172 @@
+import asyncio
+import contextvars
+import functools
+import os
 import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import agent_invoice_sql
+import formatters
+import gst_calculator
+import tracing
 from agent_gst_rag import GSTRagAgent
+from index_receipts import COUNTRY_NAMES, RECEIPT_CATEGORIES, receipt_filters
+from intent_router import IntentRouter
+from rate_index import RateIndex
+
+# Set AGENT_WARMUP=1 to load the embedder/LLM in a background thread at startup
+AGENT_WARMUP = os.getenv("AGENT_WARMUP", "0") == "1"
+# Threads behind arun(): each runs one blocking DB/vector/LLM call at a time
+ASYNC_WORKERS = int(os.getenv("ORCH_ASYNC_WORKERS", "64"))
+REQUEST_TIMEOUT = float(os.getenv("ORCH_REQUEST_TIMEOUT", "30"))   # seconds, per arun() call
+
+DEFAULT_GST_RATE = 18.0
+RATE_LINE = re.compile(r"(\d+(?:\.\d+)?)% Rate[^:]*:(.*)")
+# "show inter-state supplies" asks for invoices even when keyword routing sends it to RAG
+DATA_REQUEST = re.compile(r"^\s*(show|list|fetch|find|get)\b")
+# Receipt categories and countries from dataset/: "hotel invoices in Hamburg 2019"
+RECEIPT_TOPIC = re.compile(r"\b(" + "|".join(RECEIPT_CATEGORIES + [c.lower() for c in COUNTRY_NAMES.values()]) + r")\b")
+
+
+def applicable_rate(query, rules):
+    """Picks the slab whose item list mentions something in the query, e.g. "mobiles" -> 12%."""
+    q = query.lower()
+    for rule in rules:
+        for rate, items in RATE_LINE.findall(rule):
+            for item in re.split(r",|\band\b|like", items.lower()):
+                item = item.strip(" .")
+                if len(item) > 2 and re.search(rf"\b{re.escape(item)}", q):
+                    return float(rate)
+    return None
+
+
+class StreamLatency:
+    """
+    Rolling latency of recent answers: time to the first chunk (what the user waits before
+    text appears) and time to the last chunk, both from the moment the query arrived.
+    """
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._first = deque(maxlen=window)
+        self._total = deque(maxlen=window)
+
+    def record(self, first_s, total_s):
+        with self._lock:
+            if first_s is not None:
+                self._first.append(first_s)
+            self._total.append(total_s)
+
+    def timed(self, chunks, started):
+        """Passes chunks through, recording their timing once the last one is out."""
+        first = None
+        try:
+            for chunk in chunks:
+                if first is None:
+                    first = time.monotonic() - started
+                yield chunk
+        finally:
+            self.record(first, time.monotonic() - started)
+
+    def stats(self):
+        def percentiles(samples):
+            if not samples:
+                return None
+            p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+            return {"p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1), "p99_ms": round(float(p99), 1)}
+
+        with self._lock:
+            return {
+                "answers": len(self._total),
+                "time_to_first_chunk": percentiles(self._first),
+                "total": percentiles(self._total)
+            }
+
 
 class OrchestratorAgent:
-    def __init__(self):
-        self.rag_agent = GSTRagAgent()
+    def __init__(self, warm_up=AGENT_WARMUP):
+        # The RAG agent is built on first use, so SQL-only sessions start instantly
+        self._rag_agent = None
+        self._rag_lock = threading.Lock()
+        self._executor = None
+        self._router = None
+        # Slab/threshold questions answered straight from gst_rules.txt, no embedding or LLM
+        self.rate_index = RateIndex()
+        self.latency = StreamLatency()
+        if warm_up:
+            self.rag_agent.warm_up(background=True)
+
+    @property
+    def rag_agent(self):
+        if self._rag_agent is None:
+            with self._rag_lock:
+                if self._rag_agent is None:
+                    self._rag_agent = GSTRagAgent()
+        return self._rag_agent
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._rag_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="orchestrator")
+        return self._executor
+
+    @property
+    def router(self):
+        """Embedding router, once the RAG agent's embedder is loaded; None until then."""
+        if self._router is None:
+            if self._rag_agent is None or not self._rag_agent.embedder_loaded:
+                # Don't load MiniLM just to route: SQL-only sessions keep using keywords
+                return None
+            with self._rag_lock:
+                if self._router is None:
+                    self._router = IntentRouter(
+                        self._rag_agent.embedder,
+                        keyword_intent=self.keyword_intent,
+                        keyword_sql_intent=agent_invoice_sql.classify_intent,
+                        has_invoice_id=lambda q: any(agent_invoice_sql.extract_invoice_ids(q))
+                    )
+        return self._router
+
+    def route(self, query):
+        """Returns {"intent", "sql_intent", "confidence", "source", "embedding"} for a query."""
+        with tracing.span("classify") as attrs:
+            router = self.router
+            if router is None:
+                route = {"intent": self.keyword_intent(query), "sql_intent": None, "confidence": None,
+                         "source": "keywords", "embedding": None}
+            else:
+                route = router.route(query)
+            attrs.update(intent=route["intent"], source=route["source"])
+        tracing.annotate(intent=route["intent"], route_source=route["source"])
+        return route
 
     def classify_query(self, query):
+        return self.route(query)["intent"]
+
+    def keyword_intent(self, query):
         q = query.lower()
         
         # Calculation implied
         if "calculate" in q:
             return "CALCULATION"
 
+        # Receipt corpus search (the year in "hotel invoices 2019" is not an invoice ID)
+        if "receipt" in q or (re.search(r"\b(invoices|bills)\b", q) and RECEIPT_TOPIC.search(q)):
+            return "RECEIPT_SEARCH"
+
+        # SQL Intent: Totals over all invoices ("total tax collected by state", "monthly IGST liability")
+        if agent_invoice_sql.classify_analytics_intent(q):
+            return "SQL_AGENT"
+
+        # SQL Intent: Interstate invoice listing ("show inter-state supplies")
+        if DATA_REQUEST.search(q) and re.search(r"\binter[- ]?state\b", q):
+            return "SQL_AGENT"
+
         # SQL Intent: Specific invoice data
         if "invoice" in q and any(char.isdigit() for char in q):
             # Likely asking about a specific invoice ID or sum of invoices
@@ -21,67 +175,289 @@ class OrchestratorAgent:
         # RAG Intent: General knowledge
         if "rate" in q or "slab" in q or "rule" in q or "what is" in q:
             return "RAG_AGENT"
-        
-        # Calculation implied
-        if "calculate" in q:
-            return "CALCULATION"
             
         # Default fallback
         return "RAG_AGENT"
 
     def calculate_gst(self, amount, rate, is_interstate):
-        tax = amount * (rate / 100)
-        return {
-            "taxable_value": amount,
-            "rate": rate,
-            "tax_amount": tax,
-            "total_payable": amount + tax,
-            "breakdown": {
-                "IGST": tax if is_interstate else 0,
-                "CGST": tax/2 if not is_interstate else 0,
-                "SGST": tax/2 if not is_interstate else 0
+        # Single-invoice wrapper around the exact (paise) batch engine
+        result = gst_calculator.calculate_batch([amount], rate, is_interstate=[is_interstate])
+        return gst_calculator.row_to_rupees(result.iloc[0])
+
+    def _sql_lookup(self, user_query, sql_intent=None):
+        ids, ranges = agent_invoice_sql.extract_invoice_ids(user_query)
+        if len(ids) > 1 or ranges:
+            # Several invoices: one batched query, results keyed by invoice ID
+            return agent_invoice_sql.run_queries(user_query, intent=sql_intent)
+        return agent_invoice_sql.run_query(user_query, intent=sql_intent)
+
+    @staticmethod
+    def _explicit_rate(user_query):
+        rate_match = re.search(r"(\d+(?:\.\d+)?)%", user_query)
+        return float(rate_match.group(1)) if rate_match else None
+
+    @staticmethod
+    def _calculation_data(basis, rate):
+        # Supply type (CGST+SGST / CGST+UTGST / IGST) follows the invoice's own states
+        with tracing.span("calculate", invoices=len(basis)):
+            result = gst_calculator.calculate_paise(basis["taxable_paise"].to_numpy(), rate,
+                                                    basis["supplier_state"].to_numpy(),
+                                                    basis["buyer_state"].to_numpy())
+        result.index = basis.index
+        if len(result) == 1:
+            return {
+                "action": "Calculated GST for Invoice",
+                "invoice_id": result.index[0],
+                "calculation": gst_calculator.row_to_rupees(result.iloc[0])
             }
+        return {
+            "action": "Calculated GST for Invoices",
+            "invoices": {inv_id: gst_calculator.row_to_rupees(row) for inv_id, row in result.iterrows()},
+            "summary": gst_calculator.summarize(result)
         }
 
-    def run(self, user_query):
-        intent = self.classify_query(user_query)
-        print(f"--- Orchestrator: Classified as {intent} ---")
+    def _format_stream(self, user_query, intent, raw_result, ids=()):
+        # Structured results are rendered locally; only unrecognised shapes cost an LLM call
+        with tracing.span("format", intent=intent) as attrs:
+            text = formatters.format_result(intent, raw_result, ids)
+            attrs["local"] = text is not None
+        if text is not None:
+            yield text
+            return
+        yield from self.rag_agent.stream_format(user_query, raw_result)
+
+    @staticmethod
+    def _not_found(ids, ranges):
+        if len(ids) == 1 and not ranges:
+            return f"Invoice {ids[0]} not found."
+        return "None of the requested invoices were found."
+
+    def _direct_answer(self, user_query, route=None):
+        """
+        Answer from the rate index, or None when the query needs routing (invoices, calculations).
+        Item rates are tried before routing; rule facts only once route says RAG_AGENT, since
+        "show inter-state supplies" names a supply type but asks for data.
+        """
+        q = user_query.lower()
+        if "calculate" in q or "invoice" in q or any(agent_invoice_sql.extract_invoice_ids(user_query)) \
+                or agent_invoice_sql.classify_analytics_intent(q):
+            return None
+        if route is not None and (route["intent"] != "RAG_AGENT" or DATA_REQUEST.search(q)):
+            return None
+        with tracing.span("rate_index") as attrs:
+            answer = self.rate_index.answer(user_query, items=route is None, facts=route is not None)
+            attrs["hit"] = answer is not None
+        if answer is not None:
+            tracing.annotate(intent="RATE_INDEX", route_source="rate_index")
+            print("--- Orchestrator: Answered from rate index ---")
+        return answer
+
+    def _slab_rate(self, user_query, rules=None):
+        # Compiled index first; retrieved rule chunks cover items the slab table doesn't list
+        rate = self.rate_index.rate_for(user_query)
+        if rate is None and rules is not None:
+            rate = applicable_rate(user_query, rules)
+        return rate
+
+    def _route_and_log(self, user_query):
+        route = self.route(user_query)
+        print(f"--- Orchestrator: Classified as {route['intent']} ({route['source']}) ---")
+        return route
+
+    def _respond(self, user_query, route):
+        """Yields the answer to a routed query in chunks."""
+        intent = route["intent"]
         
         if intent == "SQL_AGENT":
-            raw_result = agent_invoice_sql.run_query(user_query)
-            return self.rag_agent.format_with_llm(user_query, raw_result)
+            sql_intent = route["sql_intent"] or agent_invoice_sql.classify_intent(user_query)
+            raw_result = self._sql_lookup(user_query, sql_intent)
+            ids, _ = agent_invoice_sql.extract_invoice_ids(user_query)
+            yield from self._format_stream(user_query, sql_intent, raw_result, ids)
         
         elif intent == "RAG_AGENT":
-            rag_output = self.rag_agent.generate_answer(user_query)
-            return rag_output.get("generated_answer", "No answer found.")
+            # The routing embedding doubles as the retrieval query vector
+            yield from self.rag_agent.stream_answer(user_query, query_embedding=route["embedding"])
+
+        elif intent == "RECEIPT_SEARCH":
+            # Year/country/category named in the query narrow the search instead of just nudging the ranking
+            raw_result = self.rag_agent.search_receipts(user_query, query_embedding=route["embedding"],
+                                                        filters=receipt_filters(user_query))
+            yield from self._format_stream(user_query, intent, raw_result)
             
         elif intent == "CALCULATION":
-            # Example Hybrid Logic: "Calculate 18% GST on Invoice #101"
-            inv_id = agent_invoice_sql.extract_invoice_id(user_query)
-            if not inv_id:
-                return "Could not identify invoice ID for calculation."
-            
-            sql_result = agent_invoice_sql.run_query(f"total amount invoice {inv_id}")
-            
-            if not sql_result or 'error' in sql_result:
-                return f"Invoice {inv_id} not found."
-                
-            amount = float(sql_result[0].get('total_amount', 0))
-            
-            rate_match = re.search(r"(\d+)%", user_query)
-            rate = float(rate_match.group(1)) if rate_match else 18.0
-            
-            is_interstate = False 
+            # Example Hybrid Logic: "Calculate 18% GST on Invoice #101" (or "on invoices 101-105")
+            ids, ranges = agent_invoice_sql.extract_invoice_ids(user_query)
+            if not ids and not ranges:
+                yield "Could not identify invoice ID for calculation."
+                return
             
-            calc_result = self.calculate_gst(amount, rate, is_interstate)
-            raw_data = {
-                "action": "Calculated GST for Invoice",
-                "invoice_id": inv_id,
-                "calculation": calc_result
-            }
-            return self.rag_agent.format_with_llm(user_query, raw_data)
-            
-        return "Query not understood."
+            basis = gst_calculator.fetch_tax_basis(ids, ranges)
+            if basis.empty:
+                yield self._not_found(ids, ranges)
+                return
+
+            rate = self._explicit_rate(user_query)
+            if rate is None:
+                rate = self._slab_rate(user_query)
+            if rate is None:
+                # Item not in the slab table: look it up in the retrieved rules
+                rules = self.rag_agent.retrieve_rules(user_query, query_embedding=route["embedding"])
+                rate = self._slab_rate(user_query, rules)
+            if rate is None:
+                # 0% (exempt) is a real rate; only a missing one gets the default
+                rate = DEFAULT_GST_RATE
+
+            raw_data = self._calculation_data(basis, rate)
+            yield from self._format_stream(user_query, intent, raw_data, ids)
+
+        else:
+            yield "Query not understood."
+
+    def stream(self, user_query):
+        """
+        Yields the answer as it is produced: LLM answers token chunk by token chunk,
+        locally rendered ones in one piece. Timings land in self.latency.
+        """
+        # The request's trace stays inside the stream instead of leaking into the caller between chunks
+        return tracing.isolated(self._stream(user_query))
+
+    def _stream(self, user_query):
+        started = time.monotonic()
+        with tracing.request("query", query_chars=len(user_query)):
+            direct = self._direct_answer(user_query)
+            if direct is not None:
+                yield from self.latency.timed(iter([direct]), started)
+                return
+            route = self._route_and_log(user_query)
+            direct = self._direct_answer(user_query, route)
+            if direct is not None:
+                yield from self.latency.timed(iter([direct]), started)
+                return
+            yield from self.latency.timed(self._respond(user_query, route), started)
+
+    def run(self, user_query):
+        return "".join(self.stream(user_query)).strip()
+
+    # -------- Async API --------
+    async def _call(self, fn, *args):
+        # psycopg2, requests and the Gemini client block; run them on the shared pool so
+        # one event loop can interleave many sessions. The copied context carries the trace,
+        # and the worker is sampled for the request's profile while it runs the step.
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, tracing.attached, fn, *args))
+
+    def _llm_ready(self):
+        # Touching llm_available connects the LLM (first call only) while other steps run
+        return self.rag_agent.llm_available
+
+    async def arun(self, user_query, timeout=REQUEST_TIMEOUT):
+        """
+        Coroutine form of run(). Independent steps run concurrently and the whole request
+        is bounded by timeout seconds (None for no deadline). Cancelling the task abandons
+        the request; calls already handed to a worker thread finish in the background.
+        """
+        chunks = []
+        async for chunk in self.astream(user_query, timeout):
+            chunks.append(chunk)
+        return "".join(chunks).strip()
+
+    async def astream(self, user_query, timeout=REQUEST_TIMEOUT):
+        """Async-iterator form of stream(), with arun()'s concurrency and deadline."""
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+
+        def remaining():
+            return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+        first = None
+        with tracing.request("query", query_chars=len(user_query), mode="async"):
+            try:
+                chunks = await asyncio.wait_for(self._aprepare(user_query), remaining())
+                while True:
+                    # One chunk at a time off the worker pool, so the loop never blocks on Gemini
+                    chunk = await asyncio.wait_for(self._call(next, chunks, None), remaining())
+                    if chunk is None:
+                        break
+                    if first is None:
+                        first = time.monotonic() - started
+                    yield chunk
+            except asyncio.TimeoutError:
+                tracing.count("errors_total", stage="query", error="Timeout")
+                yield ("\n" if first is not None else "") + f"Request timed out after {timeout}s."
+            finally:
+                self.latency.record(first, time.monotonic() - started)
+
+    async def _aprepare(self, user_query):
+        """
+        Runs the steps before answer generation, independent ones concurrently, and returns
+        the (not yet started) chunk generator that produces the answer.
+        """
+        direct = self._direct_answer(user_query)
+        if direct is not None:
+            return iter([direct])
+
+        # Routing may embed the query, which blocks on the encoder
+        route = await self._call(self._route_and_log, user_query)
+        intent = route["intent"]
+        direct = self._direct_answer(user_query, route)
+        if direct is not None:
+            return iter([direct])
+
+        if intent == "SQL_AGENT":
+            sql_intent = route["sql_intent"] or agent_invoice_sql.classify_intent(user_query)
+            steps = [self._call(self._sql_lookup, user_query, sql_intent)]
+            if not formatters.is_enabled(sql_intent):
+                steps.append(self._call(self._llm_ready))
+            raw_result, *_ = await asyncio.gather(*steps)
+            ids, _ = agent_invoice_sql.extract_invoice_ids(user_query)
+            return self._format_stream(user_query, sql_intent, raw_result, ids)
+
+        elif intent == "RAG_AGENT":
+            return self.rag_agent.stream_answer(user_query, query_embedding=route["embedding"])
+
+        elif intent == "RECEIPT_SEARCH":
+            raw_result = await self._call(
+                functools.partial(self.rag_agent.search_receipts, user_query, query_embedding=route["embedding"],
+                                  filters=receipt_filters(user_query)))
+            return self._format_stream(user_query, intent, raw_result)
+
+        elif intent == "CALCULATION":
+            ids, ranges = agent_invoice_sql.extract_invoice_ids(user_query)
+            if not ids and not ranges:
+                return iter(["Could not identify invoice ID for calculation."])
+
+            # Invoice lookup, rate lookup and (if needed) LLM connection don't depend on each other
+            rate = self._explicit_rate(user_query)
+            if rate is None:
+                rate = self._slab_rate(user_query)
+            steps = [self._call(gst_calculator.fetch_tax_basis, ids, ranges)]
+            if not formatters.is_enabled(intent):
+                steps.append(self._call(self._llm_ready))
+            if rate is None:
+                steps.append(self._call(
+                    functools.partial(self.rag_agent.retrieve_rules, user_query, query_embedding=route["embedding"])))
+            basis, *others = await asyncio.gather(*steps)
+            if basis.empty:
+                return iter([self._not_found(ids, ranges)])
+            if rate is None:
+                rate = self._slab_rate(user_query, others[-1])
+            if rate is None:
+                rate = DEFAULT_GST_RATE
+
+            raw_data = self._calculation_data(basis, rate)
+            return self._format_stream(user_query, intent, raw_data, ids)
+
+        return iter(["Query not understood."])
+
+    async def arun_many(self, queries, timeout=REQUEST_TIMEOUT):
+        """Serves many sessions' queries concurrently; answers come back in input order."""
+        return await asyncio.gather(*(self.arun(q, timeout) for q in queries))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
 
 if __name__ == "__main__":
     system = OrchestratorAgent()
@@ -96,8 +472,12 @@ if __name__ == "__main__":
             if user_input.lower() in ["exit", "quit"]:
                 break
                 
-            response = system.run(user_input)
-            print(f">> Agent: {response}\n")
+            # Print the answer as it streams in rather than after the last token
+            for i, chunk in enumerate(system.stream(user_input)):
+                if i == 0:
+                    print(">> Agent: ", end="")
+                print(chunk, end="", flush=True)
+            print("\n")
             
         except KeyboardInterrupt:
             break
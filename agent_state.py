@@ -0,0 +1,60 @@
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+AGENT_STATE_PATH = os.getenv("AGENT_STATE_PATH", ".agent_state.json")
+AGENT_STATE_TTL = int(os.getenv("AGENT_STATE_TTL", str(24 * 3600)))  # seconds
+# -------------------------
+
+# Small persisted key/value store for facts that are slow to discover at startup
+# (chosen Gemini model, Pinecone index host). Entries older than the TTL are ignored.
+
+_lock = threading.Lock()
+
+
+def _read():
+    try:
+        with open(AGENT_STATE_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write(state):
+    tmp_path = f"{AGENT_STATE_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, AGENT_STATE_PATH)
+
+
+def load_state(key, ttl=AGENT_STATE_TTL):
+    entry = _read().get(key)
+    if not entry or time.time() - entry.get("saved_at", 0) > ttl:
+        return None
+    return entry.get("value")
+
+
+def save_state(key, value):
+    with _lock:
+        state = _read()
+        state[key] = {"value": value, "saved_at": time.time()}
+        try:
+            _write(state)
+        except OSError as e:
+            print(f"Warning: could not persist agent state: {e}")
+
+
+def forget_state(key):
+    with _lock:
+        state = _read()
+        if state.pop(key, None) is not None:
+            try:
+                _write(state)
+            except OSError:
+                pass
@@ -0,0 +1,716 @@
+import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+import agent_invoice_sql
+import formatters
+import gst_calculator
+from agent_gst_rag import GSTRagAgent
+from agent_orchestrator import OrchestratorAgent
+from db import get_pool, to_server_placeholders
+from embedding_models import EMBED_BACKEND, get_embedding_model
+from response_cache import ResponseCache
+from setup_vector_db import chunk_id, iter_chunks
+from vector_store import EMBEDDING_DIM, PineconeVectorStore
+
+# Offline end-to-end benchmark: OrchestratorAgent.run over a replayable query corpus, with
+# Pinecone, Postgres and Gemini replaced by local stand-ins of configurable latency. Everything
+# between them (routing, rate index, embedder cache/batching, pool, formatters, calculator)
+# is the real code. Results are JSON so two runs can be diffed (--compare).
+
+DEFAULT_CORPUS = "benchmark_queries.jsonl"
+SAMPLE_INVOICES = os.path.join("dataset", "sample_invoices.csv")
+SYNTHETIC_ID_START = 1000
+STATES = ["Delhi", "Maharashtra", "Karnataka", "Tamil Nadu", "Gujarat", "Kerala", "Chandigarh", "Ladakh"]
+RATES = [0, 5, 12, 18, 28]
+
+# A p95 must grow by this many ms (on top of the relative tolerance) to count as a regression
+MIN_REGRESSION_MS = 1.0
+
+
+# -------- Stand-in: Pinecone --------
+class _PineconeHandler(BaseHTTPRequestHandler):
+    index = None   # set by FakePinecone
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        time.sleep(self.index.latency)
+        if self.path == "/query":
+            fault = self.index.fault()
+            if fault == "error":
+                self._send_json(503, {"message": "Injected failure"})
+                return
+            if fault == "slow":
+                time.sleep(self.index.slow)
+            self._send_json(200, {"matches": self.index.query(body["vector"], body.get("topK", 10),
+                                                              body.get("includeMetadata", False),
+                                                              body.get("filter"))})
+        elif self.path == "/vectors/upsert":
+            self._send_json(200, {"upsertedCount": self.index.upsert(body.get("vectors", []))})
+        elif self.path == "/vectors/delete":
+            self.index.delete(body.get("ids", []))
+            self._send_json(200, {})
+        else:
+            self._send_json(404, {"message": f"Unknown path {self.path}"})
+
+    def do_GET(self):
+        if self.path == "/describe_index_stats":
+            self._send_json(200, {"dimension": EMBEDDING_DIM, "totalVectorCount": len(self.index.ids)})
+        else:
+            self._send_json(404, {"message": f"Unknown path {self.path}"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class FakePinecone:
+    """
+    Pinecone data-plane REST stand-in on localhost (/query, /vectors/upsert, /vectors/delete,
+    /describe_index_stats) doing exact cosine search, honouring $eq/$in/$and metadata filters. Every request sleeps latency_ms first.
+    Queries (only; indexing always succeeds) fail with a 503 at error_rate and take slow_ms
+    longer at slow_rate, drawn from a seeded RNG.
+    """
+
+    def __init__(self, latency_ms=0.0, error_rate=0.0, slow_rate=0.0, slow_ms=0.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow = slow_ms / 1000.0
+        self._rng = random.Random(seed)
+        self.ids = []
+        self.metadata = []
+        self.matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self._lock = threading.Lock()
+        handler = type("FakePineconeHandler", (_PineconeHandler,), {"index": self})
+        self.server = _StandInServer(("127.0.0.1", 0), handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-pinecone", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fault(self):
+        with self._lock:
+            draw = self._rng.random()
+        if draw < self.error_rate:
+            return "error"
+        if draw < self.error_rate + self.slow_rate:
+            return "slow"
+        return None
+
+    def upsert(self, vectors):
+        with self._lock:
+            positions = {vid: i for i, vid in enumerate(self.ids)}
+            rows = list(self.matrix)
+            for v in vectors:
+                row = np.asarray(v["values"], dtype=np.float32)
+                row = row / max(float(np.linalg.norm(row)), 1e-12)
+                i = positions.get(v["id"])
+                if i is None:
+                    positions[v["id"]] = len(self.ids)
+                    self.ids.append(v["id"])
+                    self.metadata.append(v.get("metadata", {}))
+                    rows.append(row)
+                else:
+                    rows[i] = row
+                    self.metadata[i] = v.get("metadata", {})
+            self.matrix = np.stack(rows) if rows else self.matrix
+        return len(vectors)
+
+    def delete(self, ids):
+        drop = set(ids)
+        with self._lock:
+            keep = [i for i, vid in enumerate(self.ids) if vid not in drop]
+            self.ids = [self.ids[i] for i in keep]
+            self.metadata = [self.metadata[i] for i in keep]
+            self.matrix = self.matrix[keep]
+
+    @staticmethod
+    def _matches(metadata, filter):
+        if "$and" in filter:
+            return all(FakePinecone._matches(metadata, clause) for clause in filter["$and"])
+        for field, condition in filter.items():
+            allowed = condition["$in"] if "$in" in condition else [condition["$eq"]]
+            if field not in metadata or metadata[field] not in allowed:
+                return False
+        return True
+
+    def query(self, vector, top_k, include_metadata, filter=None):
+        with self._lock:
+            matrix, ids, metadata = self.matrix, self.ids, self.metadata
+        if not ids:
+            return []
+        q = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ (q / max(float(np.linalg.norm(q)), 1e-12))
+        if filter:
+            scores = np.where([self._matches(m, filter) for m in metadata], scores, -np.inf)
+        top = [i for i in np.argsort(-scores)[:top_k] if np.isfinite(scores[i])]
+        return [{"id": ids[i], "score": float(scores[i]), **({"metadata": metadata[i]} if include_metadata else {})}
+                for i in top]
+
+
+# -------- Stand-in: Postgres --------
+# The few Postgres-only constructs in the SQL agent's templates, in SQLite spelling
+_PG_TO_SQLITE = [
+    (re.compile(r"(\w+) ~ '\^\[0-9\]\+\$'"), r"(\1 != '' AND \1 NOT GLOB '*[^0-9]*')"),
+    (re.compile(r"(\w+)::bigint"), r"CAST(\1 AS INTEGER)"),
+]
+_PARAM = re.compile(r"(= ANY\()?\$(\d+)(?(1)\))")
+
+sqlite3.register_converter("DECIMAL", lambda value: Decimal(value.decode("ascii")))
+
+
+def to_sqlite(sql, params):
+    """Server-side ($n) Postgres SQL -> (SQLite SQL, args); = ANY($n) over a list becomes IN (?, ...)."""
+    for pattern, replacement in _PG_TO_SQLITE:
+        sql = pattern.sub(replacement, sql)
+    args = []
+
+    def bind(match):
+        value = params[int(match.group(2)) - 1]
+        if match.group(1):
+            args.extend(value)
+            return "IN (" + ", ".join("?" * len(value)) + ")"
+        args.append(value)
+        return "?"
+
+    return _PARAM.sub(bind, sql), args
+
+
+class LocalInvoiceDB:
+    """
+    In-memory SQLite invoices table behind psycopg2-shaped connections, so the real
+    ConnectionPool (slots, checkout waits, PREPARE/EXECUTE) runs unchanged on top of it.
+    NUMERIC columns come back as Decimal, as from psycopg2. Every statement sleeps latency_ms.
+    """
+
+    SCHEMA = """
+        CREATE TABLE invoices (
+            invoice_id VARCHAR(50) PRIMARY KEY,
+            total_amount DECIMAL(10, 2),
+            tax_amount DECIMAL(10, 2),
+            supplier_state VARCHAR(100),
+            buyer_state VARCHAR(100),
+            invoice_date DATE,
+            vendor VARCHAR(200),
+            source_file TEXT
+        );
+    """
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self.statements = 0
+
+    def load(self, frame):
+        columns = list(frame.columns)
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO invoices ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+            )
+            self._conn.commit()
+
+    def execute(self, sql, params=()):
+        sql, args = to_sqlite(sql, params)
+        time.sleep(self.latency)
+        with self._lock:
+            self.statements += 1
+            cursor = self._conn.execute(sql, args)
+            return cursor.description, cursor.fetchall()
+
+    def connect(self):
+        return _LocalConnection(self)
+
+
+class _LocalConnection:
+    def __init__(self, database):
+        self.database = database
+        self.closed = 0
+        self.prepared = {}   # per connection, like server-side prepared statements
+
+    def cursor(self):
+        return _LocalCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class _LocalCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        command = sql.split(None, 1)[0].upper()
+        if command == "PREPARE":
+            name, body = re.match(r"PREPARE (\w+) AS (.*)", sql, re.S).groups()
+            self.conn.prepared[name] = body
+        elif command == "DEALLOCATE":
+            self.conn.prepared.pop(sql.split()[1], None)
+        elif command == "SET":
+            pass
+        elif command == "EXECUTE":
+            name = re.match(r"EXECUTE (\w+)", sql).group(1)
+            self.description, self._rows = self.conn.database.execute(self.conn.prepared[name], params)
+        else:
+            self.description, self._rows = self.conn.database.execute(to_server_placeholders(sql), params)
+
+    def fetchall(self):
+        return self._rows
+
+
+def make_invoices(count, seed=0, sample_path=SAMPLE_INVOICES):
+    """The sample CSV plus count synthetic invoices (IDs from 1000) with tax-inclusive totals."""
+    frames = []
+    if os.path.exists(sample_path):
+        sample = pd.read_csv(sample_path, dtype={"invoice_id": str})
+        frames.append(sample.rename(columns={"date": "invoice_date"}).drop(columns=["items"], errors="ignore"))
+
+    rng = np.random.default_rng(seed)
+    taxable = rng.integers(100, 500000, size=count) * 100          # paise
+    rates = rng.choice(RATES, size=count)
+    tax = taxable * rates // 100
+    frames.append(pd.DataFrame({
+        "invoice_id": [str(SYNTHETIC_ID_START + i) for i in range(count)],
+        "total_amount": [str(gst_calculator.to_rupees(v)) for v in taxable + tax],
+        "tax_amount": [str(gst_calculator.to_rupees(v)) for v in tax],
+        "supplier_state": rng.choice(STATES, size=count),
+        "buyer_state": rng.choice(STATES, size=count),
+        "invoice_date": (pd.Timestamp("2024-04-01") + pd.to_timedelta(rng.integers(0, 365, size=count), unit="D"))
+        .strftime("%Y-%m-%d"),
+        "vendor": [f"Vendor {i % 50}" for i in range(count)],
+    }))
+    return pd.concat(frames, ignore_index=True)
+
+
+# -------- Stand-in: Gemini and (optionally) MiniLM --------
+class _Text:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubLLM:
+    """
+    Gemini stand-in: the first chunk arrives after first_chunk_ms, then one chunk every
+    chunk_ms. generate_content(stream=False) returns the whole text after the same delays.
+    """
+    model_name = "benchmark-stub"
+
+    def __init__(self, first_chunk_ms=400.0, chunk_ms=25.0, chunks=8, timer=None):
+        self.first_chunk = first_chunk_ms / 1000.0
+        self.chunk = chunk_ms / 1000.0
+        self.chunks = chunks
+        self.timer = timer
+
+    def _stream(self, prompt):
+        started = time.perf_counter()
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        try:
+            time.sleep(self.first_chunk)
+            for i in range(self.chunks):
+                if i:
+                    time.sleep(self.chunk)
+                yield _Text(f"{digest[i * 4:i * 4 + 4]} ")
+        finally:
+            if self.timer is not None:
+                self.timer.add("llm", time.perf_counter() - started)
+
+    def generate_content(self, prompt, stream=False):
+        if stream:
+            return self._stream(prompt)
+        return _Text("".join(chunk.text for chunk in self._stream(prompt)))
+
+
+class HashEmbeddingModel:
+    """
+    --fake-embedder: deterministic unit vectors seeded by each text's hash, encode_ms per
+    encode call. For measuring everything but the model on machines without MiniLM.
+    """
+
+    def __init__(self, encode_ms=0.0, dim=EMBEDDING_DIM):
+        self.encode_time = encode_ms / 1000.0
+        self.dim = dim
+
+    def encode(self, texts, **kwargs):
+        single = isinstance(texts, str)
+        rows = []
+        for text in [texts] if single else texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            row = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            rows.append(row / np.linalg.norm(row))
+        time.sleep(self.encode_time)
+        matrix = np.stack(rows)
+        return matrix[0] if single else matrix
+
+
+def load_embedding_model(fake, encode_ms=0.0):
+    if fake:
+        return HashEmbeddingModel(encode_ms)
+    # EMBED_BACKEND picks PyTorch or int8 ONNX, as in the service
+    return get_embedding_model()
+
+
+# -------- Stage timing --------
+class StageTimer:
+    """Accumulates time per stage for the query running on the current thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.stages = defaultdict(float)
+
+    def finish(self):
+        stages, self._local.stages = self._local.stages, None
+        return dict(stages)
+
+    def add(self, stage, seconds):
+        stages = getattr(self._local, "stages", None)
+        if stages is not None:
+            stages[stage] += seconds
+
+    def wrap(self, stage, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+
+class StandIns:
+    """Starts the stand-ins and points the shared DB pool and module hooks at them; close() undoes it."""
+
+    def __init__(self, args, timer):
+        self.args = args
+        self.timer = timer
+        self.model = load_embedding_model(args.fake_embedder, args.encode_ms)
+        self.pinecone = FakePinecone(args.vector_latency_ms, args.vector_error_rate, args.vector_slow_rate,
+                                     args.vector_slow_ms, args.seed).start()
+        self.database = LocalInvoiceDB(args.db_latency_ms)
+        self.database.load(make_invoices(args.invoices, args.seed))
+        self._cache_dir = tempfile.TemporaryDirectory(prefix="gst-bench-")
+        self._patched = []
+
+        # Index the rules the way setup_vector_db does, through the REST client
+        store = PineconeVectorStore(host=self.pinecone.url)
+        chunks = list(iter_chunks())
+        vectors = np.asarray(self.model.encode(chunks), dtype=np.float32)
+        store.upsert_batch([{"id": chunk_id(c), "values": v.tolist(), "metadata": {"text": c}}
+                            for c, v in zip(chunks, vectors)])
+
+        pool = get_pool()
+        pool.close()
+        self._patch(pool, "connect", self.database.connect)
+        self._patch(pool, "execute_prepared", timer.wrap("sql", pool.execute_prepared))
+        self._patch(formatters, "format_result", timer.wrap("format", formatters.format_result))
+        self._patch(gst_calculator, "calculate_paise", timer.wrap("calc", gst_calculator.calculate_paise))
+        if args.sql_batch_ms > 0:
+            agent_invoice_sql.enable_lookup_batching(args.sql_batch_ms)
+
+    def _patch(self, owner, name, value):
+        self._patched.append((owner, name, owner.__dict__.get(name, _MISSING)))
+        setattr(owner, name, value)
+
+    def build_system(self):
+        """A fresh OrchestratorAgent (cold caches) wired to the stand-ins, embedder loaded as in server.py."""
+        with contextlib.redirect_stdout(io.StringIO()):
+            rag = GSTRagAgent()
+        rag.vector_store = PineconeVectorStore(host=self.pinecone.url)
+        rag.vector_store.query = self.timer.wrap("vector_query", rag.vector_store.query)
+        # ttl -1 makes every lookup miss
+        rag.response_cache = ResponseCache(path=os.path.join(self._cache_dir.name, f"{time.monotonic_ns()}.sqlite"),
+                                           ttl=-1 if self.args.no_llm_cache else 7 * 24 * 3600)
+        rag._model = self.model
+        rag.embedder.embed = self.timer.wrap("embed", rag.embedder.embed)
+        rag._llm_model = StubLLM(self.args.llm_first_chunk_ms, self.args.llm_chunk_ms, timer=self.timer)
+        rag._llm_available = True
+
+        system = OrchestratorAgent()
+        system._rag_agent = rag
+        system.rate_index.answer = self.timer.wrap("rate_index", system.rate_index.answer)
+        return system
+
+    def close(self):
+        for owner, name, original in reversed(self._patched):
+            if original is _MISSING:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        get_pool().close()
+        self.pinecone.stop()
+        self._cache_dir.cleanup()
+
+
+_MISSING = object()
+
+
+# -------- Running --------
+def load_corpus(path=DEFAULT_CORPUS):
+    """JSON lines of {"intent": <reporting group>, "query": "..."}, replayed in file order."""
+    with open(path, "r", encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    for item in corpus:
+        item.setdefault("intent", "unlabelled")
+    return corpus
+
+
+def percentiles(seconds):
+    if not seconds:
+        return None
+    ms = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"count": len(ms), "mean_ms": round(float(ms.mean()), 2), "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2), "max_ms": round(float(ms.max()), 2)}
+
+
+def _stage_summary(samples):
+    stages = defaultdict(list)
+    for total, timed in samples:
+        for stage, seconds in timed.items():
+            stages[stage].append(seconds)
+        stages["other"].append(max(total - sum(timed.values()), 0.0))
+    return {stage: percentiles(values) for stage, values in sorted(stages.items())}
+
+
+def run_level(system, corpus, concurrency, repeat, timer, verbose=False):
+    """Replays corpus repeat times with concurrency queries in flight; returns one result level."""
+    jobs = [item for _ in range(repeat) for item in corpus]
+
+    def one(item):
+        timer.start()
+        started = time.perf_counter()
+        error = None
+        try:
+            system.run(item["query"])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return item["intent"], time.perf_counter() - started, timer.finish(), error
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with output, ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+        results = list(pool.map(one, jobs))
+    wall = time.perf_counter() - started
+
+    by_intent = defaultdict(list)
+    for intent, total, timed, error in results:
+        by_intent[intent].append((total, timed, error))
+
+    intents = {}
+    for intent, rows in sorted(by_intent.items()):
+        intents[intent] = {
+            **percentiles([total for total, _, _ in rows]),
+            "errors": sum(1 for _, _, error in rows if error),
+            "throughput_qps": round(len(rows) / wall, 2),
+            "stages": _stage_summary([(total, timed) for total, timed, _ in rows])
+        }
+    errors = sorted({error for _, _, _, error in results if error})
+    return {
+        "concurrency": concurrency,
+        "queries": len(results),
+        "wall_s": round(wall, 3),
+        "throughput_qps": round(len(results) / wall, 2),
+        "errors": sum(1 for *_, error in results if error),
+        "error_samples": errors[:5],
+        "latency": percentiles([total for _, total, _, _ in results]),
+        "stages": _stage_summary([(total, timed) for _, total, timed, _ in results]),
+        "intents": intents
+    }
+
+
+def run_benchmark(args):
+    corpus = load_corpus(args.corpus)
+    timer = StageTimer()
+    stand_ins = StandIns(args, timer)
+    try:
+        levels = []
+        for concurrency in args.concurrency:
+            system = stand_ins.build_system()
+            try:
+                levels.append(run_level(system, corpus, concurrency, args.repeat, timer, args.verbose))
+                levels[-1]["vector_store"] = system._rag_agent.vector_store.stats()
+            finally:
+                system.close()
+    finally:
+        stand_ins.close()
+
+    with open(args.corpus, "rb") as f:
+        corpus_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+    return {
+        "version": 1,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "corpus": args.corpus,
+            "corpus_sha256": corpus_hash,
+            "corpus_queries": len(corpus),
+            "repeat": args.repeat,
+            "invoices": args.invoices,
+            "seed": args.seed,
+            "embedder": "hash" if args.fake_embedder else f"MiniLM ({EMBED_BACKEND})",
+            "encode_ms": args.encode_ms,
+            "vector_latency_ms": args.vector_latency_ms,
+            "vector_error_rate": args.vector_error_rate,
+            "vector_slow_rate": args.vector_slow_rate,
+            "vector_slow_ms": args.vector_slow_ms,
+            "db_latency_ms": args.db_latency_ms,
+            "llm_first_chunk_ms": args.llm_first_chunk_ms,
+            "llm_chunk_ms": args.llm_chunk_ms,
+            "llm_cache": not args.no_llm_cache,
+            "sql_batch_ms": args.sql_batch_ms
+        },
+        "levels": levels
+    }
+
+
+# -------- Reporting --------
+def print_report(report):
+    for level in report["levels"]:
+        print(f"\n=== concurrency {level['concurrency']}: {level['queries']} queries in {level['wall_s']}s, "
+              f"{level['throughput_qps']} q/s, {level['errors']} errors ===")
+        print(f"{'intent':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'q/s':>9}{'errors':>8}")
+        rows = list(level["intents"].items()) + [("ALL", {**level["latency"], "throughput_qps": level["throughput_qps"],
+                                                         "errors": level["errors"]})]
+        for intent, stats in rows:
+            print(f"{intent:<20}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+                  f"{stats['p99_ms']:>10.1f}{stats['throughput_qps']:>9.1f}{stats['errors']:>8}")
+        stages = ", ".join(f"{stage} p50 {s['p50_ms']:.1f} / p95 {s['p95_ms']:.1f} ms (n={s['count']})"
+                           for stage, s in level["stages"].items())
+        print(f"stages: {stages}")
+        vector = level.get("vector_store") or {}
+        if vector.get("client"):
+            client = vector["client"]
+            print(f"vector client: {client['retries']} retries, {client['hedged']} hedged ({client['hedge_wins']} won), "
+                  f"{client['failed']} failed, breaker {client['breaker']}; fallbacks {vector['fallbacks']}")
+        for sample in level["error_samples"]:
+            print(f"error: {sample}")
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    Regressions of current against baseline, per concurrency level: intent p95 more than
+    tolerance (0.1 = 10%) and MIN_REGRESSION_MS slower, throughput more than tolerance lower,
+    or new errors. Returns a list of human-readable lines; empty means no regression.
+    """
+    regressions = []
+    base_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in current["levels"]:
+        base = base_levels.get(level["concurrency"])
+        if base is None:
+            continue
+        c = level["concurrency"]
+        if level["throughput_qps"] < base["throughput_qps"] * (1 - tolerance):
+            regressions.append(f"c={c}: throughput {base['throughput_qps']} -> {level['throughput_qps']} q/s")
+        if level["errors"] > base["errors"]:
+            regressions.append(f"c={c}: errors {base['errors']} -> {level['errors']}")
+        for intent, stats in level["intents"].items():
+            old = base["intents"].get(intent)
+            if old is None:
+                continue
+            if stats["p95_ms"] > old["p95_ms"] * (1 + tolerance) + MIN_REGRESSION_MS:
+                regressions.append(f"c={c} {intent}: p95 {old['p95_ms']} -> {stats['p95_ms']} ms")
+    return regressions
+
+
+def _concurrency_levels(text):
+    return [int(level) for level in text.split(",") if level.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of OrchestratorAgent.run.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSON lines of {\"intent\", \"query\"}")
+    parser.add_argument("--repeat", type=int, default=5, help="replays of the corpus per concurrency level")
+    parser.add_argument("--concurrency", type=_concurrency_levels, default=[1],
+                        help="comma-separated sweep, e.g. 1,4,16,64")
+    parser.add_argument("--invoices", type=int, default=5000, help="synthetic invoices besides the sample CSV")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fake-embedder", action="store_true", help="hash vectors instead of MiniLM")
+    parser.add_argument("--encode-ms", type=float, default=0.0, help="per-call delay of --fake-embedder")
+    parser.add_argument("--vector-latency-ms", type=float, default=20.0)
+    parser.add_argument("--vector-error-rate", type=float, default=0.0, help="share of vector queries answered 503")
+    parser.add_argument("--vector-slow-rate", type=float, default=0.0, help="share of vector queries delayed")
+    parser.add_argument("--vector-slow-ms", type=float, default=0.0, help="extra delay of a slow vector query")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--llm-first-chunk-ms", type=float, default=400.0)
+    parser.add_argument("--llm-chunk-ms", type=float, default=25.0)
+    parser.add_argument("--no-llm-cache", action="store_true", help="every LLM call misses the response cache")
+    parser.add_argument("--sql-batch-ms", type=float, default=0.0, help="enable the SQL lookup batcher (as server.py)")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative slack for --compare")
+    parser.add_argument("--verbose", action="store_true", help="keep the agents' console output")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nReport written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) against {args.compare}:")
+            for line in regressions:
+                print(f"- {line}")
+            return 1
+        print(f"\n✅ No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.errors
+from dotenv import load_dotenv
+import tracing
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+DB_CONFIG = {
+    "dbname": os.getenv("DB_NAME", "gst_invoice_db"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD"),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": os.getenv("DB_PORT", "5432")
+}
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))              # seconds to wait for a free connection
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+DB_CONN_MAX_AGE = float(os.getenv("DB_CONN_MAX_AGE", "1800"))            # recycle connections older than this
+# -------------------------
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def get_db_connection():
+    """Plain unpooled connection, for one-off scripts."""
+    return psycopg2.connect(**DB_CONFIG)
+
+
+def to_server_placeholders(sql):
+    # psycopg2 uses %s client-side; PREPARE wants $1, $2, ...
+    counter = iter(range(1, sql.count("%s") + 1))
+    return re.sub(r"%s", lambda _: f"${next(counter)}", sql)
+
+
+class ConnectionPool:
+    """
+    Thread-safe LIFO pool of psycopg2 connections. Checkout blocks (up to timeout) when all
+    maxconn connections are in use, every session gets a statement timeout, and registered
+    statements are PREPAREd once per connection.
+    (psycopg2.pool closes everything above minconn on return, which defeats the point here.)
+    """
+
+    def __init__(self, config=DB_CONFIG, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS, max_age=DB_CONN_MAX_AGE, connect=None):
+        self.config = config
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.statement_timeout_ms = statement_timeout_ms
+        self.max_age = max_age
+        # Zero-argument factory for new connections; benchmark.py swaps in a local stand-in
+        self.connect = connect or self._connect
+
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._statements = {}     # name -> server-side SQL
+        self._versions = {}       # name -> version, bumped when a statement must be re-planned
+        self._prepared = {}       # conn -> {name: version prepared on that connection}
+        self._born = {}           # conn -> creation time
+
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.recycled = 0
+
+    def _connect(self):
+        return psycopg2.connect(options=f"-c statement_timeout={self.statement_timeout_ms}", **self.config)
+
+    def _checkout(self):
+        # Caller holds a slot, so there is always an idle connection or room for a new one
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    return conn
+                self._forget(conn)
+        conn = self.connect()
+        with self._lock:
+            self._born[conn] = time.time()
+            self._prepared[conn] = {}
+        return conn
+
+    def _forget(self, conn):
+        self._born.pop(conn, None)
+        self._prepared.pop(conn, None)
+
+    def prepare(self, name, sql):
+        """Registers a statement to be PREPAREd on each pooled connection."""
+        server_sql = to_server_placeholders(sql)
+        # Statements can be registered while other threads check out connections
+        with self._lock:
+            self._statements[name] = server_sql
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def _prepare_missing(self, conn):
+        # Snapshot under the lock: the connection is marked with the versions it actually PREPAREd
+        with self._lock:
+            versions = dict(self._versions)
+            statements = dict(self._statements)
+        done = self._prepared[conn]
+        stale = [name for name, version in versions.items() if done.get(name) != version]
+        if not stale:
+            return
+        with conn.cursor() as cursor:
+            for name in stale:
+                if name in done:
+                    cursor.execute(f"DEALLOCATE {name}")
+                cursor.execute(f"PREPARE {name} AS {statements[name]}")
+        conn.commit()
+        done.update((name, versions[name]) for name in stale)
+
+    @contextmanager
+    def connection(self, statement_timeout_ms=None):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            tracing.record("sql_connect", started, error="PoolTimeout")
+            raise PoolTimeout(f"No database connection free after {self.timeout}s")
+
+        conn = None
+        discard = False
+        try:
+            conn = self._checkout()
+            waited = time.perf_counter() - started
+            with self._lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+            self._prepare_missing(conn)
+            if statement_timeout_ms is not None:
+                with conn.cursor() as cursor:
+                    # SET LOCAL ends with the transaction, so the pooled session keeps its default
+                    cursor.execute("SET LOCAL statement_timeout = %s", (statement_timeout_ms,))
+            # Slot wait + checkout (+ connect) + any PREPAREs still missing on this connection
+            tracing.record("sql_connect", started, waited_ms=round(1000 * waited, 3))
+
+            yield conn
+            conn.commit()
+        except Exception:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+            raise
+        finally:
+            if conn is not None:
+                with self._lock:
+                    discard = discard or conn.closed or time.time() - self._born.get(conn, 0) > self.max_age
+                    if discard:
+                        self.recycled += 1
+                        self._forget(conn)
+                    else:
+                        self._idle.append(conn)
+                if discard and not conn.closed:
+                    conn.close()
+            self._slots.release()
+
+    def execute_prepared(self, name, params=()):
+        """Runs a registered statement and returns rows as dicts."""
+        try:
+            return self._execute_prepared(name, params)
+        except psycopg2.errors.FeatureNotSupported:
+            # "cached plan must not change result type": the table was altered under a
+            # SELECT * statement. Re-prepare it everywhere and try once more.
+            with self._lock:
+                self._versions[name] += 1
+            return self._execute_prepared(name, params)
+
+    def _execute_prepared(self, name, params):
+        with self.connection() as conn:
+            with conn.cursor() as cursor, tracing.span("sql_execute", statement=name) as attrs:
+                if params:
+                    placeholders = ", ".join(["%s"] * len(params))
+                    cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+                else:
+                    cursor.execute(f"EXECUTE {name}")
+                rows = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description]
+                attrs["rows"] = len(rows)
+        return [dict(zip(columns, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            for conn in idle:
+                self._forget(conn)
+        for conn in idle:
+            conn.close()
+
+    def metrics(self):
+        now = time.time()
+        with self._lock:
+            ages = [now - born for born in self._born.values()]
+            return {
+                "checkouts": self.checkouts,
+                "wait_avg_ms": 1000 * self.wait_total / self.checkouts if self.checkouts else 0.0,
+                "wait_max_ms": 1000 * self.wait_max,
+                "timeouts": self.timeouts,
+                "recycled": self.recycled,
+                "connections": len(ages),
+                "idle": len(self._idle),
+                "connection_age_max_s": max(ages) if ages else 0.0,
+                "connection_age_avg_s": sum(ages) / len(ages) if ages else 0.0
+            }
+
+
+# Columns added after the original schema (see README); created on demand by the ingesters
+INVOICE_EXTRA_COLUMNS_DDL = """
+ALTER TABLE invoices ADD COLUMN IF NOT EXISTS invoice_date DATE;
+ALTER TABLE invoices ADD COLUMN IF NOT EXISTS vendor VARCHAR(200);
+ALTER TABLE invoices ADD COLUMN IF NOT EXISTS source_file TEXT;
+"""
+
+
+def ensure_invoice_columns():
+    with get_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(INVOICE_EXTRA_COLUMNS_DDL)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide pool shared by the SQL agent and the ingesters."""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = ConnectionPool()
+    return _default_pool
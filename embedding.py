@@ -0,0 +1,142 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+import tracing
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "1024"))
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))  # 0 disables micro-batching
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+# -------------------------
+
+
+def normalize_query(text):
+    # MiniLM's tokenizer is uncased, so case and spacing don't change the embedding
+    return " ".join(text.lower().split())
+
+
+class _PendingEncode:
+    def __init__(self, key):
+        self.key = key
+        self.vector = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class QueryEmbedder:
+    """
+    Wraps an embedding model (embedding_models.py) with a bounded LRU cache of query
+    embeddings and a micro-batcher: concurrent cache misses are collected for up to
+    batch_window_ms and encoded in one model.encode call.
+    """
+
+    def __init__(self, model, cache_size=EMBED_CACHE_SIZE, batch_window_ms=EMBED_BATCH_WINDOW_MS,
+                 max_batch=EMBED_MAX_BATCH):
+        self.model = model
+        self.cache_size = cache_size
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+        self.hits = 0
+        self.misses = 0
+        self.batch_sizes = Counter()
+
+    def embed(self, text):
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                tracing.count("cache_lookups_total", cache="embedding", result="hit")
+                return vector
+            self.misses += 1
+        tracing.count("cache_lookups_total", cache="embedding", result="miss")
+
+        # Includes the wait for the micro-batch window
+        with tracing.span("embed"):
+            vector = self._encode(key)
+
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vector
+
+    def _encode(self, key):
+        if self.batch_window <= 0:
+            vector = self._encode_batch([key])[0]
+            self.batch_sizes[1] += 1
+            return vector
+
+        pending = _PendingEncode(key)
+        self._ensure_worker()
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.vector
+
+    def _encode_batch(self, texts):
+        vectors = np.asarray(self.model.encode(texts), dtype=np.float32)
+        # Cached rows are handed to many callers; keep them read-only
+        vectors.setflags(write=False)
+        return vectors
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # The same query can miss twice before the first result lands; encode it once
+            texts = list(dict.fromkeys(p.key for p in batch))
+            try:
+                vectors = dict(zip(texts, self._encode_batch(texts)))
+                for p in batch:
+                    p.vector = vectors[p.key]
+            except Exception as e:
+                for p in batch:
+                    p.error = e
+            self.batch_sizes[len(texts)] += 1
+            for p in batch:
+                p.done.set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "cached": len(self._cache),
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items()))
+            }
@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")                  # "torch" or "onnx"
+EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", "models/all-MiniLM-L6-v2-onnx")
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))                 # intra-op threads; 0 = runtime default
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))          # texts per forward pass
+EMBED_PARITY_TOLERANCE = float(os.getenv("EMBED_PARITY_TOLERANCE", "0.05"))
+# -------------------------
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+MAX_SEQ_LENGTH = 256          # all-MiniLM-L6-v2's sentence-transformers limit
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+ONNX_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+class OnnxEmbeddingModel:
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime: int8 dynamically quantized weights, mean pooling over
+    the attention mask and L2 normalization, as the sentence-transformers pipeline does.
+    encode() has the same shape as SentenceTransformer.encode for the callers here.
+    """
+
+    def __init__(self, model_dir=EMBED_ONNX_DIR, threads=EMBED_THREADS, batch_size=EMBED_BATCH_SIZE,
+                 quantized=True):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = os.path.join(model_dir, ONNX_INT8_FILE if quantized else ONNX_MODEL_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found. Run: python embedding_models.py export --output {model_dir}")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+        self.path = path
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        batch_size = batch_size or self.batch_size
+        out = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+
+        # Similar lengths per batch keep padding (wasted compute) down
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            out[idx] = self._encode_batch([texts[i] for i in idx])
+        return out[0] if single else out
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+        mask = feeds["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+
+def get_embedding_model(backend=None):
+    backend = (backend or EMBED_BACKEND).lower()
+    if backend == "onnx":
+        print(f"Loading embedding model {MODEL_NAME} (ONNX int8, {EMBED_ONNX_DIR})...")
+        return OnnxEmbeddingModel()
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        if EMBED_THREADS > 0:
+            import torch
+            torch.set_num_threads(EMBED_THREADS)
+        print(f"Loading embedding model {MODEL_NAME}...")
+        return SentenceTransformer(MODEL_NAME)
+    raise ValueError(f"Unknown EMBED_BACKEND '{backend}'. Use 'torch' or 'onnx'.")
+
+
+def export_onnx(output_dir=EMBED_ONNX_DIR, opset=14):
+    """Exports the transformer of all-MiniLM-L6-v2 to ONNX and writes an int8 copy next to it."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(MODEL_NAME, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    st_model.tokenizer.save_pretrained(output_dir)    # writes tokenizer.json
+
+    sample = st_model.tokenizer(["GST rate for mobile phones"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    dynamic = {"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"},
+               "token_type_ids": {0: "batch", 1: "seq"}, "last_hidden_state": {0: "batch", 1: "seq"}}
+    with torch.no_grad():
+        torch.onnx.export(transformer, tuple(sample[name] for name in ONNX_INPUTS), fp32_path,
+                          input_names=list(ONNX_INPUTS), output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic, opset_version=opset)
+
+    int8_path = os.path.join(output_dir, ONNX_INT8_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"✅ Exported {fp32_path} ({os.path.getsize(fp32_path) / 1e6:.1f} MB) and "
+          f"{int8_path} ({os.path.getsize(int8_path) / 1e6:.1f} MB)")
+    return int8_path
+
+
+def parity_texts():
+    """Rule chunks plus the benchmark's queries: the text the model actually sees here."""
+    from setup_vector_db import iter_chunks
+    texts = list(iter_chunks())
+    if os.path.exists("benchmark_queries.jsonl"):
+        with open("benchmark_queries.jsonl", "r", encoding="utf-8") as f:
+            texts += [json.loads(line)["query"] for line in f if line.strip()]
+    return texts
+
+
+def parity_check(reference, candidate, texts, tolerance=EMBED_PARITY_TOLERANCE):
+    """
+    Compares two models on texts. Passes when every text's embedding from candidate has
+    cosine >= 1 - tolerance with reference's, and no pairwise text-to-text similarity
+    (what retrieval ranks by) moves by more than tolerance.
+    """
+    ref = np.asarray(reference.encode(texts), dtype=np.float32)
+    cand = np.asarray(candidate.encode(texts), dtype=np.float32)
+    ref /= np.maximum(np.linalg.norm(ref, axis=1, keepdims=True), 1e-12)
+    cand /= np.maximum(np.linalg.norm(cand, axis=1, keepdims=True), 1e-12)
+
+    self_cosine = (ref * cand).sum(axis=1)
+    ref_sim, cand_sim = ref @ ref.T, cand @ cand.T
+    pairwise_drift = np.abs(ref_sim - cand_sim)
+    # Share of texts whose nearest other text is the same under both models
+    np.fill_diagonal(ref_sim, -np.inf)
+    np.fill_diagonal(cand_sim, -np.inf)
+    top1 = float(np.mean(ref_sim.argmax(axis=1) == cand_sim.argmax(axis=1))) if len(texts) > 1 else 1.0
+
+    return {
+        "texts": len(texts),
+        "min_cosine": round(float(self_cosine.min()), 5),
+        "mean_cosine": round(float(self_cosine.mean()), 5),
+        "max_pairwise_drift": round(float(pairwise_drift.max()), 5),
+        "top1_agreement": round(top1, 4),
+        "tolerance": tolerance,
+        "passed": bool(self_cosine.min() >= 1 - tolerance and pairwise_drift.max() <= tolerance)
+    }
+
+
+def _rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def measure_backend(backend, texts, batch_size=EMBED_BATCH_SIZE, seconds=5.0):
+    """Encodes/sec for single queries and for batches, plus peak RSS, of one backend in this process."""
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    model = get_embedding_model(backend)
+    load_s = time.perf_counter() - started
+    model.encode(texts[:batch_size])     # warm-up
+
+    def rate(batch):
+        done = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            for i in range(0, len(texts), batch):
+                model.encode(texts[i:i + batch], batch_size=batch)
+            done += len(texts)
+        return done / (time.perf_counter() - started)
+
+    return {
+        "backend": backend,
+        "threads": EMBED_THREADS or "default",
+        "load_s": round(load_s, 2),
+        "single_per_s": round(rate(1), 1),
+        f"batch{batch_size}_per_s": round(rate(batch_size), 1),
+        "peak_rss_mb": round(_rss_mb(), 1),
+        "python_rss_mb": round(rss_before, 1)
+    }
+
+
+def benchmark(backends=("torch", "onnx"), batch_size=EMBED_BATCH_SIZE, seconds=5.0):
+    """Runs measure_backend for each backend in its own process, so RSS isn't shared."""
+    results = []
+    for backend in backends:
+        cmd = [sys.executable, __file__, "measure", "--backend", backend,
+               "--batch-size", str(batch_size), "--seconds", str(seconds)]
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embedding backends: ONNX export, parity check, benchmark.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export MiniLM to ONNX and quantize it to int8")
+    export.add_argument("--output", default=EMBED_ONNX_DIR)
+    parity = commands.add_parser("parity", help="compare ONNX int8 against PyTorch embeddings")
+    parity.add_argument("--tolerance", type=float, default=EMBED_PARITY_TOLERANCE)
+    for name in ("bench", "measure"):
+        bench = commands.add_parser(name, help="encodes/sec and peak RSS per backend" if name == "bench" else None)
+        bench.add_argument("--backend", default="torch,onnx" if name == "bench" else EMBED_BACKEND)
+        bench.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+        bench.add_argument("--seconds", type=float, default=5.0, help="time per measurement")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        export_onnx(args.output)
+    elif args.command == "parity":
+        result = parity_check(get_embedding_model("torch"), get_embedding_model("onnx"), parity_texts(),
+                              args.tolerance)
+        print(json.dumps(result, indent=2))
+        return 0 if result["passed"] else 1
+    elif args.command == "measure":
+        # Child of "bench": the last stdout line is the result
+        print(json.dumps(measure_backend(args.backend, parity_texts(), args.batch_size, args.seconds)))
+    else:
+        results = benchmark(args.backend.split(","), args.batch_size, args.seconds)
+        key = f"batch{args.batch_size}_per_s"
+        print(f"{'backend':<10}{'load s':>8}{'single/s':>11}{key:>16}{'peak RSS MB':>14}")
+        for r in results:
+            print(f"{r['backend']:<10}{r['load_s']:>8}{r['single_per_s']:>11}{r[key]:>16}{r['peak_rss_mb']:>14}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
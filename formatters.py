@@ -0,0 +1,297 @@
+import os
+import threading
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+FAST_FORMAT = os.getenv("FAST_FORMAT", "1") == "1"    # 0 sends every structured answer to the LLM
+# Comma-separated intents that should keep LLM formatting, e.g. "GET_INVOICE_BY_ID,CALCULATION"
+FAST_FORMAT_DISABLE = {i.strip() for i in os.getenv("FAST_FORMAT_DISABLE", "").split(",") if i.strip()}
+# -------------------------
+
+# Deterministic renderers for the structured results of the SQL agent and the calculator.
+# Each is registered for an (intent, result shape) pair; anything without a renderer
+# returns None and the caller falls back to GSTRagAgent.format_with_llm.
+
+LIST_LIMIT = 20   # invoices spelled out in one answer; the rest are summarized
+
+_registry = {}
+_enabled = {}
+_lock = threading.Lock()
+rendered = Counter()
+fallbacks = Counter()
+
+
+def formatter(intent, shape):
+    """Registers fn(raw, ids) -> str for intent ("*" for any) and result shape."""
+    def register(fn):
+        _registry[(intent, shape)] = fn
+        return fn
+    return register
+
+
+def set_enabled(intent, enabled=True):
+    """Per-intent toggle at runtime; overrides FAST_FORMAT / FAST_FORMAT_DISABLE."""
+    _enabled[intent] = enabled
+
+
+def is_enabled(intent):
+    return _enabled.get(intent, FAST_FORMAT and intent not in FAST_FORMAT_DISABLE)
+
+
+def result_shape(raw):
+    if isinstance(raw, dict):
+        if "error" in raw:
+            return "error"
+        if raw.get("action") == "Calculated GST for Invoice":
+            return "calculation"
+        if raw.get("action") == "Calculated GST for Invoices":
+            return "calculation_batch"
+        if not raw:
+            return "empty"
+        if all(v is None or isinstance(v, dict) for v in raw.values()):
+            return "by_id"
+        return None
+    if isinstance(raw, list):
+        if not raw:
+            return "empty"
+        if all(isinstance(row, dict) for row in raw):
+            return "rows"
+    return None
+
+
+def format_result(intent, raw, ids=()):
+    """Renders raw locally, or returns None when the shape is unknown or the intent is toggled off."""
+    if not is_enabled(intent):
+        return None
+    shape = result_shape(raw)
+    fn = _registry.get((intent, shape)) or _registry.get(("*", shape))
+    with _lock:
+        (rendered if fn else fallbacks)[intent] += 1
+    if fn is None:
+        return None
+    return fn(raw, [str(i) for i in ids])
+
+
+def stats():
+    with _lock:
+        return {"rendered": dict(rendered), "llm_fallbacks": dict(fallbacks)}
+
+
+# -------- Helpers --------
+def format_inr(value):
+    """1234567.5 -> '₹12,34,567.50' (Indian digit grouping)."""
+    try:
+        amount = Decimal(str(value)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return str(value)
+    sign = "-" if amount < 0 else ""
+    whole, fraction = f"{abs(amount):.2f}".split(".")
+    if len(whole) > 3:
+        head, tail = whole[:-3], whole[-3:]
+        groups = []
+        while len(head) > 2:
+            groups.insert(0, head[-2:])
+            head = head[:-2]
+        whole = ",".join(([head] if head else []) + groups + [tail])
+    return f"{sign}₹{whole}.{fraction}"
+
+
+def _invoices_count(n, kind=""):
+    return f"{n} {kind}invoice{'' if n == 1 else 's'}"
+
+
+def _rate(value):
+    return f"{float(value):g}%"
+
+
+def _listing(lines, total):
+    text = "\n".join(f"- {line}" for line in lines[:LIST_LIMIT])
+    if total > LIST_LIMIT:
+        text += f"\n- ... and {total - LIST_LIMIT} more"
+    return text
+
+
+def _invoice_summary(row):
+    parts = [f"total {format_inr(row.get('total_amount'))}", f"tax {format_inr(row.get('tax_amount'))}"]
+    if row.get("supplier_state") or row.get("buyer_state"):
+        parts.append(f"{row.get('supplier_state') or '?'} → {row.get('buyer_state') or '?'}")
+    if row.get("invoice_date"):
+        parts.append(f"dated {row['invoice_date']}")
+    if row.get("vendor"):
+        parts.append(f"vendor {row['vendor']}")
+    return ", ".join(parts)
+
+
+def _missing_note(raw):
+    missing = [i for i, row in raw.items() if row is None]
+    if not missing:
+        return ""
+    shown = ", ".join(missing[:LIST_LIMIT]) + (" ..." if len(missing) > LIST_LIMIT else "")
+    return f"\nNot found: {shown}."
+
+
+# -------- Any intent --------
+@formatter("*", "empty")
+def _empty(raw, ids):
+    if len(ids) == 1:
+        return f"Invoice {ids[0]} was not found."
+    return "No matching invoices were found."
+
+
+@formatter("*", "error")
+def _error(raw, ids):
+    return f"Sorry, I couldn't look that up: {raw['error']}."
+
+
+# -------- SQL intents --------
+def _single_amount(column, label):
+    def render(raw, ids):
+        value = raw[0].get(column)
+        invoice = ids[0] if ids else raw[0].get("invoice_id")
+        if value is None:
+            return f"No {label} is recorded for invoice {invoice}."
+        return f"The {label} for invoice {invoice} is {format_inr(value)}."
+    return render
+
+
+def _batch_amounts(column, label):
+    def render(raw, ids):
+        found = {i: row for i, row in raw.items() if row is not None}
+        if not found:
+            return _empty({}, ids)
+        total = sum(Decimal(str(row[column])) for row in found.values() if row.get(column) is not None)
+        lines = [f"Invoice {i}: {format_inr(row.get(column))}" for i, row in found.items()]
+        return (f"{label.capitalize()} for {_invoices_count(len(found))} (combined {format_inr(total)}):\n"
+                f"{_listing(lines, len(lines))}{_missing_note(raw)}")
+    return render
+
+
+formatter("GET_TOTAL_AMOUNT", "rows")(_single_amount("total_amount", "total amount"))
+formatter("GET_TAX_AMOUNT", "rows")(_single_amount("tax_amount", "tax amount"))
+formatter("GET_TOTAL_AMOUNT", "by_id")(_batch_amounts("total_amount", "total amounts"))
+formatter("GET_TAX_AMOUNT", "by_id")(_batch_amounts("tax_amount", "tax amounts"))
+
+
+@formatter("GET_INVOICE_BY_ID", "rows")
+def _invoice(raw, ids):
+    row = raw[0]
+    return f"Invoice {row.get('invoice_id')}: {_invoice_summary(row)}."
+
+
+@formatter("GET_INVOICE_BY_ID", "by_id")
+def _invoices(raw, ids):
+    found = {i: row for i, row in raw.items() if row is not None}
+    if not found:
+        return _empty({}, ids)
+    lines = [f"Invoice {i}: {_invoice_summary(row)}" for i, row in found.items()]
+    return f"Found {_invoices_count(len(found))}:\n{_listing(lines, len(lines))}{_missing_note(raw)}"
+
+
+@formatter("GET_INTERSTATE_INVOICES", "rows")
+def _interstate(raw, ids):
+    lines = [f"Invoice {row.get('invoice_id')}: {_invoice_summary(row)}" for row in raw[:LIST_LIMIT]]
+    return f"Found {_invoices_count(len(raw), 'interstate ')}:\n{_listing(lines, len(raw))}"
+
+
+@formatter("GET_INTERSTATE_INVOICES", "empty")
+def _no_interstate(raw, ids):
+    return "There are no interstate invoices."
+
+
+# -------- Analytics (invoice_daily_summary) --------
+def _month(value):
+    return value.strftime("%b %Y") if hasattr(value, "strftime") else str(value)[:7]
+
+
+def _sum(raw, column):
+    return sum(Decimal(str(row[column])) for row in raw if row.get(column) is not None)
+
+
+@formatter("GET_TAX_BY_STATE", "rows")
+def _tax_by_state(raw, ids):
+    lines = [f"{row['state']}: tax {format_inr(row['tax_amount'])} on {_invoices_count(int(row['invoice_count']))} "
+             f"(total {format_inr(row['total_amount'])})" for row in raw]
+    return (f"Tax collected by supplier state, {format_inr(_sum(raw, 'tax_amount'))} in all:\n"
+            f"{_listing(lines, len(lines))}")
+
+
+@formatter("GET_MONTHLY_TAX", "rows")
+def _monthly_tax(raw, ids):
+    lines = [f"{_month(row['month'])}: IGST {format_inr(row['igst_amount'])}, CGST + SGST "
+             f"{format_inr(row['cgst_sgst_amount'])}, total tax {format_inr(row['tax_amount'])} "
+             f"({_invoices_count(int(row['invoice_count']))})" for row in raw]
+    return (f"Monthly GST liability (IGST {format_inr(_sum(raw, 'igst_amount'))}, "
+            f"total {format_inr(_sum(raw, 'tax_amount'))}):\n{_listing(lines, len(lines))}")
+
+
+@formatter("GET_SUPPLY_TYPE_SUMMARY", "rows")
+def _supply_types(raw, ids):
+    lines = [f"{row['supply_type'].capitalize()}: tax {format_inr(row['tax_amount'])} on "
+             f"{_invoices_count(int(row['invoice_count']))} (total {format_inr(row['total_amount'])})" for row in raw]
+    return f"Tax by supply type:\n{_listing(lines, len(lines))}"
+
+
+def _no_totals(raw, ids):
+    return "No invoices have been loaded yet, so there are no totals to report."
+
+
+formatter("GET_TAX_BY_STATE", "empty")(_no_totals)
+formatter("GET_SUPPLY_TYPE_SUMMARY", "empty")(_no_totals)
+
+
+@formatter("GET_MONTHLY_TAX", "empty")
+def _no_monthly_totals(raw, ids):
+    return "No dated invoices have been loaded yet, so there are no monthly totals to report."
+
+
+# -------- Receipt search --------
+@formatter("RECEIPT_SEARCH", "rows")
+def _receipts(raw, ids):
+    lines = []
+    for row in raw:
+        facets = ", ".join(str(f) for f in (row.get("category"), row.get("country"), row.get("year")) if f)
+        excerpt = " ".join((row.get("excerpt") or "").split())[:80]
+        lines.append(f"{row['file']} ({facets}; match {row['score']:.2f})" + (f": {excerpt}" if excerpt else ""))
+    return f"Found {len(raw)} matching receipt{'' if len(raw) == 1 else 's'}:\n{_listing(lines, len(raw))}"
+
+
+@formatter("RECEIPT_SEARCH", "empty")
+def _no_receipts(raw, ids):
+    return "No matching receipts were found."
+
+
+# -------- Calculator --------
+def _breakdown(calc):
+    split = calc["breakdown"]
+    if split.get("IGST"):
+        parts = f"IGST {format_inr(split['IGST'])}"
+    else:
+        state_tax = "UTGST" if split.get("UTGST") else "SGST"
+        parts = f"CGST {format_inr(split.get('CGST', 0))} + {state_tax} {format_inr(split.get(state_tax, 0))}"
+    supply = f" ({calc['supply_type']} supply)" if calc.get("supply_type") else ""
+    return (f"taxable value {format_inr(calc['taxable_value'])}, {parts} = tax {format_inr(calc['tax_amount'])}, "
+            f"total payable {format_inr(calc['total_payable'])}{supply}")
+
+
+@formatter("CALCULATION", "calculation")
+def _calculation(raw, ids):
+    calc = raw["calculation"]
+    return f"GST on invoice {raw['invoice_id']} at {_rate(calc['rate'])}: {_breakdown(calc)}."
+
+
+@formatter("CALCULATION", "calculation_batch")
+def _calculation_batch(raw, ids):
+    summary = raw["summary"]
+    lines = [f"Invoice {i} at {_rate(calc['rate'])}: {_breakdown(calc)}" for i, calc in raw["invoices"].items()]
+    state_tax = f"SGST {format_inr(summary['sgst'])}"
+    if Decimal(str(summary.get("utgst", 0))):
+        state_tax += f", UTGST {format_inr(summary['utgst'])}"
+    return (f"GST for {_invoices_count(summary['invoices'])}: taxable value {format_inr(summary['taxable'])}, "
+            f"IGST {format_inr(summary['igst'])}, CGST {format_inr(summary['cgst'])}, {state_tax}, "
+            f"total tax {format_inr(summary['tax'])}, total payable {format_inr(summary['total'])}.\n"
+            f"{_listing(lines, len(lines))}")
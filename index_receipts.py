@@ -0,0 +1,257 @@
+import argparse
+import functools
+import itertools
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from ingest_receipts import discover_receipts, file_sha256, is_unchanged, receipt_invoice_id
+from upsert_pipeline import UpsertPipeline, embed_stream
+from vector_store import LocalVectorStore, get_vector_store
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+RECEIPT_NAMESPACE = os.getenv("RECEIPT_NAMESPACE", "receipts")
+# Tokens are whitespace-separated words. Receipts are number-heavy and MiniLM reads at most
+# 256 word pieces, so 80 words per chunk stays clear of truncation.
+RECEIPT_CHUNK_TOKENS = int(os.getenv("RECEIPT_CHUNK_TOKENS", "80"))
+RECEIPT_CHUNK_OVERLAP = int(os.getenv("RECEIPT_CHUNK_OVERLAP", "20"))
+# -------------------------
+
+MANIFEST_FILE = ".receipts_vector_manifest.json"
+PROGRESS_EVERY = 50
+
+# Country folders in dataset/, as a query would name them
+COUNTRY_NAMES = {
+    "at": "Austria", "be": "Belgium", "ca": "Canada", "cn": "China", "cz": "Czech Republic",
+    "de": "Germany", "ee": "Estonia", "es": "Spain", "fr": "France", "gr": "Greece",
+    "hk": "Hong Kong", "hr": "Croatia", "ir": "Ireland", "lt": "Lithuania", "nl": "Netherlands",
+    "pl": "Poland", "se": "Sweden", "uk": "United Kingdom", "us": "United States",
+}
+RECEIPT_CATEGORIES = ["cafe", "flights", "hotel", "miscellaneous", "public transport", "restaurant", "retail",
+                      "taxi", "tourist attraction"]
+
+# Facet words in a query, singular or plural: "taxi receipts in Germany from 2019"
+_FACET_PATTERNS = (
+    [("year", re.compile(r"\b(20\d\d)\b"), int)]
+    + [("country", re.compile(rf"\b{re.escape(name.lower())}\b"), code) for code, name in COUNTRY_NAMES.items()]
+    + [("category", re.compile(rf"\b{re.escape(c.removesuffix('s'))}s?\b"), c) for c in RECEIPT_CATEGORIES]
+)
+
+
+def receipt_filters(query):
+    """Vector store filter for the facets a query names, e.g. {"year": [2019], "country": ["de"]}."""
+    q = query.lower()
+    filters = {}
+    for field, pattern, value in _FACET_PATTERNS:
+        for match in pattern.finditer(q):
+            filters.setdefault(field, []).append(value(match.group(1)) if callable(value) else value)
+    return filters
+
+
+# -------- Chunking --------
+def iter_pages(path):
+    """Yields each page's text as it is extracted, so a long PDF is never held in memory whole."""
+    # Imported here so discovery and chunking work without the optional PDF dependency
+    from pypdf import PdfReader
+    for page in PdfReader(path).pages:
+        yield page.extract_text() or ""
+
+
+def token_windows(tokens, size=RECEIPT_CHUNK_TOKENS, overlap=RECEIPT_CHUNK_OVERLAP):
+    """
+    Sliding windows over a token iterator: size tokens each, consecutive windows sharing
+    overlap tokens. The last window ends at the last token. Holds one window in memory.
+    """
+    step = max(size - overlap, 1)
+    window = deque(maxlen=size)
+    fresh = 0        # tokens not yet emitted in any window
+    for token in tokens:
+        window.append(token)
+        fresh += 1
+        if len(window) == size and fresh >= step:
+            yield list(window)
+            fresh = 0
+    if fresh:
+        yield list(window)
+
+
+def describe(receipt):
+    """Header embedded with every chunk, so year/country/category/file words match in one query."""
+    stem = re.sub(r"[_\-]+", " ", os.path.splitext(os.path.basename(receipt["relpath"]))[0])
+    facets = [receipt["category"], COUNTRY_NAMES.get(receipt["country"], receipt["country"]), receipt["year"]]
+    return f"Receipt ({', '.join(f for f in facets if f)}): {stem}"
+
+
+def chunk_receipt(receipt, size=RECEIPT_CHUNK_TOKENS, overlap=RECEIPT_CHUNK_OVERLAP):
+    """Worker: hash + extract + chunk one PDF. Runs in a child process."""
+    try:
+        sha = file_sha256(receipt["path"])
+        header = describe(receipt)
+        tokens = (token for page in iter_pages(receipt["path"]) for token in page.split())
+        # Scanned receipts without a text layer still get their header indexed
+        chunks = [f"{header}\n{' '.join(window)}" for window in token_windows(tokens, size, overlap)] or [header]
+        return {**receipt, "sha256": sha, "chunks": chunks, "error": None}
+    except Exception as e:
+        return {**receipt, "sha256": None, "chunks": [], "error": str(e)}
+
+
+def chunk_metadata(receipt, text, index):
+    # Pinecone rejects null metadata values, so unknown facets are left out
+    metadata = {
+        "text": text,
+        "file": receipt["relpath"],
+        "invoice_id": receipt_invoice_id(receipt["relpath"]),
+        "chunk": index,
+        "year": int(receipt["year"]) if str(receipt["year"]).isdigit() else None,
+        "country": receipt["country"],
+        "category": receipt["category"],
+    }
+    return {k: v for k, v in metadata.items() if v is not None}
+
+
+def bounded_map(pool, fn, items, window):
+    """pool.map in input order with at most window tasks in flight, so memory stays flat."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# -------- Manifest --------
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest):
+    tmp_path = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def store_key(store):
+    if isinstance(store, LocalVectorStore):
+        return f"local:{os.path.abspath(store.path)}"
+    return f"pinecone:{store.index_name}/{store.namespace}"
+
+
+def chunk_ids(relpath, start, stop):
+    invoice_id = receipt_invoice_id(relpath)
+    return [f"{invoice_id}#{i}" for i in range(start, stop)]
+
+
+# -------- Indexing --------
+def index_receipts(backend=None, workers=None, limit=None, size=RECEIPT_CHUNK_TOKENS, overlap=RECEIPT_CHUNK_OVERLAP):
+    """
+    Streams dataset/index.txt -> changed PDFs -> text pages -> token windows -> batched
+    embeddings -> concurrent upserts into the receipts namespace. Only new or changed
+    receipts are processed; chunks of edited and removed receipts are deleted.
+    """
+    store = get_vector_store(backend, namespace=RECEIPT_NAMESPACE)
+    manifest = load_manifest()
+    key = store_key(store)
+    if isinstance(store, LocalVectorStore) and not store.is_ready():
+        # Index files missing: whatever the manifest says is gone
+        manifest.pop(key, None)
+    indexed = manifest.setdefault(key, {})
+    chunking = [size, overlap]
+
+    receipts = discover_receipts()
+    if limit:
+        receipts = itertools.islice(receipts, limit)
+    seen = set()
+
+    def changed():
+        for receipt in receipts:
+            if not os.path.exists(receipt["path"]):
+                continue
+            seen.add(receipt["relpath"])
+            entry = indexed.get(receipt["relpath"])
+            if entry and entry.get("chunking") == chunking and is_unchanged(receipt, indexed):
+                continue
+            yield receipt
+
+    started = time.monotonic()
+    counts = {"receipts": 0, "chunks": 0, "failed": 0}
+    finished = []     # (relpath, manifest entry) once all of its chunks have been handed on
+    stale = []
+
+    def records(pool):
+        for result in bounded_map(pool, functools.partial(chunk_receipt, size=size, overlap=overlap),
+                                  changed(), window=2 * (workers or os.cpu_count() or 1)):
+            counts["receipts"] += 1
+            if result["error"]:
+                counts["failed"] += 1
+                print(f"❌ {result['relpath']}: {result['error']}")
+                continue
+            relpath, chunks = result["relpath"], result["chunks"]
+            previous = indexed.get(relpath, {}).get("chunks", 0)
+            stale.extend(chunk_ids(relpath, len(chunks), previous))
+            stat = os.stat(result["path"])
+            finished.append((relpath, {"sha256": result["sha256"], "size": stat.st_size, "mtime": stat.st_mtime,
+                                       "chunks": len(chunks), "chunking": chunking}))
+            for i, text in enumerate(chunks):
+                counts["chunks"] += 1
+                yield {"id": chunk_ids(relpath, i, i + 1)[0], "text": text,
+                       "metadata": chunk_metadata(result, text, i)}
+            if counts["receipts"] % PROGRESS_EVERY == 0:
+                elapsed = time.monotonic() - started
+                print(f"[{counts['receipts']}] {counts['receipts'] / elapsed:.1f} files/sec, {counts['chunks']} chunks")
+
+    failed_ids = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        stream = records(pool)
+        first = next(stream, None)
+        if first is not None:
+            from embedding_models import get_embedding_model
+            model = get_embedding_model()
+            pipeline = UpsertPipeline(store)
+            with store.deferred_writes():
+                pipeline.run(embed_stream(itertools.chain([first], stream), model))
+            failed_ids = pipeline.failed_ids
+
+    # Receipts gone from index.txt (only knowable on a full pass)
+    removed = [] if limit else [relpath for relpath in indexed if relpath not in seen]
+    for relpath in removed:
+        stale.extend(chunk_ids(relpath, 0, indexed.pop(relpath).get("chunks", 0)))
+    if stale:
+        store.delete(stale)
+
+    # A receipt with any chunk dead-lettered stays out of the manifest and is retried next run
+    for relpath, entry in finished:
+        if failed_ids.isdisjoint(chunk_ids(relpath, 0, entry["chunks"])):
+            indexed[relpath] = entry
+        else:
+            indexed.pop(relpath, None)
+    save_manifest(manifest)
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Receipt index ({store.name}, namespace '{RECEIPT_NAMESPACE}'): {counts['receipts']} receipts "
+          f"-> {counts['chunks']} chunks, {counts['failed']} failed, {len(stale)} stale chunks deleted "
+          f"in {elapsed:.1f}s")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index receipt PDFs from dataset/ in the vector store.")
+    parser.add_argument("backend", nargs="?", default=None, help="pinecone or local (default: VECTOR_BACKEND)")
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes (default: CPU count)")
+    parser.add_argument("--limit", type=int, default=None, help="only consider the first N receipts")
+    parser.add_argument("--chunk-tokens", type=int, default=RECEIPT_CHUNK_TOKENS)
+    parser.add_argument("--overlap", type=int, default=RECEIPT_CHUNK_OVERLAP)
+    args = parser.parse_args()
+    index_receipts(args.backend, workers=args.workers, limit=args.limit, size=args.chunk_tokens,
+                   overlap=args.overlap)
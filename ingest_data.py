@@ -1,26 +1,30 @@
+import argparse
+import io
+import time
+import numpy as np
 import pandas as pd
-import psycopg2
 import os
 import glob
 from psycopg2.extras import execute_values
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# DB Configuration (Matches agent_invoice_sql.py)
-DB_CONFIG = {
-    "dbname": "gst_invoice_db",
-    "user": "postgres",
-    "password": os.getenv("DB_PASSWORD"),
-    "host": "localhost",
-    "port": "5432"
-}
+from db import DB_CONFIG, get_pool, get_db_connection, ensure_invoice_columns  # shared config; names kept for existing imports
+from invoice_analytics import ensure_summary_table, with_summary
 
 DATA_DIR = "./dataset"
 
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+# Bulk loads can legitimately run longer than the interactive statement timeout
+INGEST_STATEMENT_TIMEOUT_MS = 0
+
+# Streaming mode: rows per chunk held in memory at once
+CHUNK_SIZE = 50000
+
+# Column order used for COPY into the staging table
+LOAD_COLUMNS = ["invoice_id", "total_amount", "tax_amount", "supplier_state", "buyer_state", "invoice_date"]
+COLUMN_ALIASES = {
+    "invoice no": "invoice_id",
+    "total": "total_amount",
+    "tax": "tax_amount",
+    "date": "invoice_date"
+}
 
 def ingest_data():
     # 1. Find CSV File
@@ -73,16 +77,14 @@ def ingest_data():
     df.fillna(0, inplace=True)
 
     # 4. Insert into DB
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     print(f"Inserting {len(df)} records into 'invoices' table...")
 
-    insert_query = """
+    # New invoices are added to invoice_daily_summary in the same statement
+    insert_query = with_summary("""
     INSERT INTO invoices (invoice_id, total_amount, tax_amount, supplier_state, buyer_state)
     VALUES %s
-    ON CONFLICT (invoice_id) DO NOTHING;
-    """
+    ON CONFLICT (invoice_id) DO NOTHING
+    """)
 
     # Prepare data list
     data_to_insert = [
@@ -97,15 +99,104 @@ def ingest_data():
     ]
 
     try:
-        execute_values(cursor, insert_query, data_to_insert)
-        conn.commit()
-        print("Data ingestion complete!")
+        ensure_summary_table()
+        with get_pool().connection(statement_timeout_ms=INGEST_STATEMENT_TIMEOUT_MS) as conn:
+            with conn.cursor() as cursor:
+                # One count row per page of values
+                pages = execute_values(cursor, insert_query, data_to_insert, fetch=True)
+        print(f"Data ingestion complete! {sum(count for count, in pages)} new invoices.")
     except Exception as e:
         print(f"Database Error: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+
+# -------- Streaming Mode --------
+def prepare_chunk(df, next_generated_id):
+    """Same column mapping as ingest_data, done column-wise. Returns (frame, next_generated_id)."""
+    df.columns = [c.lower().strip() for c in df.columns]
+    df = df.rename(columns={k: v for k, v in COLUMN_ALIASES.items() if k in df.columns and v not in df.columns})
+
+    if "invoice_id" not in df.columns:
+        df["invoice_id"] = np.arange(next_generated_id, next_generated_id + len(df))
+        next_generated_id += len(df)
+
+    out = pd.DataFrame(index=df.index)
+    out["invoice_id"] = df["invoice_id"].astype(str).str.strip()
+    for col in ("total_amount", "tax_amount"):
+        values = df[col] if col in df.columns else pd.Series(0, index=df.index)
+        out[col] = pd.to_numeric(values, errors="coerce").fillna(0).round(2)
+    for col in ("supplier_state", "buyer_state"):
+        out[col] = df[col].fillna("").astype(str) if col in df.columns else "Delhi"  # Default
+    if "invoice_date" in df.columns:
+        out["invoice_date"] = pd.to_datetime(df["invoice_date"], errors="coerce").dt.date
+    else:
+        out["invoice_date"] = None
+
+    return out[LOAD_COLUMNS], next_generated_id
+
+
+def copy_chunk(cursor, chunk):
+    """COPY one chunk into a temp staging table, then merge into invoices (and their totals into the summary)."""
+    buffer = io.StringIO()
+    # Empty unquoted CSV fields load as NULL
+    chunk.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS invoices_staging
+        (LIKE invoices INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+    """)
+    cursor.copy_expert(
+        f"COPY invoices_staging ({', '.join(LOAD_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+    cursor.execute(with_summary(f"""
+        INSERT INTO invoices ({', '.join(LOAD_COLUMNS)})
+        SELECT DISTINCT ON (invoice_id) {', '.join(LOAD_COLUMNS)} FROM invoices_staging
+        ON CONFLICT (invoice_id) DO NOTHING
+    """))
+    return cursor.fetchone()[0]
+
+
+def ingest_data_streaming(chunksize=CHUNK_SIZE):
+    """Loads every CSV in DATA_DIR chunk by chunk via COPY; memory stays bounded by chunksize."""
+    csv_files = sorted(glob.glob(os.path.join(DATA_DIR, "*.csv")))
+    if not csv_files:
+        print(f"No CSV file found in {DATA_DIR}. Please place your dataset file there.")
+        return
+
+    ensure_summary_table()
+
+    started = time.monotonic()
+    total_read = total_inserted = 0
+    next_generated_id = 1001
+
+    for file_path in csv_files:
+        print(f"Processing file: {file_path}")
+        file_started = time.monotonic()
+        file_read = 0
+
+        for raw_chunk in pd.read_csv(file_path, chunksize=chunksize):
+            chunk, next_generated_id = prepare_chunk(raw_chunk, next_generated_id)
+            with get_pool().connection(statement_timeout_ms=INGEST_STATEMENT_TIMEOUT_MS) as conn:
+                with conn.cursor() as cursor:
+                    total_inserted += copy_chunk(cursor, chunk)
+            file_read += len(chunk)
+
+        elapsed = time.monotonic() - file_started
+        total_read += file_read
+        print(f"  {file_read} rows in {elapsed:.2f}s ({file_read / max(elapsed, 1e-9):.0f} rows/sec)")
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Streaming ingestion complete: {total_read} rows read, {total_inserted} new "
+          f"in {elapsed:.2f}s ({total_read / max(elapsed, 1e-9):.0f} rows/sec)")
+
 
 if __name__ == "__main__":
-    ingest_data()
+    parser = argparse.ArgumentParser(description="Load invoice CSVs from dataset/ into PostgreSQL.")
+    parser.add_argument("--stream", action="store_true", help="chunked COPY ingest of every CSV")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    if args.stream:
+        ingest_data_streaming(args.chunksize)
+    else:
+        ingest_data()
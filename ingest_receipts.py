@@ -0,0 +1,329 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from psycopg2.extras import execute_values
+from db import get_pool
+from invoice_analytics import delta_columns, ensure_summary_table, merge_sql
+
+DATA_DIR = "./dataset"
+INDEX_FILE = os.path.join(DATA_DIR, "index.txt")
+MANIFEST_FILE = ".receipts_manifest.json"
+
+LOAD_BATCH_SIZE = 200
+# invoices.total_amount / tax_amount are DECIMAL(10, 2); parsed amounts beyond this are OCR noise
+MAX_AMOUNT = 99_999_999.99
+PROGRESS_EVERY = 50
+
+# Bulk loads can legitimately run longer than the interactive statement timeout
+INGEST_STATEMENT_TIMEOUT_MS = 0
+
+# A re-ingested receipt replaces its row, so invoice_daily_summary gets the new version added
+# and the old one subtracted. All CTEs read the statement's snapshot, so "replaced" sees the
+# rows as they were before "written" ran. (No FOR UPDATE there: rows the upsert has already
+# changed would be skipped.) One ingester runs at a time; rebuild() covers anything else.
+UPSERT_QUERY = f"""
+WITH incoming (invoice_id, total_amount, tax_amount, supplier_state, buyer_state,
+               invoice_date, vendor, source_file) AS (
+    VALUES %s
+),
+replaced AS (
+    SELECT {delta_columns("i")}, -1 AS sign
+    FROM invoices i JOIN incoming USING (invoice_id)
+),
+written AS (
+    INSERT INTO invoices (invoice_id, total_amount, tax_amount, supplier_state, buyer_state,
+                          invoice_date, vendor, source_file)
+    SELECT * FROM incoming
+    ON CONFLICT (invoice_id) DO UPDATE SET
+        total_amount = EXCLUDED.total_amount,
+        tax_amount = EXCLUDED.tax_amount,
+        invoice_date = EXCLUDED.invoice_date,
+        vendor = EXCLUDED.vendor,
+        source_file = EXCLUDED.source_file
+    RETURNING {delta_columns()}, 1 AS sign
+),
+summarized AS ({merge_sql("(SELECT * FROM replaced UNION ALL SELECT * FROM written) AS delta")}
+)
+SELECT count(*) FROM written
+"""
+# VALUES has no column types of its own; all-NULL columns would otherwise come out as text
+UPSERT_TEMPLATE = "(%s, %s::numeric, %s::numeric, %s::varchar, %s::varchar, %s::date, %s::varchar, %s::text)"
+
+# -------- Discovery --------
+def discover_receipts(index_file=INDEX_FILE, data_dir=DATA_DIR):
+    """Yields {"path", "relpath", "year", "country", "category"} for each PDF in index.txt."""
+    with open(index_file, "r", encoding="utf-8") as f:
+        for line in f:
+            relpath = line.strip()
+            if not relpath.lower().endswith(".pdf"):
+                continue
+            relpath = relpath[2:] if relpath.startswith("./") else relpath
+            parts = relpath.split("/")
+            yield {
+                "path": os.path.join(data_dir, relpath),
+                "relpath": relpath,
+                "year": parts[0],
+                "country": parts[1] if len(parts) > 2 else None,
+                # Some receipts sit directly under <year>/<country>/
+                "category": parts[2] if len(parts) > 3 else None
+            }
+
+
+def receipt_invoice_id(relpath):
+    # Stable per file, so an edited receipt updates its row instead of adding one
+    return "R-" + hashlib.sha1(relpath.encode("utf-8")).hexdigest()[:12]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# -------- Extraction & Parsing --------
+def extract_text(path):
+    # Imported here so discovery/parsing work without the optional PDF dependency
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+AMOUNT_PATTERN = re.compile(r"(?<![\d.,])(\d{1,3}(?:[ .,']\d{3})*[.,]\d{2}|\d+[.,]\d{2})(?![\d])")
+TOTAL_KEYWORDS = re.compile(r"\b(total|summe|gesamt|betrag|zu zahlen|amount due|montant|totale|importe)\b", re.IGNORECASE)
+TAX_KEYWORDS = re.compile(r"\b(tax|mwst|ust|vat|tva|gst|hst|pst|iva|btw|moms)\b", re.IGNORECASE)
+DATE_PATTERNS = [
+    (re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b"), ("y", "m", "d")),
+    (re.compile(r"\b(\d{1,2})\.(\d{1,2})\.(\d{4}|\d{2})\b"), ("d", "m", "y")),
+    (re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})\b"), ("m", "d", "y")),
+]
+
+
+def parse_amount(text):
+    """'1.234,56', '1,234.56', '57,60' -> float. The last separator is always the decimal one."""
+    whole = re.sub(r"\D", "", text[:-3])
+    return float(f"{whole or 0}.{text[-2:]}")
+
+
+def _amounts(line):
+    # "12.10.2019" would otherwise read as an amount of 12.10
+    for pattern, _ in DATE_PATTERNS:
+        line = pattern.sub(" ", line)
+    return [parse_amount(m) for m in AMOUNT_PATTERN.findall(line)]
+
+
+def clean_amounts(receipt):
+    """Drops amounts the invoices table can't hold or that can't be right (tax above total); returns the dropped fields."""
+    dropped = []
+    for field in ("total_amount", "tax_amount"):
+        value = receipt.get(field)
+        if value is not None and not 0 <= value <= MAX_AMOUNT:
+            receipt[field] = None
+            dropped.append(field)
+    if receipt.get("tax_amount") is not None and receipt.get("total_amount") is not None \
+            and receipt["tax_amount"] > receipt["total_amount"]:
+        receipt["tax_amount"] = None
+        dropped.append("tax_amount")
+    return dropped
+
+
+def parse_date(text, year_hint=None):
+    for pattern, order in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            parts = dict(zip(order, (int(g) for g in match.groups())))
+            year = parts["y"] + 2000 if parts["y"] < 100 else parts["y"]
+            try:
+                parsed = date(year, parts["m"], parts["d"])
+            except ValueError:
+                continue
+            # The folder year is a cheap sanity check against OCR noise
+            if year_hint is None or abs(parsed.year - int(year_hint)) <= 1:
+                return parsed
+    return None
+
+
+def parse_receipt(text, year_hint=None):
+    """Best-effort extraction of total, tax, date and vendor from a receipt's text layer."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+
+    total = None
+    tax = None
+    for line in lines:
+        amounts = _amounts(line)
+        if not amounts:
+            continue
+        if total is None and TOTAL_KEYWORDS.search(line):
+            total = max(amounts)
+        elif tax is None and TAX_KEYWORDS.search(line):
+            tax = min(amounts)
+
+    # No labelled total on the same line: the largest amount on a receipt is usually it
+    if total is None:
+        all_amounts = [a for line in lines for a in _amounts(line)]
+        total = max(all_amounts) if all_amounts else None
+
+    vendor = next((line[:200] for line in lines if sum(c.isalpha() for c in line) >= 3), None)
+
+    return {
+        "total_amount": total,
+        "tax_amount": tax,
+        "invoice_date": parse_date(text, year_hint),
+        "vendor": vendor
+    }
+
+
+def process_receipt(receipt):
+    """Worker: hash + extract + parse one PDF. Runs in a child process."""
+    try:
+        sha = file_sha256(receipt["path"])
+        text = extract_text(receipt["path"])
+        parsed = parse_receipt(text, receipt["year"])
+        return {**receipt, **parsed, "sha256": sha, "error": None}
+    except Exception as e:
+        return {**receipt, "sha256": None, "error": str(e)}
+
+
+# -------- Manifest --------
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest):
+    tmp_path = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def is_unchanged(receipt, manifest):
+    entry = manifest.get(receipt["relpath"])
+    if not entry:
+        return False
+    stat = os.stat(receipt["path"])
+    if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return True
+    # Touched but identical content (e.g. fresh checkout) still counts as unchanged
+    if file_sha256(receipt["path"]) == entry["sha256"]:
+        entry["mtime"] = stat.st_mtime
+        return True
+    return False
+
+
+# -------- Loading --------
+def _row(r):
+    return (
+        receipt_invoice_id(r["relpath"]),
+        r["total_amount"],
+        r["tax_amount"],
+        None,   # supplier/buyer state are unknown for foreign receipts
+        None,
+        r["invoice_date"],
+        r["vendor"],
+        r["relpath"]
+    )
+
+
+def _upsert(rows):
+    with get_pool().connection(statement_timeout_ms=INGEST_STATEMENT_TIMEOUT_MS) as conn:
+        with conn.cursor() as cursor:
+            execute_values(cursor, UPSERT_QUERY, rows, template=UPSERT_TEMPLATE)
+
+
+def load_batch(batch):
+    """
+    Upserts a batch in one statement. If that fails, retries receipt by receipt so one bad
+    row doesn't cost the rest. Returns the receipts that could not be loaded.
+    """
+    try:
+        _upsert([_row(r) for r in batch])
+        return []
+    except Exception as e:
+        print(f"⚠️ Batch of {len(batch)} failed ({e}); retrying one by one")
+
+    rejected = []
+    for r in batch:
+        try:
+            _upsert([_row(r)])
+        except Exception as e:
+            print(f"❌ {r['relpath']}: {e}")
+            rejected.append(r)
+    return rejected
+
+
+def ingest_receipts(workers=None, limit=None):
+    manifest = load_manifest()
+
+    # 1. Discover, skipping files already in the manifest
+    receipts = list(discover_receipts())
+    if limit:
+        receipts = receipts[:limit]
+    todo = [r for r in receipts if os.path.exists(r["path"]) and not is_unchanged(r, manifest)]
+    print(f"Found {len(receipts)} receipts, {len(todo)} new or changed.")
+    if not todo:
+        save_manifest(manifest)
+        return
+
+    ensure_summary_table()
+
+    # 2. Extract + parse in a process pool, load in batches as results stream back
+    started = time.monotonic()
+    done = loaded = failed = 0
+    batch = []
+
+    def flush():
+        nonlocal loaded, failed
+        if not batch:
+            return
+        # Rejected receipts stay out of the manifest, so the next run tries them again
+        rejected = {r["relpath"] for r in load_batch(batch)}
+        failed += len(rejected)
+        for r in batch:
+            if r["relpath"] in rejected:
+                continue
+            stat = os.stat(r["path"])
+            manifest[r["relpath"]] = {"sha256": r["sha256"], "size": stat.st_size, "mtime": stat.st_mtime}
+        # Persist per batch so an interrupted run resumes where it stopped
+        save_manifest(manifest)
+        loaded += len(batch) - len(rejected)
+        batch.clear()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(process_receipt, todo, chunksize=4):
+            done += 1
+            if result["error"]:
+                failed += 1
+                print(f"❌ {result['relpath']}: {result['error']}")
+            else:
+                dropped = clean_amounts(result)
+                if dropped:
+                    print(f"⚠️ {result['relpath']}: implausible {', '.join(dropped)} stored as NULL")
+                batch.append(result)
+                if len(batch) >= LOAD_BATCH_SIZE:
+                    flush()
+
+            if done % PROGRESS_EVERY == 0 or done == len(todo):
+                elapsed = time.monotonic() - started
+                print(f"[{done}/{len(todo)}] {done / elapsed:.1f} files/sec")
+        flush()
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Receipt ingestion complete: {loaded} loaded, {failed} failed "
+          f"in {elapsed:.1f}s ({done / elapsed:.1f} files/sec)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load receipt PDFs from dataset/ into the invoices table.")
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes (default: CPU count)")
+    parser.add_argument("--limit", type=int, default=None, help="only consider the first N receipts")
+    args = parser.parse_args()
+    ingest_receipts(workers=args.workers, limit=args.limit)
@@ -0,0 +1,201 @@
+import os
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+ROUTER_THRESHOLD = float(os.getenv("ROUTER_THRESHOLD", "0.5"))   # min cosine to the best prototype
+ROUTER_MARGIN = float(os.getenv("ROUTER_MARGIN", "0.05"))        # min lead over the runner-up
+# -------------------------
+
+# Example utterances per intent. Each intent's prototype is the normalized mean of its
+# examples' embeddings; add phrasings here when a query type keeps falling back.
+ORCHESTRATOR_EXAMPLES = {
+    "SQL_AGENT": [
+        "get total amount for invoice 101",
+        "what is the tax amount on invoice 205",
+        "show me invoice 103",
+        "details of invoice number 42",
+        "how much was billed on invoice 310",
+        "total for invoices 101, 102 and 105",
+        "list all interstate invoices",
+        "which invoices are inter-state supplies",
+        "total tax collected by state",
+        "monthly igst liability",
+        "intra-state vs inter-state totals",
+    ],
+    "RAG_AGENT": [
+        "what is the gst rate for mobile phones",
+        "which tax slab applies to cars",
+        "explain the difference between igst and cgst",
+        "when is an e-way bill required",
+        "what is the registration threshold for goods",
+        "can I claim input tax credit on food",
+        "what are the mandatory fields on a tax invoice",
+        "is fresh milk exempt from gst",
+    ],
+    "CALCULATION": [
+        "calculate 18% gst on invoice 101",
+        "compute the tax on invoice 104 at 12 percent",
+        "calculate gst for invoice 103",
+        "work out igst on invoice 220",
+        "how much gst is payable on invoice 55 at 28%",
+        "calculate gst on invoices 101 to 105",
+    ],
+    "RECEIPT_SEARCH": [
+        "hotel invoices in hamburg 2019",
+        "find restaurant receipts from spain",
+        "show my taxi receipts",
+        "public transport tickets in germany 2018",
+        "which receipts are from a cafe in hong kong",
+        "retail bills from the united states",
+    ],
+}
+
+SQL_EXAMPLES = {
+    "GET_TOTAL_AMOUNT": [
+        "total amount of invoice 101",
+        "what is the invoice total for 205",
+        "how much was invoice 42 for",
+        "total for invoices 101 and 102",
+    ],
+    "GET_TAX_AMOUNT": [
+        "tax amount on invoice 101",
+        "how much gst was charged on invoice 205",
+        "tax for invoices 101-105",
+    ],
+    "GET_INVOICE_BY_ID": [
+        "show invoice 101",
+        "details of invoice 42",
+        "get invoice number 310",
+        "fetch invoices 100 to 200",
+    ],
+    "GET_INTERSTATE_INVOICES": [
+        "list all interstate invoices",
+        "show inter-state supplies",
+        "invoices where supplier and buyer are in different states",
+    ],
+    "GET_TAX_BY_STATE": [
+        "total tax collected by state",
+        "state-wise gst collection",
+        "how much tax did each state collect",
+    ],
+    "GET_MONTHLY_TAX": [
+        "monthly igst liability",
+        "tax collected per month",
+        "month-wise gst report",
+    ],
+    "GET_SUPPLY_TYPE_SUMMARY": [
+        "intra-state vs inter-state totals",
+        "tax breakdown by supply type",
+        "how much tax came from interstate supplies overall",
+    ],
+}
+
+# SQL intents over all invoices; every other SQL intent acts on invoice IDs named in the query
+SQL_INTENTS_WITHOUT_ID = {"GET_INTERSTATE_INVOICES", "GET_TAX_BY_STATE", "GET_MONTHLY_TAX", "GET_SUPPLY_TYPE_SUMMARY"}
+
+
+def _normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+class IntentRouter:
+    """
+    Nearest-prototype intent classifier. All prototypes (orchestrator and SQL intents) sit in
+    one matrix, so routing a query is a single matrix-vector product against the query
+    embedding the RAG agent needs anyway. Low-confidence decisions fall back to the keyword
+    rules, and every decision is tallied against what the keyword rules would have said.
+    """
+
+    def __init__(self, embedder, keyword_intent, keyword_sql_intent, has_invoice_id, threshold=ROUTER_THRESHOLD,
+                 margin=ROUTER_MARGIN, examples=ORCHESTRATOR_EXAMPLES, sql_examples=SQL_EXAMPLES):
+        self.embedder = embedder
+        self.keyword_intent = keyword_intent
+        self.keyword_sql_intent = keyword_sql_intent
+        self.has_invoice_id = has_invoice_id
+        self.threshold = threshold
+        self.margin = margin
+
+        # One row per intent; the first len(examples) rows are orchestrator intents
+        groups = list(examples.items()) + list(sql_examples.items())
+        self.labels = [intent for intent, _ in groups]
+        self._split = len(examples)
+        texts = [text for _, utterances in groups for text in utterances]
+        owners = np.repeat(np.arange(len(groups)), [len(u) for _, u in groups])
+        vectors = _normalize_rows(embedder.model.encode(texts))
+        centroids = np.stack([vectors[owners == i].mean(axis=0) for i in range(len(groups))])
+        self.prototypes = _normalize_rows(centroids)
+
+        self._lock = threading.Lock()
+        self.routed = Counter()
+        self.fallbacks = Counter()
+        self.confusion = defaultdict(Counter)   # router intent -> keyword intent -> count
+
+    def _pick(self, scores, labels):
+        order = np.argsort(-scores)
+        best = float(scores[order[0]])
+        runner_up = float(scores[order[1]]) if len(order) > 1 else -1.0
+        confident = best >= self.threshold and best - runner_up >= self.margin
+        return labels[order[0]], best, confident
+
+    def _plausible(self, query, intent, sql_intent):
+        # Embeddings barely see digits: "how is GST calculated" sits close to CALCULATION.
+        # Intents that act on specific invoices need an invoice ID in the query.
+        if intent == "CALCULATION" or (intent == "SQL_AGENT" and sql_intent not in SQL_INTENTS_WITHOUT_ID):
+            return self.has_invoice_id(query)
+        return True
+
+    def route(self, query, embedding=None):
+        """
+        Returns {"intent", "sql_intent", "confidence", "source", "embedding"}; source is
+        "router" or "keywords". Pass embedding if the caller already has it.
+        """
+        if embedding is None:
+            embedding = self.embedder.embed(query)
+        scores = self.prototypes @ _normalize_rows(embedding)
+
+        intent, confidence, confident = self._pick(scores[:self._split], self.labels[:self._split])
+        sql_intent, _, sql_confident = self._pick(scores[self._split:], self.labels[self._split:])
+        keyword_intent = self.keyword_intent(query)
+
+        if not sql_confident:
+            sql_intent = self.keyword_sql_intent(query)
+        source = "router"
+        if not confident or not self._plausible(query, intent, sql_intent):
+            intent, source = keyword_intent, "keywords"
+        if intent == "SQL_AGENT" and source == "keywords":
+            sql_intent = self.keyword_sql_intent(query)
+
+        with self._lock:
+            self.routed[intent] += 1
+            if source == "keywords":
+                self.fallbacks[intent] += 1
+            else:
+                self.confusion[intent][keyword_intent] += 1
+
+        return {
+            "intent": intent,
+            "sql_intent": sql_intent if intent == "SQL_AGENT" else None,
+            "confidence": confidence,
+            "source": source,
+            "embedding": embedding
+        }
+
+    def stats(self):
+        with self._lock:
+            decided = sum(self.routed.values())
+            agreed = sum(self.confusion[i][i] for i in self.confusion)
+            by_router = decided - sum(self.fallbacks.values())
+            return {
+                "routed": dict(self.routed),
+                "fallbacks": dict(self.fallbacks),
+                "fallback_ratio": sum(self.fallbacks.values()) / decided if decided else 0.0,
+                "keyword_agreement": agreed / by_router if by_router else 0.0,
+                "confusion": {intent: dict(counts) for intent, counts in self.confusion.items()}
+            }
@@ -0,0 +1,167 @@
+import argparse
+import sys
+import time
+from db import get_pool, ensure_invoice_columns
+
+# Pre-aggregated invoice totals for analytics questions and dashboards: one row per
+# (day, supplier state, buyer state, supply type). The ingesters fold every load into it in
+# the same statement that writes the invoices (with_summary / merge_sql), so it is always
+# consistent with the invoices table; rebuild() recomputes it from scratch if it ever drifts
+# (rows written by other tools, a failed migration).
+
+SUMMARY_TABLE = "invoice_daily_summary"
+SUMMARY_KEY = ("day", "supplier_state", "buyer_state", "supply_type")
+# Invoice columns the summary is computed from
+DELTA_COLUMNS = ("total_amount", "tax_amount", "supplier_state", "buyer_state", "invoice_date")
+
+# Rebuilding scans every invoice; it may run longer than the interactive statement timeout
+REBUILD_STATEMENT_TIMEOUT_MS = 0
+
+SUMMARY_DDL = f"""
+CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+    day DATE NOT NULL,                       -- invoice_date; 'infinity' for undated invoices
+    supplier_state VARCHAR(100) NOT NULL,    -- '' when unknown (foreign receipts)
+    buyer_state VARCHAR(100) NOT NULL,
+    supply_type VARCHAR(12) NOT NULL,        -- 'inter-state', 'intra-state' or 'unknown'
+    invoice_count BIGINT NOT NULL,
+    total_amount NUMERIC(16, 2) NOT NULL,
+    tax_amount NUMERIC(16, 2) NOT NULL,
+    PRIMARY KEY ({', '.join(SUMMARY_KEY)})
+);
+"""
+
+
+def _state(column):
+    return f"btrim(COALESCE({column}, ''))"
+
+
+def _normalized_state(column):
+    # Same comparison as gst_calculator.normalize_state: case, '&' and spacing don't matter
+    return f"btrim(regexp_replace(lower(replace(COALESCE({column}, ''), '&', ' and ')), '\\s+', ' ', 'g'))"
+
+
+# Summary key of an invoice row. Intra-UT supplies count as intra-state (CGST + UTGST).
+_KEY_EXPRESSIONS = f"""
+    COALESCE(invoice_date, DATE 'infinity'),
+    {_state("supplier_state")},
+    {_state("buyer_state")},
+    CASE WHEN {_state("supplier_state")} = '' OR {_state("buyer_state")} = '' THEN 'unknown'
+         WHEN {_normalized_state("supplier_state")} = {_normalized_state("buyer_state")} THEN 'intra-state'
+         ELSE 'inter-state' END"""
+
+
+def delta_columns(alias=None):
+    """Column list of DELTA_COLUMNS, qualified with alias if given."""
+    return ", ".join(f"{alias}.{c}" if alias else c for c in DELTA_COLUMNS)
+
+
+def _aggregate(source):
+    # source: rows with DELTA_COLUMNS and sign (+1 invoice added, -1 invoice removed)
+    return f"""
+    SELECT {_KEY_EXPRESSIONS}, SUM(sign) AS invoice_count,
+           SUM(sign * COALESCE(total_amount, 0)) AS total_amount, SUM(sign * COALESCE(tax_amount, 0)) AS tax_amount
+    FROM {source}
+    GROUP BY 1, 2, 3, 4"""
+
+
+def merge_sql(source):
+    """INSERT ... ON CONFLICT that adds source's rows (DELTA_COLUMNS plus sign) into the summary."""
+    return f"""
+    INSERT INTO {SUMMARY_TABLE} AS s ({', '.join(SUMMARY_KEY)}, invoice_count, total_amount, tax_amount)
+    {_aggregate(source)}
+    ON CONFLICT ({', '.join(SUMMARY_KEY)}) DO UPDATE SET
+        invoice_count = s.invoice_count + EXCLUDED.invoice_count,
+        total_amount = s.total_amount + EXCLUDED.total_amount,
+        tax_amount = s.tax_amount + EXCLUDED.tax_amount"""
+
+
+def with_summary(insert_sql):
+    """
+    Wraps an INSERT INTO invoices ... ON CONFLICT DO NOTHING (no RETURNING) into one statement
+    that also folds the rows it actually inserted into the summary. The statement returns
+    one row: the number of invoices inserted.
+    """
+    return f"""
+    WITH added AS (
+        {insert_sql.strip().rstrip(';')}
+        RETURNING {delta_columns()}, 1 AS sign
+    ),
+    summarized AS ({merge_sql("added")}
+    )
+    SELECT count(*) FROM added
+    """
+
+
+def _fill(cursor):
+    # SHARE blocks invoice writers (not readers) until commit, so no load is missed or counted
+    # twice. DELETE rather than TRUNCATE keeps the old totals readable while this runs.
+    cursor.execute("LOCK TABLE invoices IN SHARE MODE")
+    cursor.execute(f"DELETE FROM {SUMMARY_TABLE}")
+    cursor.execute(merge_sql("(SELECT *, 1 AS sign FROM invoices) AS i"))
+    return cursor.rowcount
+
+
+def ensure_summary_table():
+    """Creates the summary table and fills it from invoices, unless it exists. Returns True if created."""
+    ensure_invoice_columns()
+    with get_pool().connection(statement_timeout_ms=REBUILD_STATEMENT_TIMEOUT_MS) as conn:
+        with conn.cursor() as cursor:
+            # Serializes concurrent first runs (two ingesters, an ingester and the agent)
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (SUMMARY_TABLE,))
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (SUMMARY_TABLE,))
+            if cursor.fetchone()[0]:
+                return False
+            cursor.execute(SUMMARY_DDL)
+            rows = _fill(cursor)
+    print(f"Created {SUMMARY_TABLE} ({rows} rows).")
+    return True
+
+
+def rebuild():
+    """Recomputes the whole summary from the invoices table in one transaction."""
+    ensure_invoice_columns()
+    started = time.monotonic()
+    with get_pool().connection(statement_timeout_ms=REBUILD_STATEMENT_TIMEOUT_MS) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SUMMARY_DDL)
+            rows = _fill(cursor)
+    print(f"✅ Rebuilt {SUMMARY_TABLE}: {rows} rows in {time.monotonic() - started:.2f}s")
+    return rows
+
+
+def verify():
+    """Summary rows that disagree with a fresh aggregate of invoices ([] when consistent)."""
+    key = ", ".join(SUMMARY_KEY)
+    sql = f"""
+    WITH fresh ({key}, invoice_count, total_amount, tax_amount) AS (
+        {_aggregate("(SELECT *, 1 AS sign FROM invoices) AS i")}
+    )
+    SELECT {key},
+           COALESCE(f.invoice_count, 0) AS expected_count, COALESCE(s.invoice_count, 0) AS summary_count,
+           COALESCE(f.tax_amount, 0) AS expected_tax, COALESCE(s.tax_amount, 0) AS summary_tax
+    FROM fresh f FULL JOIN {SUMMARY_TABLE} s USING ({key})
+    WHERE COALESCE(f.invoice_count, 0) <> COALESCE(s.invoice_count, 0)
+       OR COALESCE(f.total_amount, 0) <> COALESCE(s.total_amount, 0)
+       OR COALESCE(f.tax_amount, 0) <> COALESCE(s.tax_amount, 0)
+    """
+    with get_pool().connection(statement_timeout_ms=REBUILD_STATEMENT_TIMEOUT_MS) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+            columns = [desc[0] for desc in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Maintain the {SUMMARY_TABLE} analytics table.")
+    parser.add_argument("command", choices=["rebuild", "verify"],
+                        help="rebuild: recompute from invoices; verify: list rows that drifted")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        rebuild()
+    else:
+        drift = verify()
+        for row in drift[:20]:
+            print(row)
+        print(f"{len(drift)} summary rows out of date" + (" (run: python invoice_analytics.py rebuild)" if drift else ""))
+        sys.exit(1 if drift else 0)
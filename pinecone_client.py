@@ -0,0 +1,271 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import tracing
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+PINECONE_TIMEOUT = float(os.getenv("PINECONE_TIMEOUT", "2"))                  # seconds, whole query incl. retries
+PINECONE_WRITE_TIMEOUT = float(os.getenv("PINECONE_WRITE_TIMEOUT", "30"))     # upserts, deletes, control plane
+PINECONE_CONNECT_TIMEOUT = float(os.getenv("PINECONE_CONNECT_TIMEOUT", "1"))
+PINECONE_RETRIES = int(os.getenv("PINECONE_RETRIES", "2"))
+PINECONE_BACKOFF_MS = float(os.getenv("PINECONE_BACKOFF_MS", "50"))           # doubled per attempt, full jitter
+PINECONE_POOL_SIZE = int(os.getenv("PINECONE_POOL_SIZE", "32"))               # keep-alive connections per host
+PINECONE_HEDGE = os.getenv("PINECONE_HEDGE", "0") == "1"                      # duplicate slow queries
+PINECONE_HEDGE_MIN_MS = float(os.getenv("PINECONE_HEDGE_MIN_MS", "20"))       # never hedge earlier than this
+PINECONE_BREAKER_FAILURES = int(os.getenv("PINECONE_BREAKER_FAILURES", "5"))  # consecutive failed calls to open
+PINECONE_BREAKER_RESET = float(os.getenv("PINECONE_BREAKER_RESET", "30"))     # seconds open before a trial call
+# -------------------------
+
+CONTROL_PLANE_URL = "https://api.pinecone.io"
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+HEDGE_MIN_SAMPLES = 20        # successful calls needed before the p95 is trusted
+
+
+class DeadlineExceeded(requests.Timeout):
+    pass
+
+
+class CircuitOpen(requests.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Closed until `failures` calls in a row fail; then open (calls rejected without touching the
+    network) for reset_s, after which one trial call is let through. Its outcome closes the
+    breaker or opens it for another reset_s.
+    """
+
+    def __init__(self, failures=PINECONE_BREAKER_FAILURES, reset_s=PINECONE_BREAKER_RESET):
+        self.failures = failures
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_running = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.reset_s else "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_s and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._trial_running or (self._opened_at is None and self._consecutive >= self.failures):
+                self._opened_at = time.monotonic()
+                self.opened += 1
+            self._trial_running = False
+
+
+class PineconeClient:
+    """
+    HTTP client for one Pinecone host (data plane or api.pinecone.io): a keep-alive Session
+    with a bounded connection pool, a deadline per call that covers every retry, retries with
+    full-jitter backoff on connection errors / 429 / 5xx, optional hedging (a second identical
+    request once the first has taken longer than the recent p95) and a circuit breaker.
+    """
+
+    def __init__(self, base_url, api_key, timeout=PINECONE_TIMEOUT, retries=PINECONE_RETRIES,
+                 backoff_ms=PINECONE_BACKOFF_MS, pool_size=PINECONE_POOL_SIZE, hedge=PINECONE_HEDGE,
+                 hedge_min_ms=PINECONE_HEDGE_MIN_MS, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff_ms / 1000.0
+        self.hedge = hedge
+        self.hedge_min = hedge_min_ms / 1000.0
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Api-Key": api_key or "", "Content-Type": "application/json"})
+
+        self._hedge_pool = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self.calls = 0
+        self.failed = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def p95(self):
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return float(np.percentile(self._latencies, 95))
+
+    def send(self, method, path, timeout=None, retries=None, hedge=None, **kwargs):
+        """
+        Returns the final requests.Response (any status once retries are spent or the status
+        isn't retryable). Raises CircuitOpen, DeadlineExceeded or the last connection error.
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        retries = self.retries if retries is None else retries
+        hedge = self.hedge if hedge is None else hedge
+
+        if not self.breaker.allow():
+            tracing.count("vector_circuit_rejections_total")
+            raise CircuitOpen(f"Circuit open for {self.base_url}")
+        with self._lock:
+            self.calls += 1
+
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"{method} {path}: deadline exceeded after {attempt} attempt(s)")
+                started = time.monotonic()
+                resp = self._send_hedged(method, path, remaining, **kwargs) if hedge \
+                    else self._send_once(method, path, remaining, **kwargs)
+                if resp.status_code not in RETRYABLE_STATUS or attempt >= retries:
+                    self._finished(resp.status_code not in RETRYABLE_STATUS, time.monotonic() - started)
+                    return resp
+            except DeadlineExceeded:
+                self._finished(False)
+                raise
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries:
+                    self._finished(False)
+                    raise
+            except Exception:
+                # Anything else (ChunkedEncodingError, a hedge worker's error) still ends the call;
+                # record it so a half-open trial doesn't leave the breaker stuck open
+                self._finished(False)
+                raise
+            attempt += 1
+            with self._lock:
+                self.retried += 1
+            tracing.count("vector_retries_total")
+            # Full jitter, and never sleep past the deadline
+            pause = random.uniform(0, self.backoff * 2 ** (attempt - 1))
+            time.sleep(max(min(pause, deadline - time.monotonic()), 0))
+
+    def request(self, method, path, **kwargs):
+        """send() that raises requests.HTTPError for a non-2xx response and returns the JSON body."""
+        resp = self.send(method, path, **kwargs)
+        resp.raise_for_status()
+        return resp.json() if resp.content else {}
+
+    def _finished(self, ok, elapsed=None):
+        if ok:
+            self.breaker.success()
+            with self._lock:
+                if elapsed is not None:
+                    self._latencies.append(elapsed)
+        else:
+            self.breaker.failure()
+            with self._lock:
+                self.failed += 1
+
+    def _send_once(self, method, path, remaining, **kwargs):
+        # requests' read timeout bounds each socket read, which is close enough to the budget here
+        return self.session.request(method, self._url(path),
+                                    timeout=(min(PINECONE_CONNECT_TIMEOUT, remaining), remaining), **kwargs)
+
+    @property
+    def hedge_pool(self):
+        if self._hedge_pool is None:
+            with self._lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                          thread_name_prefix="pinecone-hedge")
+        return self._hedge_pool
+
+    def _send_hedged(self, method, path, remaining, **kwargs):
+        p95 = self.p95()
+        if p95 is None:
+            return self._send_once(method, path, remaining, **kwargs)
+        delay = max(p95, self.hedge_min)
+        if delay >= remaining:
+            return self._send_once(method, path, remaining, **kwargs)
+
+        started = time.monotonic()
+        first = self.hedge_pool.submit(self._send_once, method, path, remaining, **kwargs)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        # First request is slower than p95: race a duplicate against it. The loser's
+        # response is dropped; its connection goes back to the pool when it completes.
+        with self._lock:
+            self.hedged += 1
+        tracing.count("vector_hedges_total")
+        left = remaining - (time.monotonic() - started)
+        second = self.hedge_pool.submit(self._send_once, method, path, left, **kwargs)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(remaining - (time.monotonic() - started), 0),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f"{method} {path}: hedged requests exceeded the deadline")
+            for future in done:
+                try:
+                    resp = future.result()
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                    continue
+                if future is second:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return resp
+        raise error
+
+    def close(self):
+        self.session.close()
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+
+    def stats(self):
+        p95 = self.p95()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failed": self.failed,
+                "retries": self.retried,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "p95_ms": round(1000 * p95, 1) if p95 is not None else None,
+                "breaker": self.breaker.state,
+                "breaker_opened": self.breaker.opened,
+                "breaker_rejected": self.breaker.rejected
+            }
@@ -0,0 +1,252 @@
+import os
+import re
+import threading
+
+RULES_FILE = "gst_rules.txt"
+
+# Query words -> the wording used in gst_rules.txt (after normalization)
+SYNONYMS = {
+    "mobile phone": "mobile",
+    "cell phone": "mobile",
+    "cellphone": "mobile",
+    "smartphone": "mobile",
+    "phone": "mobile",
+    "laptop": "computer",
+    "desktop": "computer",
+    "pc": "computer",
+    "automobile": "car",
+    "motor car": "car",
+    "milk": "fresh milk",
+    "veggie": "vegetable",
+    "cooking oil": "edible oil",
+    "soft drink": "aerated drink",
+    "cold drink": "aerated drink",
+    "cola": "aerated drink",
+    "soda": "aerated drink",
+    "cigarette": "tobacco",
+    "machinery": "capital good",
+}
+
+# A rate question has to say so; "can I claim ITC on food" must not come back as "food: 12%"
+RATE_QUESTION = re.compile(r"\b(rate|rates|slab|percent|how much (gst|tax)|(gst|tax) (on|for|of))\b")
+
+# Question and calculation framing around the item name; any other word left over means the
+# query is about something the slab table doesn't list ("laptop bags", "milk powder")
+FRAME_WORDS = frozenset("""
+    what is are the a an of on for in at to me tell please india current applicable
+    gst tax rate slab percent percentage how much charged levied calculate invoice
+""".split())
+
+# Whole questions whose answer is exactly one rules section. Anything else that merely mentions
+# e-way bills, registration or IGST ("penalty for not generating an e-way bill", "ITC on IGST
+# paid on imports") needs retrieval and the LLM.
+_GST = r"(?:gst )?"
+FACT_QUESTIONS = {
+    "eway": re.compile(r"(?:when is (?:an |the )?e-?way bill (?:required|needed|mandatory)"
+                       r"|(?:what is the )?e-?way bill (?:limit|threshold))"),
+    "registration": re.compile(rf"(?:what (?:is|are) the )?{_GST}registration (?:limit|threshold)s?"
+                               rf"|what is the turnover (?:limit|threshold) for {_GST}registration"
+                               rf"|when is {_GST}registration (?:required|mandatory)"),
+    "supply": re.compile(r"(?:what is the )?difference between (?:igst|cgst|sgst|cgst/sgst) and (?:igst|cgst|sgst|cgst/sgst)"
+                         r"|(?:explain )?(?:igst|cgst/sgst|cgst) vs\.? (?:igst|cgst/sgst|cgst|sgst)"
+                         r"|when (?:is|to) (?:apply|charge) igst(?: or cgst/sgst)?"),
+}
+
+
+def _question(query):
+    """'When is an E-way bill required?' -> 'when is an e-way bill required'."""
+    return " ".join(query.lower().split()).rstrip("?.! ")
+
+_SLAB_LINE = re.compile(r"^-\s*(\d+(?:\.\d+)?)%\s*Rate(?:\s*\(([^)]*)\))?:\s*(.*)$")
+_THRESHOLD_LINE = re.compile(r"^-\s*(Goods|Services):\s*([\d.]+\s*Lakhs)[^(]*(?:\(([\d.]+\s*Lakhs)[^)]*\))?", re.I)
+_EWAY_AMOUNT = re.compile(r"Rs\.?\s*([\d,]+)")
+
+
+def _singular(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize(text):
+    """Lowercase, drop punctuation, singularize: 'High-end Motorcycles.' -> 'high end motorcycle'."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return " ".join(_singular(w) for w in words)
+
+
+def _as_sentences(lines):
+    sentences = []
+    for line in lines:
+        line = line.lstrip("- ").strip()
+        sentences.append(line if line.endswith((".", "!", "?")) else line + ".")
+    return " ".join(sentences)
+
+
+def _sections(text):
+    """Splits the rules file into {heading: [lines]} on 'HEADING:' lines."""
+    sections = {}
+    current = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.endswith(":") and stripped[:-1].upper() == stripped[:-1]:
+            current = stripped[:-1]
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(stripped)
+    return sections
+
+
+def compile_rules(text):
+    """
+    Parses gst_rules.txt into {"items": {normalized item: entry}, "facts": {topic: answer}}.
+    Slab lines look like '- 5% Rate: Household necessities like sugar, spices, tea.'
+    """
+    sections = _sections(text)
+    items = {}
+
+    for line in sections.get("GST TAX SLABS", []):
+        match = _SLAB_LINE.match(line)
+        if not match:
+            continue
+        rate, note, body = float(match.group(1)), match.group(2), match.group(3).rstrip(".")
+        category, _, examples = body.partition(" like ")
+        names = examples if examples else body
+        for name in re.split(r",|\band\b", names):
+            name = name.strip()
+            key = normalize(name)
+            if not key:
+                continue
+            items[key] = {"item": name, "rate": rate, "note": note,
+                          "category": category.strip() if examples else None, "section": "GST TAX SLABS"}
+
+    facts = {}
+    supply = sections.get("IGST VS CGST/SGST LOGIC")
+    if supply:
+        facts["supply"] = {"section": "IGST VS CGST/SGST LOGIC", "answer": _as_sentences(supply)}
+
+    registration = sections.get("REGISTRATION THRESHOLDS")
+    if registration:
+        thresholds = {}
+        for line in registration:
+            match = _THRESHOLD_LINE.match(line)
+            if match:
+                thresholds[match.group(1).lower()] = {"normal": match.group(2), "special_category": match.group(3)}
+        facts["registration"] = {"section": "REGISTRATION THRESHOLDS",
+                                 "answer": "Registration is required above: " + _as_sentences(registration),
+                                 "thresholds": thresholds}
+
+    eway = sections.get("E-WAY BILL")
+    if eway:
+        amount = next((m.group(1) for m in map(_EWAY_AMOUNT.search, eway) if m), None)
+        facts["eway"] = {"section": "E-WAY BILL", "answer": "E-way bill: " + _as_sentences(eway),
+                         "threshold": int(amount.replace(",", "")) if amount else None}
+
+    return {"items": items, "facts": facts}
+
+
+class RateIndex:
+    """
+    In-memory item -> rate index over gst_rules.txt. The file's mtime/size is checked on
+    every lookup and the index is recompiled when it changes, so edits apply without a restart.
+    """
+
+    def __init__(self, path=RULES_FILE, synonyms=SYNONYMS):
+        self.path = path
+        self.synonyms = {normalize(k): normalize(v) for k, v in synonyms.items()}
+        self._lock = threading.Lock()
+        self._signature = None
+        self._compiled = {"items": {}, "facts": {}}
+        self.builds = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _current(self):
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return self._compiled
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._compiled = compile_rules(f.read())
+                    self._signature = signature
+                    self.builds += 1
+        return self._compiled
+
+    def match_items(self, query):
+        """
+        Items the query names, when every word outside FRAME_WORDS is part of a whole item
+        name (or 'and' between two); [] as soon as one word isn't, so near misses go to retrieval.
+        """
+        items = self._current()["items"]
+        words = [w for w in normalize(query).split() if w not in FRAME_WORDS and not w.isdigit()]
+        found = []
+        i = 0
+        while i < len(words):
+            if words[i] == "and" and found:
+                i += 1
+                continue
+            for n in (4, 3, 2, 1):
+                if len(words) - i < n:
+                    continue
+                phrase = " ".join(words[i:i + n])
+                key = self.synonyms.get(phrase, phrase)
+                if key in items:
+                    if items[key] not in found:
+                        found.append(items[key])
+                    i += n
+                    break
+            else:
+                return []
+        return found
+
+    def rate_for(self, query):
+        """The slab rate when the query names exactly one rate; None otherwise."""
+        rates = {entry["rate"] for entry in self.match_items(query)}
+        return rates.pop() if len(rates) == 1 else None
+
+    def answer(self, query, items=True, facts=True):
+        """
+        A direct answer for rate (items) and fact (facts) questions the index covers, else None.
+        Fact topics name supply types that data queries use too, so callers route first.
+        """
+        q = query.lower()
+        compiled = self._current()
+
+        if items and RATE_QUESTION.search(q):
+            found = self.match_items(query)
+            if found:
+                self._count(hit=True)
+                lines = []
+                for entry in found:
+                    note = f" ({entry['note']})" if entry["note"] else ""
+                    lines.append(f"{entry['item'].capitalize()}: {entry['rate']:g}% GST{note}")
+                return "; ".join(lines) + ". (Source: GST TAX SLABS)"
+
+        question = _question(query)
+        for topic, pattern in FACT_QUESTIONS.items():
+            if facts and pattern.fullmatch(question) and topic in compiled["facts"]:
+                fact = compiled["facts"][topic]
+                self._count(hit=True)
+                return f"{fact['answer']} (Source: {fact['section']})"
+
+        self._count(hit=False)
+        return None
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        current = self._compiled
+        return {"items": len(current["items"]), "facts": sorted(current["facts"]), "builds": self.builds,
+                "hits": self.hits, "misses": self.misses}
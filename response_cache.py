@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", ".response_cache.sqlite")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "256"))
+# How stale another process's invalidate() may be here (seconds); 0 checks on every lookup
+RESPONSE_CACHE_GENERATION_CHECK_S = float(os.getenv("RESPONSE_CACHE_GENERATION_CHECK_S", "1.0"))
+# -------------------------
+
+
+def make_key(model_name, template_version, query, context):
+    """Content address for one LLM call: same model, template, question and evidence -> same answer."""
+    payload = json.dumps([model_name, template_version, query, context], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses: an in-memory LRU in front of a SQLite file.
+    Entries expire after ttl seconds; the SQLite tier is trimmed to max_entries by last access.
+    invalidate() bumps a generation counter stored in SQLite, so other processes sharing the
+    file drop their in-memory entries too, within generation_check_s seconds.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES, memory_entries=RESPONSE_CACHE_MEMORY_ENTRIES,
+                 generation_check_s=RESPONSE_CACHE_GENERATION_CHECK_S):
+        self.ttl = ttl
+        self.generation_check_s = generation_check_s
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self._memory = OrderedDict()
+        self._memory_generation = None
+        self._generation_checked = float("-inf")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO cache_meta (name, value) VALUES ('generation', 0);
+        """)
+        self._conn.commit()
+
+    def _generation(self):
+        return self._conn.execute("SELECT value FROM cache_meta WHERE name = 'generation'").fetchone()[0]
+
+    def _sync_memory(self):
+        # Memory hits shouldn't pay a SQLite read; the counter only moves on invalidate()
+        now = time.monotonic()
+        if now - self._generation_checked < self.generation_check_s:
+            return
+        self._generation_checked = now
+        generation = self._generation()
+        if generation != self._memory_generation:
+            self._memory.clear()
+            self._memory_generation = generation
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            self._sync_memory()
+
+            # 1. Memory tier
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            # 2. Disk tier
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._remember(key, row[0], row[1])
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._sync_memory()
+            self._remember(key, value, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self._conn.execute("""
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def invalidate(self):
+        """Drops every cached response, e.g. after gst_rules.txt is re-indexed."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("UPDATE cache_meta SET value = value + 1 WHERE name = 'generation'")
+            self._conn.commit()
+            self._memory.clear()
+            self._memory_generation = self._generation()
+            self._generation_checked = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            }
@@ -0,0 +1,258 @@
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+import agent_invoice_sql
+import formatters
+import tracing
+from agent_orchestrator import OrchestratorAgent
+from db import PoolTimeout, get_pool
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8080"))
+SERVER_MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", "32"))   # queries executing at once
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", "64"))               # queries waiting for a slot
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", "5"))      # seconds a queued query may wait
+SQL_BATCH_WINDOW_MS = float(os.getenv("SERVER_SQL_BATCH_WINDOW_MS", "2"))
+# -------------------------
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionController:
+    """
+    Bounded admission: up to max_concurrency queries run, up to max_queue more wait for a
+    slot, and anything beyond that is turned away immediately (HTTP 429) instead of piling up.
+    """
+
+    def __init__(self, max_concurrency=SERVER_MAX_CONCURRENCY, max_queue=SERVER_MAX_QUEUE,
+                 queue_timeout=SERVER_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._admitted = threading.BoundedSemaphore(max_concurrency + max_queue)
+        self._running = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.in_flight = 0
+        self.served = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+
+    def __enter__(self):
+        if not self._admitted.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded("Server is at capacity, retry shortly.")
+        with self._lock:
+            self.admitted += 1
+        if not self._running.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.admitted -= 1
+                self.queue_timeouts += 1
+            self._admitted.release()
+            raise Overloaded(f"No worker free after {self.queue_timeout}s, retry shortly.")
+        with self._lock:
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.in_flight -= 1
+            self.admitted -= 1
+            self.served += 1
+        self._running.release()
+        self._admitted.release()
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.admitted - self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "served": self.served,
+                "rejected": self.rejected,
+                "queue_timeouts": self.queue_timeouts
+            }
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 for keep-alive and chunked streaming; every other response sets Content-Length
+    protocol_version = "HTTP/1.1"
+    # Set by serve()
+    system = None
+    admission = None
+    started = None
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text, content_type):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_text(200, tracing.prometheus_text(), "text/plain; version=0.0.4; charset=utf-8")
+            return
+        if self.path == "/metrics?format=json":
+            self._send_json(200, tracing.snapshot())
+            return
+        if self.path != "/health":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        rag = self.system._rag_agent
+        health = {
+            "status": "ok",
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "admission": self.admission.stats(),
+            # Only report what is already loaded; a health check must not trigger model loading
+            "embedder": rag._embedder.stats() if rag is not None and rag._embedder is not None else None,
+            "llm_available": rag._llm_available if rag is not None else None,
+            "latency": self.system.latency.stats(),
+            "router": self.system._router.stats() if self.system._router is not None else None,
+            "rate_index": self.system.rate_index.stats(),
+            "vector_store": rag.vector_store.stats() if rag is not None else None,
+            "formatters": formatters.stats(),
+            "sql_batcher": agent_invoice_sql.lookup_batcher.stats() if agent_invoice_sql.lookup_batcher else None,
+            "db_pool": get_pool().metrics()
+        }
+        self._send_json(200, health)
+
+    def do_POST(self):
+        if self.path != "/query":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self.close_connection = True   # unread body would corrupt the next keep-alive request
+            self._send_json(400, {"error": f"Body must be 1-{MAX_BODY_BYTES} bytes of JSON"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length))
+            query = body.get("query", "").strip()
+            stream = bool(body.get("stream", False))
+        except (ValueError, AttributeError):
+            query = ""
+        if not query:
+            self._send_json(400, {"error": 'Expected JSON body {"query": "..."}'})
+            return
+
+        started = time.monotonic()
+        try:
+            with self.admission:
+                if stream:
+                    self._stream_answer(query)
+                    return
+                answer = self.system.run(query)
+        except Overloaded as e:
+            self._send_json(429, {"error": str(e)}, headers={"Retry-After": "1"})
+            return
+        except PoolTimeout as e:
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": "1"})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+
+        self._send_json(200, {
+            "query": query,
+            "answer": answer,
+            "latency_ms": round(1000 * (time.monotonic() - started), 1)
+        })
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_answer(self, query):
+        # Chunked plain-text response, one HTTP chunk per answer chunk as it is generated.
+        # Routing and lookups run before the first chunk, so their errors still get a JSON status.
+        chunks = self.system.stream(query)
+        first = next(chunks, "")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in itertools.chain([first], chunks):
+                if chunk:
+                    self._write_chunk(chunk.encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            chunks.close()   # client went away; stop generating
+            self.close_connection = True
+            return
+        except Exception as e:
+            self._write_chunk(f"\nError: {e}".encode("utf-8"))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        # Per-request access logs would dominate output under load; errors still go to stderr
+        pass
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Bursts beyond the listen backlog get connection resets, not a clean 429
+    request_queue_size = 256
+
+
+def make_server(host=SERVER_HOST, port=SERVER_PORT, system=None, admission=None):
+    # Concurrent requests share one orchestrator, so embeddings and SQL lookups from
+    # different requests land in the same micro-batches
+    if SQL_BATCH_WINDOW_MS > 0:
+        agent_invoice_sql.enable_lookup_batching(SQL_BATCH_WINDOW_MS)
+    handler = type("BoundQueryHandler", (QueryHandler,), {
+        "system": system or OrchestratorAgent(warm_up=True),
+        "admission": admission or AdmissionController(),
+        "started": time.monotonic()
+    })
+    return QueryServer((host, port), handler)
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT):
+    server = make_server(host, port)
+    print(f"--- GST INTELLIGENCE SERVICE on http://{host}:{port} ---")
+    print("POST /query {\"query\": \"...\"}  |  GET /health  |  GET /metrics")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        get_pool().close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/JSON service around the GST orchestrator.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+    serve(args.host, args.port)
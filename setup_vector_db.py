@@ -1,9 +1,14 @@
+import hashlib
+import itertools
 import os
+import sys
 import time
-import requests
 import json
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
+from embedding_models import get_embedding_model
+from vector_store import LocalVectorStore, PineconeVectorStore, VECTOR_BACKEND, control_plane
+from response_cache import ResponseCache
+from upsert_pipeline import UpsertPipeline, embed_stream
 
 # Load environment variables
 load_dotenv()
@@ -13,19 +18,142 @@ PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 INDEX_NAME = os.getenv("INDEX_NAME", "gst-rules-index")
 # -------------------------
 
-MODEL_NAME = "all-MiniLM-L6-v2"
 SOURCE_FILE = "gst_rules.txt"
+MANIFEST_FILE = ".vector_manifest.json"
+# Bump when chunk_metadata changes: every chunk then gets a new ID and is re-upserted once
+METADATA_VERSION = 2
 
-def setup_database():
-    headers = {
-        "Api-Key": PINECONE_API_KEY,
-        "Content-Type": "application/json"
-    }
+def iter_chunks(path=SOURCE_FILE):
+    """Yields blank-line separated chunks one at a time instead of reading the whole file."""
+    lines = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                lines.append(line)
+            elif lines:
+                chunk = "\n".join(lines).strip()
+                lines = []
+                if chunk:
+                    yield chunk
+    chunk = "\n".join(lines).strip()
+    if chunk:
+        yield chunk
+
+def chunk_id(chunk):
+    # Content-addressed: editing one rule changes one ID, the rest stay put
+    return "rule_" + hashlib.sha256(f"v{METADATA_VERSION}\n{chunk}".encode("utf-8")).hexdigest()[:16]
+
+def chunk_metadata(chunk):
+    # "GST TAX SLABS:" heading -> section "gst tax slabs", a filterable facet
+    heading = chunk.split("\n", 1)[0]
+    metadata = {"text": chunk}
+    if heading.endswith(":") and heading.upper() == heading:
+        metadata["section"] = heading.rstrip(":").strip().lower()
+    return metadata
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    tmp_path = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+def sync_index(store, manifest_key, fresh=False):
+    """Embeds and upserts only new/changed chunks and deletes removed ones."""
+    print("Loading Rule Data...")
+    if not os.path.exists(SOURCE_FILE):
+        print(f"Error: {SOURCE_FILE} not found.")
+        return False
+
+    manifest = load_manifest()
+    if fresh:
+        # Newly created (or missing) index: whatever the manifest says is gone
+        indexed = set()
+    elif manifest_key in manifest:
+        indexed = set(manifest[manifest_key])
+    else:
+        # First incremental run against this index: see what is actually there
+        # (this also catches positional rule_<n> IDs from older setups)
+        try:
+            indexed = set(store.list_ids(prefix="rule_"))
+        except Exception as e:
+            print(f"Could not list existing vectors ({e}); assuming an empty index.")
+            indexed = set()
+
+    current = set()
+
+    def changed_records():
+        for chunk in iter_chunks():
+            cid = chunk_id(chunk)
+            if cid in current:
+                continue
+            current.add(cid)
+            if cid not in indexed:
+                yield {"id": cid, "text": chunk, "metadata": chunk_metadata(chunk)}
+
+    # 1. Stream changed chunks -> batched encode -> concurrent upsert workers
+    records = changed_records()
+    first = next(records, None)
+    failed_ids = set()
+    upserted = 0
+    if first is not None:
+        print("Generating Embeddings...")
+        model = get_embedding_model()
+        pipeline = UpsertPipeline(store)
+        with store.deferred_writes():
+            stats = pipeline.run(embed_stream(itertools.chain([first], records), model))
+        failed_ids = pipeline.failed_ids
+        upserted = stats["vectors"]
+
+    # 2. Whatever was indexed but no longer appears in the file is stale
+    removed = sorted(indexed - current)
+    print(f"Index diff: {upserted} upserted, {len(failed_ids)} failed, {len(removed)} deleted, "
+          f"{len(current & indexed)} unchanged.")
+    if removed:
+        store.delete(removed)
+
+    manifest[manifest_key] = sorted(current - failed_ids)
+    save_manifest(manifest)
+
+    if upserted or removed:
+        # Answers cached against the old rules are stale now
+        ResponseCache().invalidate()
+    return True
+
+def setup_local_database():
+    store = LocalVectorStore()
+    if sync_index(store, f"local:{os.path.abspath(store.path)}", fresh=not store.is_ready()):
+        print("✅ Local index is up to date!")
+
+def wait_until_ready(api, timeout=300, interval=2):
+    """Polls the index description until Pinecone reports it ready."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        resp = api.send("GET", f"indexes/{INDEX_NAME}")
+        if resp.status_code == 200 and resp.json().get("status", {}).get("ready"):
+            return True
+        time.sleep(interval)
+        interval = min(interval * 1.5, 10)
+    return False
+
+def setup_database(backend=None):
+    if (backend or VECTOR_BACKEND).lower() == "local":
+        return setup_local_database()
+
+    # One keep-alive session for every control-plane call below
+    api = control_plane(PINECONE_API_KEY)
 
     print("Checking Pinecone Index via REST API...")
     
     # 1. List Indexes
-    resp = requests.get("https://api.pinecone.io/indexes", headers=headers)
+    resp = api.send("GET", "indexes")
     if resp.status_code != 200:
         print(f"❌ Error listing indexes: {resp.text}")
         return
@@ -35,6 +163,7 @@ def setup_database():
     print(f"Existing Indexes: {existing_names}")
 
     host = None
+    created = False
 
     if INDEX_NAME not in existing_names:
         print(f"Creating new Serverless index: {INDEX_NAME}...")
@@ -49,17 +178,20 @@ def setup_database():
                 }
             }
         }
-        resp = requests.post("https://api.pinecone.io/indexes", json=create_payload, headers=headers)
+        resp = api.send("POST", "indexes", json=create_payload)
         if resp.status_code != 201:
              print(f"❌ Failed to create index: {resp.text}")
              return
-        print("Index creating... waiting 30s...")
-        time.sleep(30)
+        print("Index creating... waiting until ready...")
+        if not wait_until_ready(api):
+            print(f"❌ Index '{INDEX_NAME}' did not become ready in time.")
+            return
+        created = True
     else:
         print(f"Index '{INDEX_NAME}' already exists.")
 
     # 2. Get Index Host
-    resp = requests.get(f"https://api.pinecone.io/indexes/{INDEX_NAME}", headers=headers)
+    resp = api.send("GET", f"indexes/{INDEX_NAME}")
     if resp.status_code != 200:
         print(f"❌ Failed to get index details: {resp.text}")
         return
@@ -67,46 +199,11 @@ def setup_database():
     host = resp.json()['host']
     print(f"✅ Target Host: {host}")
 
-    # 3. Embed Data
-    print("Loading Rule Data...")
-    if not os.path.exists(SOURCE_FILE):
-        print(f"Error: {SOURCE_FILE} not found.")
-        return
-
-    with open(SOURCE_FILE, "r") as f:
-        content = f.read()
-
-    chunks = [chunk.strip() for chunk in content.split("\n\n") if chunk.strip()]
-    print(f"Found {len(chunks)} rule chunks to upsert.")
-
-    print("Generating Embeddings...")
-    model = SentenceTransformer(MODEL_NAME)
-    embeddings = model.encode(chunks)
-
-    # 4. Upsert
-    vectors = []
-    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-        vectors.append({
-            "id": f"rule_{i}",
-            "values": embedding.tolist(),
-            "metadata": {"text": chunk}
-        })
-    
-    upsert_url = f"https://{host}/vectors/upsert"
-    
-    # Batch upsert logic (Pinecone supports max 2MB request, strict batching is safe)
-    batch_size = 50
-    for i in range(0, len(vectors), batch_size):
-        batch = vectors[i:i+batch_size]
-        payload = {"vectors": batch}
-        print(f"Upserting batch {i} to {i+len(batch)}...")
-        resp = requests.post(upsert_url, json=payload, headers=headers)
-        if resp.status_code != 200:
-            print(f"❌ Upsert failed: {resp.text}")
-        else:
-            print(f"Batch {i} success: {resp.json()}")
-
-    print("✅ Full Knowledge Base uploaded to Pinecone!")
+    # 3. Embed + Upsert only what changed
+    store = PineconeVectorStore(index_name=INDEX_NAME, api_key=PINECONE_API_KEY, host=host)
+    if sync_index(store, f"pinecone:{INDEX_NAME}", fresh=created):
+        print("✅ Knowledge Base in Pinecone is up to date!")
 
 if __name__ == "__main__":
-    setup_database()
+    # Usage: python setup_vector_db.py [pinecone|local]
+    setup_database(sys.argv[1] if len(sys.argv) > 1 else None)
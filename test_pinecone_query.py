@@ -1,5 +1,5 @@
 import requests
-from sentence_transformers import SentenceTransformer
+from embedding_models import get_embedding_model
 
 PINECONE_API_KEY = "pcsk_237Kxu_3J1tXeQQfmfVvRbSk7ynDnCHa4kMzsPfFPMVaP1cV9fvVBPNJfWBM5sL3AZeWzf"
 INDEX_NAME = "gst-rules-index"
@@ -12,7 +12,7 @@ host = resp.json()['host']
 print(f"Querying index at: {host}")
 
 # Test query
-model = SentenceTransformer("all-MiniLM-L6-v2")
+model = get_embedding_model()
 query_text = "What is the GST rate for mobile phones?"
 query_embedding = model.encode([query_text])[0].tolist()
 
@@ -0,0 +1,460 @@
+import asyncio
+import bisect
+import cProfile
+import contextvars
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") == "1"
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")                  # JSON lines, one per request; empty = off
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))            # > 0: profile requests, keep the slower ones
+TRACE_PROFILER = os.getenv("TRACE_PROFILER", "sample")            # "sample" (stack sampling) or "cprofile"
+TRACE_PROFILE_DIR = os.getenv("TRACE_PROFILE_DIR", "profiles")
+TRACE_SAMPLE_INTERVAL_MS = float(os.getenv("TRACE_SAMPLE_INTERVAL_MS", "5"))
+# -------------------------
+
+# Spans time the stages of a request (classify, embed, vector_query, sql_connect, sql_execute,
+# llm, format, ...). Every span feeds the process-wide stage_seconds histogram; spans opened
+# inside tracing.request() are also kept on that request's trace, which is appended to
+# TRACE_LOG_PATH when the request ends. The current trace lives in a context variable, so
+# code on the request's thread (or a worker given a copied context) needs no plumbing.
+
+METRIC_PREFIX = "gst_"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Metrics:
+    """Process-wide counters and histograms, rendered as Prometheus text or a JSON snapshot."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)   # (name, labels) -> value
+        self._histograms = {}                 # (name, labels) -> {"buckets", "counts", "sum", "count"}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0,
+                                                "count": 0}
+            i = bisect.bisect_left(hist["buckets"], value)
+            if i < len(hist["buckets"]):
+                hist["counts"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _copy(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {**hist, "counts": list(hist["counts"])} for key, hist in self._histograms.items()}
+        return counters, histograms
+
+    @staticmethod
+    def _cumulative(hist):
+        return list(zip(hist["buckets"], itertools.accumulate(hist["counts"])))
+
+    def snapshot(self):
+        counters, histograms = self._copy()
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(counters.items())],
+            "histograms": [{"name": name, "labels": dict(labels), "count": hist["count"],
+                            "sum": round(hist["sum"], 6),
+                            "buckets": {str(bound): n for bound, n in self._cumulative(hist)}}
+                           for (name, labels), hist in sorted(histograms.items())]
+        }
+
+    def prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        counters, histograms = self._copy()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{METRIC_PREFIX}{name}{_labels(labels)} {value:g}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+            for (metric, labels), hist in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, n in self._cumulative(hist):
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {n}")
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_labels(labels + (('le', '+Inf'),))} {hist['count']}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{_labels(labels)} {hist['sum']:.6f}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{_labels(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+metrics = Metrics()
+
+
+class Trace:
+    """One request: its spans (offsets from the request start), annotations, counts and profile."""
+    _ids = itertools.count(1)
+
+    def __init__(self, name, attrs):
+        self.id = f"{os.getpid():x}-{next(Trace._ids)}"
+        self.name = name
+        self.attrs = dict(attrs)
+        self.spans = []
+        self.counts = Counter()
+        self.started = time.perf_counter()
+        self.wall_start = time.time()
+        self.duration = None
+        self.error = None
+        self.profile = None
+        self.sampled = False
+
+    def to_dict(self):
+        record = {
+            "trace_id": self.id,
+            "name": self.name,
+            "ts": round(self.wall_start, 3),
+            "duration_ms": round(1000 * self.duration, 3) if self.duration is not None else None,
+            "attrs": self.attrs,
+            "spans": list(self.spans),
+            "counts": dict(self.counts)
+        }
+        if self.error:
+            record["error"] = self.error
+        if self.profile:
+            record["profile"] = self.profile
+        return record
+
+
+_current = contextvars.ContextVar("gst_trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+def record(name, started, error=None, **attrs):
+    """Records a span that began at started (time.perf_counter()) and ends now."""
+    if not TRACE_ENABLED:
+        return
+    elapsed = time.perf_counter() - started
+    metrics.observe("stage_seconds", elapsed, stage=name)
+    if error:
+        metrics.inc("errors_total", stage=name, error=error)
+    trace = _current.get()
+    if trace is not None:
+        entry = {"name": name, "start_ms": round(1000 * (started - trace.started), 3),
+                 "duration_ms": round(1000 * elapsed, 3)}
+        if attrs:
+            entry["attrs"] = attrs
+        if error:
+            entry["error"] = error
+        trace.spans.append(entry)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Times the enclosed block as stage name. Yields the span's attribute dict so the block
+    can add results (row counts, cache outcome) before it closes. Exceptions are counted.
+    """
+    if not TRACE_ENABLED:
+        yield attrs
+        return
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record(name, started, error, **attrs)
+
+
+def count(name, value=1, **labels):
+    """Increments counter name{labels}, and the same key on the current request's trace."""
+    if not TRACE_ENABLED:
+        return
+    metrics.inc(name, value, **labels)
+    trace = _current.get()
+    if trace is not None:
+        trace.counts[":".join([name, *map(str, labels.values())])] += value
+
+
+def observe_size(kind, size):
+    """Payload size (bytes, characters, rows) into the payload_size{kind} histogram."""
+    if TRACE_ENABLED:
+        metrics.observe("payload_size", size, buckets=SIZE_BUCKETS, kind=kind)
+
+
+def annotate(**attrs):
+    """Adds attributes (intent, route source, ...) to the current request's trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+@contextmanager
+def request(name="query", **attrs):
+    """
+    Scope of one request. Spans opened inside attach to its trace; on exit the total goes to
+    request_seconds{request, intent}, the trace is appended to TRACE_LOG_PATH, and with
+    TRACE_SLOW_MS set, a profile of a request slower than that is saved to TRACE_PROFILE_DIR.
+    Sampled profiles cover the thread that entered a sync request plus every worker step run
+    through attached(); inside an event loop only the workers are sampled, since the loop thread
+    interleaves other requests. cProfile can only follow one thread, so it profiles sync requests only.
+    """
+    if not TRACE_ENABLED:
+        yield None
+        return
+    trace = Trace(name, attrs)
+    previous = _current.get()
+    token = _current.set(trace)
+    profile = _start_profile(trace) if TRACE_SLOW_MS > 0 else None
+    try:
+        yield trace
+    except Exception as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        trace.duration = time.perf_counter() - trace.started
+        if profile is not None:
+            _finish_profile(profile, trace)
+        try:
+            _current.reset(token)
+        except ValueError:
+            # An abandoned async stream is closed from whichever context collects it
+            _current.set(previous)
+        _finish(trace)
+
+
+def isolated(generator):
+    """
+    Runs generator step by step in a private copy of the current context. A request() opened
+    inside a generator would otherwise stay set in the consumer's context between yields.
+    """
+    context = contextvars.copy_context()
+    try:
+        while True:
+            try:
+                item = context.run(next, generator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        context.run(generator.close)
+
+
+def _finish(trace):
+    intent = trace.attrs.get("intent", "unknown")
+    metrics.observe("request_seconds", trace.duration, request=trace.name, intent=intent)
+    if trace.error:
+        metrics.inc("errors_total", stage=trace.name, error=trace.error)
+    if TRACE_LOG_PATH:
+        _write_log(trace.to_dict())
+
+
+_log_lock = threading.Lock()
+_log_file = None
+
+
+def _write_log(entry):
+    global _log_file
+    line = json.dumps(entry, default=str) + "\n"
+    with _log_lock:
+        if _log_file is None:
+            _log_file = open(TRACE_LOG_PATH, "a", encoding="utf-8")
+        _log_file.write(line)
+        _log_file.flush()
+
+
+# -------- Slow-request profiling --------
+def _frame_name(frame):
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+class StackSampler:
+    """
+    One daemon thread sampling, every interval_ms, the stack of each thread that is inside a
+    profiled request. Samples are kept as collapsed stacks ("a.py:f;b.py:g" -> count), the
+    input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval_ms=TRACE_SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self._lock = threading.Lock()
+        # trace id -> (Counter of thread ids working for it, Counter of collapsed stacks)
+        self._watched = {}
+        self._thread = None
+
+    def watch(self, key):
+        with self._lock:
+            self._watched[key] = (Counter(), Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-sampler", daemon=True)
+                self._thread.start()
+
+    def unwatch(self, key):
+        with self._lock:
+            _, samples = self._watched.pop(key, (None, Counter()))
+            return samples
+
+    def attach(self, key, thread_id):
+        """Samples thread_id for key until detach(); returns False if key isn't watched."""
+        with self._lock:
+            if key not in self._watched:
+                return False
+            self._watched[key][0][thread_id] += 1
+            return True
+
+    def detach(self, key, thread_id):
+        with self._lock:
+            if key in self._watched:
+                threads = self._watched[key][0]
+                threads[thread_id] -= 1
+                if threads[thread_id] <= 0:
+                    del threads[thread_id]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._watched:
+                    continue
+                frames = sys._current_frames()
+                for threads, samples in self._watched.values():
+                    for thread_id in threads:
+                        frame = frames.get(thread_id)
+                        stack = []
+                        while frame is not None:
+                            stack.append(_frame_name(frame))
+                            frame = frame.f_back
+                        if stack:
+                            samples[";".join(reversed(stack))] += 1
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def _get_sampler():
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = StackSampler()
+    return _sampler
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _start_profile(trace):
+    in_loop = _in_event_loop()
+    if TRACE_PROFILER == "cprofile":
+        if in_loop:
+            # The work runs on executor threads cProfile can't follow; the loop thread's
+            # profile would mix in every other request
+            metrics.inc("profiles_skipped_total")
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active (one per interpreter from Python 3.12)
+            metrics.inc("profiles_skipped_total")
+            return None
+        return ("cprofile", profiler)
+    sampler = _get_sampler()
+    sampler.watch(trace.id)
+    if not in_loop:
+        sampler.attach(trace.id, threading.get_ident())
+    trace.sampled = True
+    return ("sample", trace.id)
+
+
+def attached(fn, *args):
+    """
+    Calls fn(*args), sampling this thread for the current request's profile meanwhile. For
+    worker threads running a step of a request (in a copy of its context).
+    """
+    trace = _current.get()
+    if trace is None or not trace.sampled:
+        return fn(*args)
+    sampler = _get_sampler()
+    thread_id = threading.get_ident()
+    if not sampler.attach(trace.id, thread_id):
+        return fn(*args)
+    try:
+        return fn(*args)
+    finally:
+        sampler.detach(trace.id, thread_id)
+
+
+def _finish_profile(profile, trace):
+    kind, handle = profile
+    if kind == "cprofile":
+        handle.disable()
+    else:
+        samples = _get_sampler().unwatch(handle)
+    if 1000 * trace.duration < TRACE_SLOW_MS:
+        return
+
+    os.makedirs(TRACE_PROFILE_DIR, exist_ok=True)
+    if kind == "cprofile":
+        path = os.path.join(TRACE_PROFILE_DIR, f"{trace.id}.prof")      # python -m pstats <file>
+        handle.dump_stats(path)
+    else:
+        path = os.path.join(TRACE_PROFILE_DIR, f"{trace.id}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(f"{stack} {n}\n" for stack, n in samples.most_common())
+    trace.profile = path
+    metrics.inc("slow_requests_total", request=trace.name)
+
+
+def prometheus_text():
+    return metrics.prometheus()
+
+
+def snapshot():
+    return metrics.snapshot()
@@ -0,0 +1,185 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+UPSERT_WORKERS = int(os.getenv("UPSERT_WORKERS", "4"))
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES", "5"))
+DEAD_LETTER_FILE = os.getenv("UPSERT_DEAD_LETTER_FILE", "upsert_dead_letter.jsonl")
+# -------------------------
+
+ENCODE_BATCH_SIZE = 64
+MAX_REQUEST_BYTES = 2 * 1024 * 1024      # Pinecone upsert request limit
+REQUEST_BYTES_BUDGET = int(MAX_REQUEST_BYTES * 0.9)
+MAX_VECTORS_PER_REQUEST = 1000
+BACKOFF_BASE = 0.5                       # seconds, doubled per attempt
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_stream(records, model, batch_size=ENCODE_BATCH_SIZE):
+    """
+    records: iterable of {"id", "text", "metadata"}. Yields Pinecone-style vectors,
+    encoding batch_size texts per model.encode call, so only one batch is in memory.
+    """
+    for batch in batched(records, batch_size):
+        embeddings = model.encode([r["text"] for r in batch])
+        for record, embedding in zip(batch, embeddings):
+            yield {
+                "id": record["id"],
+                "values": [float(x) for x in embedding],
+                "metadata": record.get("metadata", {"text": record["text"]})
+            }
+
+
+def size_batches(vectors, max_bytes=REQUEST_BYTES_BUDGET, max_count=MAX_VECTORS_PER_REQUEST):
+    """Groups vectors so each upsert body stays under max_bytes of JSON."""
+    batch = []
+    batch_bytes = len('{"vectors": []}')
+    for vector in vectors:
+        size = len(json.dumps(vector)) + 2   # ", " separator
+        if batch and (batch_bytes + size > max_bytes or len(batch) >= max_count):
+            yield batch
+            batch = []
+            batch_bytes = len('{"vectors": []}')
+        batch.append(vector)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _is_retryable(error):
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    # Connection resets, timeouts (incl. the client's deadline), truncated responses
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+def _is_upsert_failure(error):
+    # The service refused or couldn't be reached; anything else is a bug and must surface
+    return isinstance(error, requests.RequestException)
+
+
+class UpsertPipeline:
+    """
+    Producer/consumer indexing: the caller's thread encodes and packs size-aware batches,
+    a bounded pool of workers upserts them concurrently with exponential-backoff retries.
+    Batches that still fail are appended to a dead-letter JSONL file for replay.
+    """
+
+    def __init__(self, store, workers=UPSERT_WORKERS, max_retries=UPSERT_MAX_RETRIES,
+                 dead_letter_file=DEAD_LETTER_FILE):
+        self.store = store
+        self.workers = workers
+        self.max_retries = max_retries
+        self.dead_letter_file = dead_letter_file
+
+        self._lock = threading.Lock()
+        self.vectors_sent = 0
+        self.batches_sent = 0
+        self.retries = 0
+        self.failed_vectors = 0
+        self.failed_ids = set()
+
+    def _upsert_with_retry(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.store.upsert_batch(batch)
+                with self._lock:
+                    self.vectors_sent += len(batch)
+                    self.batches_sent += 1
+                return True
+            except Exception as e:
+                if not _is_upsert_failure(e):
+                    raise
+                if attempt == self.max_retries or not _is_retryable(e):
+                    self._dead_letter(batch, e)
+                    return False
+                with self._lock:
+                    self.retries += 1
+                # Full jitter keeps concurrent workers from retrying in lockstep
+                time.sleep(random.uniform(0, BACKOFF_BASE * 2 ** attempt))
+
+    def _dead_letter(self, batch, error):
+        print(f"❌ Upsert of {len(batch)} vectors failed for good: {error}")
+        with self._lock:
+            self.failed_vectors += len(batch)
+            self.failed_ids.update(v["id"] for v in batch)
+            with open(self.dead_letter_file, "a") as f:
+                f.write(json.dumps({"error": str(error), "vectors": batch}) + "\n")
+
+    def run(self, vectors):
+        """Consumes an iterable of vectors. Returns a stats dict."""
+        started = time.monotonic()
+        # At most two batches queued per worker: the encoder can't run far ahead of the network
+        in_flight = threading.BoundedSemaphore(self.workers * 2)
+        queued = 0
+        errors = []
+
+        def release(future):
+            if future.exception() is not None:
+                errors.append(future.exception())
+            in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upsert") as pool:
+            for batch in size_batches(vectors):
+                in_flight.acquire()
+                if errors:
+                    # A worker hit a non-upsert error; stop queueing and re-raise it below
+                    break
+                pool.submit(self._upsert_with_retry, batch).add_done_callback(release)
+                queued += 1
+                if queued % 20 == 0:
+                    print(f"Queued {queued} batches, {self.vectors_sent} vectors upserted...")
+        if errors:
+            raise errors[0]
+
+        elapsed = time.monotonic() - started
+        stats = {
+            "vectors": self.vectors_sent,
+            "batches": self.batches_sent,
+            "retries": self.retries,
+            "failed_vectors": self.failed_vectors,
+            "seconds": round(elapsed, 2),
+            "vectors_per_sec": round(self.vectors_sent / elapsed, 1) if elapsed > 0 else 0.0
+        }
+        print(f"✅ Upserted {stats['vectors']} vectors in {stats['seconds']}s "
+              f"({stats['vectors_per_sec']} vectors/sec, {stats['retries']} retries, "
+              f"{stats['failed_vectors']} dead-lettered)")
+        return stats
+
+
+def replay_dead_letters(store, dead_letter_file=DEAD_LETTER_FILE):
+    """Re-submits every dead-lettered batch; batches that fail again land in a fresh file."""
+    if not os.path.exists(dead_letter_file):
+        print("No dead letters to replay.")
+        return None
+    replay_file = f"{dead_letter_file}.replaying"
+    os.replace(dead_letter_file, replay_file)
+
+    def vectors():
+        with open(replay_file, "r") as f:
+            for line in f:
+                yield from json.loads(line)["vectors"]
+
+    stats = UpsertPipeline(store, dead_letter_file=dead_letter_file).run(vectors())
+    os.remove(replay_file)
+    return stats
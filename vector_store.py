@@ -0,0 +1,492 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import requests
+from dotenv import load_dotenv
+import tracing
+from agent_state import load_state, save_state
+from pinecone_client import CONTROL_PLANE_URL, PINECONE_WRITE_TIMEOUT, PineconeClient
+
+# Load environment variables
+load_dotenv()
+
+# --- USER CONFIGURATION ---
+PINECONE_KEY = os.getenv("PINECONE_API_KEY")
+INDEX_NAME = os.getenv("INDEX_NAME", "gst-rules-index")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")          # "pinecone" or "local"
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "vector_index")  # writes <path>.npy + <path>.json
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")     # "float32" or "int8"
+VECTOR_FALLBACK_CACHE = int(os.getenv("VECTOR_FALLBACK_CACHE", "1024"))  # recent Pinecone results kept for outages
+VECTOR_FALLBACK_LOCAL = os.getenv("VECTOR_FALLBACK_LOCAL", "1") == "1"   # then fall back to the local index, if built
+# Metadata fields the local index keeps posting lists for; filters on other fields scan the metadata
+LOCAL_INDEX_FACETS = [f for f in os.getenv("LOCAL_INDEX_FACETS", "year,country,category,section").split(",") if f]
+# -------------------------
+
+EMBEDDING_DIM = 384
+INT8_SCALE = 127.0
+
+
+class VectorStore:
+    """
+    Common interface for the vector backends used by the RAG agent and setup script.
+    A store reads and writes one namespace ("" is the default one, holding the GST rules).
+    """
+    name = "base"
+    namespace = ""
+
+    def is_ready(self):
+        raise NotImplementedError
+
+    def query(self, vector, top_k=2, filter=None):
+        """
+        Returns a list of {"id", "score", "metadata"} matches, best first. filter restricts
+        the search to vectors whose metadata matches every field: {"year": 2019,
+        "country": ["de", "at"]} (a list means any of those values).
+        """
+        raise NotImplementedError
+
+    def upsert(self, vectors):
+        """Accepts Pinecone-style records: {"id", "values", "metadata"}."""
+        raise NotImplementedError
+
+    def upsert_batch(self, batch):
+        """Writes one batch as a single request; raises on failure so callers can retry."""
+        self.upsert(batch)
+
+    def deferred_writes(self):
+        """Context manager for bulk indexing; backends that persist per write can batch here."""
+        return nullcontext(self)
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def list_ids(self, prefix=""):
+        raise NotImplementedError
+
+    def for_namespace(self, namespace):
+        """The same backend and index, scoped to another namespace."""
+        raise NotImplementedError
+
+    def stats(self):
+        return {"backend": self.name, "namespace": self.namespace}
+
+
+class PineconeVectorStore(VectorStore):
+    """
+    Pinecone over REST through a pooled PineconeClient. When a query fails (deadline, retries
+    spent, circuit open) it degrades to the last result seen for the same vector, then to the
+    local index if one has been built, and only raises when neither can answer.
+    """
+    name = "Pinecone"
+
+    def __init__(self, index_name=INDEX_NAME, api_key=PINECONE_KEY, host=None, client=None, fallback=None,
+                 namespace=""):
+        self.index_name = index_name
+        self.api_key = api_key
+        self.namespace = namespace
+        # The host lookup is a control-plane round trip; defer it to first use
+        self._host = host
+        self._host_resolved = host is not None
+        self._host_lock = threading.Lock()
+        self._client = client
+        self._fallback = fallback
+        self._recent = OrderedDict()
+        self._recent_lock = threading.Lock()
+        self.fallbacks = {"cache": 0, "local": 0, "failed": 0}
+
+    @property
+    def host(self):
+        if not self._host_resolved:
+            with self._host_lock:
+                if not self._host_resolved:
+                    self._host = self._lookup_host()
+                    self._host_resolved = True
+        return self._host
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._host_lock:
+                if self._client is None:
+                    # A host with a scheme (http://localhost:5081 for Pinecone Local or a test server) is used as is
+                    base_url = self.host if "://" in self.host else f"https://{self.host}"
+                    self._client = PineconeClient(base_url, self.api_key)
+        return self._client
+
+    @property
+    def fallback(self):
+        path = local_index_path(LOCAL_INDEX_PATH, self.namespace)
+        if self._fallback is None and VECTOR_FALLBACK_LOCAL and os.path.exists(f"{path}.npy"):
+            with self._recent_lock:
+                if self._fallback is None:
+                    self._fallback = LocalVectorStore(namespace=self.namespace)
+        return self._fallback
+
+    def for_namespace(self, namespace):
+        # Shares the resolved host and, once connected, the client's connection pool
+        client = self.client if self.is_ready() else None
+        return PineconeVectorStore(self.index_name, self.api_key, host=self.host, client=client,
+                                   namespace=namespace)
+
+    def _scoped(self, payload):
+        if self.namespace:
+            payload["namespace"] = self.namespace
+        return payload
+
+    def _lookup_host(self):
+        state_key = f"pinecone_host:{self.index_name}"
+        host = load_state(state_key)
+        if host:
+            return host
+        try:
+            resp = control_plane(self.api_key).send("GET", f"indexes/{self.index_name}")
+            if resp.status_code == 200:
+                host = resp.json()['host']
+                print(f"✅ Connected to Pinecone Index: {host}")
+                save_state(state_key, host)
+                return host
+            print(f"❌ Failed to find Pinecone Index '{self.index_name}'. Run setup first.")
+        except Exception as e:
+            print(f"Error connecting to Pinecone: {e}")
+        return None
+
+    def is_ready(self):
+        return self.host is not None
+
+    def query(self, vector, top_k=2, filter=None):
+        filter = normalize_filter(filter)
+        payload = self._scoped({
+            "vector": list(map(float, vector)),
+            "topK": top_k,
+            "includeMetadata": True
+        })
+        if filter:
+            payload["filter"] = pinecone_filter(filter)
+        key = (np.asarray(vector, dtype=np.float32).tobytes(), top_k, json.dumps(filter, sort_keys=True))
+        try:
+            matches = self.client.request("POST", "query", json=payload).get('matches', [])
+        except requests.RequestException as e:
+            return self._degraded(key, vector, top_k, filter, e)
+        if VECTOR_FALLBACK_CACHE > 0:
+            with self._recent_lock:
+                self._recent[key] = matches
+                self._recent.move_to_end(key)
+                while len(self._recent) > VECTOR_FALLBACK_CACHE:
+                    self._recent.popitem(last=False)
+        return matches
+
+    def _degraded(self, key, vector, top_k, filter, error):
+        with self._recent_lock:
+            cached = self._recent.get(key)
+        if cached is not None:
+            source, matches = "cache", cached
+        elif self.fallback is not None and self.fallback.is_ready():
+            source, matches = "local", self.fallback.query(vector, top_k=top_k, filter=filter)
+        else:
+            source, matches = "failed", None
+        with self._recent_lock:
+            self.fallbacks[source] += 1
+        if matches is None:
+            tracing.count("vector_fallbacks_total", source="none")
+            raise error
+        tracing.count("vector_fallbacks_total", source=source)
+        return matches
+
+    def upsert(self, vectors, batch_size=50):
+        # Pinecone supports max 2MB request, strict batching is safe
+        for i in range(0, len(vectors), batch_size):
+            batch = vectors[i:i+batch_size]
+            print(f"Upserting batch {i} to {i+len(batch)}...")
+            resp = self.client.send("POST", "vectors/upsert", json=self._scoped({"vectors": batch}),
+                                    timeout=PINECONE_WRITE_TIMEOUT)
+            if resp.status_code != 200:
+                print(f"❌ Upsert failed: {resp.text}")
+            else:
+                print(f"Batch {i} success: {resp.json()}")
+
+    def upsert_batch(self, batch):
+        # UpsertPipeline retries failed batches itself, so one attempt here
+        return self.client.request("POST", "vectors/upsert", json=self._scoped({"vectors": batch}),
+                                   timeout=PINECONE_WRITE_TIMEOUT, retries=0)
+
+    def delete(self, ids, batch_size=1000):
+        # Pinecone accepts at most 1000 IDs per delete request
+        ids = list(ids)
+        for i in range(0, len(ids), batch_size):
+            resp = self.client.send("POST", "vectors/delete", json=self._scoped({"ids": ids[i:i+batch_size]}),
+                                    timeout=PINECONE_WRITE_TIMEOUT)
+            if resp.status_code != 200:
+                print(f"❌ Delete failed: {resp.text}")
+
+    def list_ids(self, prefix=""):
+        # Paginated ID listing (serverless indexes only)
+        ids = []
+        params = self._scoped({"prefix": prefix})
+        while True:
+            data = self.client.request("GET", "vectors/list", params=params, timeout=PINECONE_WRITE_TIMEOUT)
+            ids.extend(v["id"] for v in data.get("vectors", []))
+            token = data.get("pagination", {}).get("next")
+            if not token:
+                return ids
+            params["paginationToken"] = token
+
+    def stats(self):
+        # Only report a client that already exists; stats must not trigger the host lookup
+        with self._recent_lock:
+            cached = len(self._recent)
+        return {"backend": self.name, "namespace": self.namespace,
+                "client": self._client.stats() if self._client is not None else None,
+                "fallbacks": dict(self.fallbacks), "cached_results": cached}
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process index: a row-normalized embedding matrix memory-mapped from <path>.npy,
+    with ids and metadata in <path>.json. Stored as float32, or int8 (scaled by 127)
+    to cut the file and page-cache footprint by 4x. Filtered queries score only the rows in
+    the filter's posting lists (row numbers per value of each LOCAL_INDEX_FACETS field).
+    """
+    name = "Local index"
+
+    def __init__(self, path=LOCAL_INDEX_PATH, dtype=LOCAL_INDEX_DTYPE, namespace=""):
+        self.base_path = path
+        self.namespace = namespace
+        self.path = local_index_path(path, namespace)
+        self.dtype = dtype
+        self.matrix = None
+        self.ids = []
+        self.metadata = []
+        self._lock = threading.RLock()
+        self._pending = None    # dense matrix held in memory while writes are deferred
+        self._postings = None   # {field: {value: sorted row numbers}}, built on first filtered query
+        self.load()
+
+    @property
+    def matrix_file(self):
+        return f"{self.path}.npy"
+
+    @property
+    def meta_file(self):
+        return f"{self.path}.json"
+
+    def load(self):
+        if not (os.path.exists(self.matrix_file) and os.path.exists(self.meta_file)):
+            return
+        with open(self.meta_file, "r") as f:
+            meta = json.load(f)
+        self.dtype = meta.get("dtype", self.dtype)
+        self.ids = meta["ids"]
+        self.metadata = meta["metadata"]
+        self.matrix = np.load(self.matrix_file, mmap_mode="r")
+        self._postings = None
+
+    def is_ready(self):
+        return self.matrix is not None and len(self.ids) > 0
+
+    def _encode_rows(self, values):
+        values = np.asarray(values, dtype=np.float32)
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values = values / np.maximum(norms, 1e-12)
+        if self.dtype == "int8":
+            return np.clip(np.round(values * INT8_SCALE), -INT8_SCALE, INT8_SCALE).astype(np.int8)
+        return values
+
+    def _dense_rows(self):
+        if self._pending is not None:
+            return self._pending
+        if self.matrix is None:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.int8 if self.dtype == "int8" else np.float32)
+        return np.array(self.matrix)
+
+    def _commit(self, matrix):
+        if self._pending is not None:
+            self._pending = matrix
+        else:
+            self.save(matrix)
+
+    @contextmanager
+    def deferred_writes(self):
+        """Batches many upserts/deletes into one file rewrite at the end (bulk indexing)."""
+        with self._lock:
+            self._pending = self._dense_rows()
+        try:
+            # Not holding the lock here: upserts may come from pipeline worker threads
+            yield self
+        finally:
+            with self._lock:
+                matrix, self._pending = self._pending, None
+                self.save(matrix)
+
+    def save(self, matrix):
+        # Write to temp files and swap in, so readers never map a half-written index
+        tmp_matrix = f"{self.path}.tmp.npy"
+        tmp_meta = f"{self.meta_file}.tmp"
+        np.save(tmp_matrix, matrix)
+        with open(tmp_meta, "w") as f:
+            json.dump({"dtype": self.dtype, "dim": int(matrix.shape[1]), "ids": self.ids, "metadata": self.metadata}, f)
+        os.replace(tmp_matrix, self.matrix_file)
+        os.replace(tmp_meta, self.meta_file)
+        self.matrix = np.load(self.matrix_file, mmap_mode="r")
+        self._postings = None
+
+    @property
+    def postings(self):
+        if self._postings is None:
+            with self._lock:
+                if self._postings is None:
+                    rows = {field: {} for field in LOCAL_INDEX_FACETS}
+                    for i, metadata in enumerate(self.metadata):
+                        for field, by_value in rows.items():
+                            if field in metadata:
+                                by_value.setdefault(metadata[field], []).append(i)
+                    self._postings = {field: {value: np.array(r, dtype=np.int64) for value, r in by_value.items()}
+                                      for field, by_value in rows.items()}
+        return self._postings
+
+    def _matching_rows(self, filter):
+        """
+        Sorted row numbers matching every field of filter: per field the union of its values'
+        lists, then the intersection across fields, led by the shortest list so the cost tracks
+        the narrowest facet rather than the corpus.
+        """
+        postings = self.postings
+        per_field = []
+        for field, values in filter.items():
+            if field in postings:
+                lists = [postings[field][v] for v in values if v in postings[field]]
+                # A row has one value per field, so the lists are disjoint
+                rows = lists[0] if len(lists) == 1 else np.sort(np.concatenate(lists or [np.empty(0, np.int64)]))
+            else:
+                rows = np.array([i for i, m in enumerate(self.metadata) if m.get(field) in values], dtype=np.int64)
+            per_field.append(rows)
+        per_field.sort(key=len)
+        rows = per_field[0]
+        for other in per_field[1:]:
+            if not len(rows):
+                break
+            # Binary-search the survivors in the longer list instead of merging both
+            at = np.minimum(np.searchsorted(other, rows), len(other) - 1)
+            rows = rows[other[at] == rows]
+        return rows
+
+    def query(self, vector, top_k=2, filter=None):
+        if not self.is_ready():
+            return []
+
+        q = np.asarray(vector, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+
+        # 1. Score every row (or only the filter's rows) with a single matmul (cosine, rows are pre-normalized)
+        filter = normalize_filter(filter)
+        if filter:
+            rows = self._matching_rows(filter)
+            if not len(rows):
+                return []
+            scores = self.matrix[rows] @ q
+        else:
+            rows = None
+            scores = self.matrix @ q
+        if self.dtype == "int8":
+            scores = scores / INT8_SCALE
+
+        # 2. Top-k without a full sort
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            {"id": self.ids[i], "score": float(scores[j]), "metadata": self.metadata[i]}
+            for j, i in zip(top, top if rows is None else rows[top])
+        ]
+
+    def upsert(self, vectors):
+        if not vectors:
+            return
+        with self._lock:
+            matrix = self._dense_rows()
+            positions = {vid: i for i, vid in enumerate(self.ids)}
+            new_rows = self._encode_rows([v["values"] for v in vectors])
+
+            appended = []
+            for v, row in zip(vectors, new_rows):
+                i = positions.get(v["id"])
+                if i is not None:
+                    matrix[i] = row
+                    self.metadata[i] = v.get("metadata", {})
+                else:
+                    positions[v["id"]] = len(self.ids)
+                    self.ids.append(v["id"])
+                    self.metadata.append(v.get("metadata", {}))
+                    appended.append(row)
+
+            if appended:
+                matrix = np.vstack([matrix, np.stack(appended)])
+            self._postings = None
+            self._commit(matrix)
+            if self._pending is None:
+                print(f"✅ Local index now holds {len(self.ids)} vectors ({self.dtype}) at {self.matrix_file}")
+
+    def delete(self, ids):
+        drop = set(ids)
+        with self._lock:
+            if not drop or not self.ids:
+                return
+            keep = [i for i, vid in enumerate(self.ids) if vid not in drop]
+            matrix = self._dense_rows()[keep]
+            self.ids = [self.ids[i] for i in keep]
+            self.metadata = [self.metadata[i] for i in keep]
+            self._postings = None
+            self._commit(matrix)
+
+    def list_ids(self, prefix=""):
+        return [vid for vid in self.ids if vid.startswith(prefix)]
+
+    def for_namespace(self, namespace):
+        return LocalVectorStore(self.base_path, self.dtype, namespace=namespace)
+
+
+def normalize_filter(filter):
+    """{"year": 2019, "country": ["de", "at"], "category": None} -> {"year": [2019], "country": ["de", "at"]}."""
+    normalized = {}
+    for field, value in (filter or {}).items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        values = sorted({v for v in values if v is not None}, key=str)
+        if values:
+            normalized[field] = values
+    return normalized
+
+
+def pinecone_filter(filter):
+    """A normalized filter in Pinecone's metadata filter language."""
+    clauses = [{field: {"$eq": values[0]} if len(values) == 1 else {"$in": values}}
+               for field, values in filter.items()]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def local_index_path(path, namespace=""):
+    # Each namespace is its own pair of files: vector_index.npy, vector_index.receipts.npy, ...
+    return f"{path}.{namespace}" if namespace else path
+
+
+_control_plane = {}
+_control_plane_lock = threading.Lock()
+
+
+def control_plane(api_key=PINECONE_KEY):
+    """Shared client for api.pinecone.io (index listing, creation, host lookups)."""
+    with _control_plane_lock:
+        if api_key not in _control_plane:
+            _control_plane[api_key] = PineconeClient(CONTROL_PLANE_URL, api_key, timeout=PINECONE_WRITE_TIMEOUT)
+        return _control_plane[api_key]
+
+
+def get_vector_store(backend=None, namespace=""):
+    backend = (backend or VECTOR_BACKEND).lower()
+    if backend == "local":
+        return LocalVectorStore(namespace=namespace)
+    if backend == "pinecone":
+        return PineconeVectorStore(namespace=namespace)
+    raise ValueError(f"Unknown VECTOR_BACKEND '{backend}'. Use 'pinecone' or 'local'.")